@@ -0,0 +1,206 @@
+# chats/access_log.py
+"""
+Queued access logging.
+
+Request threads only put records on a bounded in-memory queue through a
+``QueueHandler``; a ``QueueListener`` thread drains it into a rotating file
+handler that writes lines in batches. File I/O, including rollovers and
+slow disks, therefore never runs on a request thread. When the queue is
+full, records are dropped and counted instead of blocking the request;
+``dropped()`` reports how many.
+
+Settings (all optional) come from ``settings.ACCESS_LOG``::
+
+    ACCESS_LOG = {
+        'PATH': 'requests.log',
+        'MAX_BYTES': 10 * 1024 * 1024,   # rotate at this size...
+        'ROTATE_INTERVAL': 24 * 60 * 60, # ...or when the file is this old (seconds)
+        'BACKUP_COUNT': 5,
+        'BATCH_SIZE': 100,               # lines per write
+        'FLUSH_INTERVAL': 1.0,           # max seconds a line waits under load
+        'QUEUE_SIZE': 10000,
+    }
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+
+LOGGER_NAME = 'chats.access'
+
+DEFAULTS = {
+    'PATH': 'requests.log',
+    'MAX_BYTES': 10 * 1024 * 1024,
+    'ROTATE_INTERVAL': 24 * 60 * 60,
+    'BACKUP_COUNT': 5,
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL': 1.0,
+    'QUEUE_SIZE': 10000,
+}
+
+
+class BatchingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    ``RotatingFileHandler`` that buffers formatted lines and writes them in
+    one call once ``batch_size`` lines are pending or ``flush_interval``
+    seconds have passed, and on ``flush()``. Rolls over by size like its
+    parent and also once the current file is ``rotate_interval`` seconds old.
+    """
+
+    def __init__(self, filename, max_bytes=0, backup_count=0, rotate_interval=0,
+                 batch_size=100, flush_interval=1.0, encoding='utf-8'):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count,
+                         encoding=encoding, delay=True)
+        self.rotate_interval = rotate_interval
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._last_write = time.monotonic()
+        # When this handler started writing the current file. Not the file's
+        # mtime: every write refreshes that, so a busy log would never age
+        self._opened_at = time.monotonic()
+
+    def emit(self, record):
+        try:
+            self._pending.append(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+            return
+        if (len(self._pending) >= self.batch_size
+                or time.monotonic() - self._last_write >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self._pending:
+                return
+            batch = ''.join(self._pending)
+            self._pending = []
+            self._last_write = time.monotonic()
+            try:
+                if self._batch_needs_rollover(batch):
+                    self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+                self.stream.write(batch)
+                self.stream.flush()
+            except Exception:
+                self.handleError(None)
+
+    def doRollover(self):
+        super().doRollover()
+        self._opened_at = time.monotonic()
+
+    def close(self):
+        self.flush()
+        super().close()
+
+    def _batch_needs_rollover(self, batch):
+        # See bpo-45401: never roll over anything other than a regular file
+        if os.path.exists(self.baseFilename) and not os.path.isfile(self.baseFilename):
+            return False
+        if self.rotate_interval and time.monotonic() - self._opened_at >= self.rotate_interval:
+            return os.path.exists(self.baseFilename)
+        if self.maxBytes > 0:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.seek(0, 2)
+            return 0 < self.stream.tell() and self.stream.tell() + len(batch) >= self.maxBytes
+        return False
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """``QueueHandler`` that drops records when the queue is full, counting them"""
+
+    def __init__(self, records):
+        super().__init__(records)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+class FlushingQueueListener(logging.handlers.QueueListener):
+    """``QueueListener`` that flushes its handlers whenever the queue runs dry"""
+
+    def dequeue(self, block):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            if not block:
+                raise
+        for handler in self.handlers:
+            handler.flush()
+        return self.queue.get()
+
+
+_lock = threading.Lock()
+_listener = None
+
+
+def get_logger():
+    """
+    The access logger, with the queue and listener set up on first use.
+
+    Safe to call from every middleware instance: the handlers are attached
+    once per process, so lines are never written twice.
+    """
+    global _listener
+    logger = logging.getLogger(LOGGER_NAME)
+    with _lock:
+        if _listener is None:
+            options = {**DEFAULTS, **getattr(settings, 'ACCESS_LOG', {})}
+            file_handler = BatchingRotatingFileHandler(
+                options['PATH'],
+                max_bytes=options['MAX_BYTES'],
+                backup_count=options['BACKUP_COUNT'],
+                rotate_interval=options['ROTATE_INTERVAL'],
+                batch_size=options['BATCH_SIZE'],
+                flush_interval=options['FLUSH_INTERVAL'],
+            )
+            file_handler.setFormatter(logging.Formatter('%(message)s'))
+
+            records = queue.Queue(maxsize=options['QUEUE_SIZE'])
+            logger.addHandler(DroppingQueueHandler(records))
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+
+            _listener = FlushingQueueListener(records, file_handler)
+            _listener.start()
+            atexit.register(shutdown)
+    return logger
+
+
+def dropped():
+    """Records dropped on a full queue since the logger was set up"""
+    return sum(
+        handler.dropped
+        for handler in logging.getLogger(LOGGER_NAME).handlers
+        if isinstance(handler, DroppingQueueHandler)
+    )
+
+
+def shutdown():
+    """Write everything still queued and stop the listener thread"""
+    global _listener
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        logger = logging.getLogger(LOGGER_NAME)
+        for handler in list(logger.handlers):
+            if isinstance(handler, DroppingQueueHandler):
+                logger.removeHandler(handler)
+        _listener = None
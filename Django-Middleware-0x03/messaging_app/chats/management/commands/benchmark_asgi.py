@@ -0,0 +1,150 @@
+import asyncio
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.http import JsonResponse
+from django.test.utils import override_settings
+from django.urls import path
+
+from chats import access_log
+
+MIDDLEWARE_PATH = 'chats.middleware.RequestLoggingMiddleware'
+
+
+async def ping(request):
+    return JsonResponse({'ok': True})
+
+
+def sync_ping(request):
+    return JsonResponse({'ok': True})
+
+
+# URLconf of the benchmark. With the async view, every thread hop measured
+# comes from the middleware stack; the sync view adds the one hop a DRF
+# view costs under ASGI.
+urlpatterns = [path('ping/', ping), path('sync-ping/', sync_ping)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure what RequestLoggingMiddleware costs under ASGI: throughput "
+        "without and with it, alone and within settings.MIDDLEWARE, driving "
+        "Django's ASGIHandler in-process. Note that Django runs the hooks of "
+        "MiddlewareMixin-based middleware through sync_to_async in an async "
+        "stack, so an async-capable logger only pays off once those are "
+        "async-native too."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Requests per run (default: 2000)')
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='Requests in flight at once (default: 50)')
+        parser.add_argument('--view', choices=['async', 'sync'], default='async',
+                            help='Kind of view to request (default: async)')
+
+    def handle(self, *args, **options):
+        requests, concurrency = options['requests'], options['concurrency']
+        if requests <= 0 or concurrency <= 0:
+            raise CommandError('--requests and --concurrency must be positive')
+        if MIDDLEWARE_PATH not in settings.MIDDLEWARE:
+            raise CommandError(f'{MIDDLEWARE_PATH} is not in MIDDLEWARE')
+
+        self.path = '/ping/' if options['view'] == 'async' else '/sync-ping/'
+        full_stack = list(settings.MIDDLEWARE)
+        comparisons = [
+            ('middleware alone', [], [MIDDLEWARE_PATH]),
+            ('full MIDDLEWARE', [m for m in full_stack if m != MIDDLEWARE_PATH], full_stack),
+        ]
+        self.stdout.write(
+            f"{requests} requests to the {options['view']} view, concurrency {concurrency}"
+        )
+        with tempfile.TemporaryDirectory() as log_dir:
+            # Unlimited: every request comes from the same client
+            with override_settings(ROOT_URLCONF=__name__,
+                                   ACCESS_LOG={'PATH': f'{log_dir}/requests.log'},
+                                   RATE_LIMIT={'DEFAULT': None, 'ROUTES': []}):
+                for label, before, after in comparisons:
+                    self.stdout.write(f"{label}:")
+                    baseline = self.report('without', before, requests, concurrency)
+                    self.report('with logging', after, requests, concurrency, baseline)
+            access_log.shutdown()
+
+    def report(self, label, middleware, requests, concurrency, baseline=None):
+        throughput, p50, p99 = self.run(middleware, requests, concurrency)
+        self.stdout.write(
+            f"  {label:>14}: {throughput:8.1f} req/s  p50 {p50 * 1000:6.2f}ms  "
+            f"p99 {p99 * 1000:6.2f}ms  ({throughput / (baseline or throughput):4.2f}x)"
+        )
+        return throughput
+
+    def run(self, middleware, requests, concurrency):
+        with override_settings(MIDDLEWARE=middleware):
+            handler = ASGIHandler()
+        return asyncio.run(self.load(handler, requests, concurrency))
+
+    async def load(self, handler, requests, concurrency):
+        # Warm up: the first requests pay for imports and URL resolution
+        for _ in range(10):
+            await self.request(handler)
+
+        latencies = []
+        remaining = [requests]
+
+        async def worker():
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                start = time.perf_counter()
+                status = await self.request(handler)
+                latencies.append(time.perf_counter() - start)
+                if status != 200:
+                    raise CommandError(f'{self.path} returned {status}')
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        return (
+            requests / elapsed,
+            latencies[len(latencies) // 2],
+            latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)],
+        )
+
+    async def request(self, handler):
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': self.path,
+            'raw_path': self.path.encode(),
+            'query_string': b'',
+            'root_path': '',
+            'headers': [(b'host', b'localhost')],
+            'client': ('127.0.0.1', 50000),
+            'server': ('localhost', 80),
+        }
+        body_sent = False
+        disconnect = asyncio.Event()
+        status = None
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+
+        await handler(scope, receive, send)
+        disconnect.set()
+        return status
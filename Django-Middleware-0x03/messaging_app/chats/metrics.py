@@ -0,0 +1,214 @@
+# chats/metrics.py
+"""
+Request metrics, exposed on ``/metrics`` in the Prometheus text format.
+
+Per view (URL name), method and status class: request counters and
+fixed-bucket latency histograms; per view and method: SQL query counts and
+DB time; plus the number of requests in flight, of throttled requests and
+of access log lines dropped on a full queue.
+The URL name and method together identify the DRF action
+(``conversation-list`` + ``POST`` is ``create``). Methods outside
+``METHODS`` are counted as ``other``, so clients cannot create series.
+
+Scrapers authenticate with ``Authorization: Bearer <settings.METRICS_TOKEN>``;
+without the setting the endpoint does not exist. A token rather than a
+client address: behind a reverse proxy every request comes from the
+proxy's address.
+
+Recording is meant to stay on permanently. Every thread records into its
+own shard without taking a lock, series are preallocated per view, and a
+histogram observation is a bisect plus a few increments on existing
+lists, so no label tuples or other objects are created per request. The
+registry lock is only taken when a thread records for the first time and
+when ``/metrics`` is rendered. Shards of finished threads are folded into
+one retired shard, so a thread-per-connection server does not leak them.
+"""
+import hmac
+import threading
+from bisect import bisect_left
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+from . import access_log
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATUS_CLASSES = ('1xx', '2xx', '3xx', '4xx', '5xx')
+UNMATCHED = 'unmatched'
+METHODS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE'})
+OTHER_METHOD = 'other'
+
+
+class ViewSeries:
+    """All series of one view and method in one shard"""
+    __slots__ = ('buckets', 'sums', 'db_queries', 'db_seconds')
+
+    def __init__(self):
+        # Per status class: one count per bucket plus one for +Inf
+        self.buckets = [[0] * (len(BUCKETS) + 1) for _ in STATUS_CLASSES]
+        self.sums = [0.0] * len(STATUS_CLASSES)
+        self.db_queries = 0
+        self.db_seconds = 0.0
+
+    def merge(self, other):
+        for mine, theirs in zip(self.buckets, other.buckets):
+            for i, count in enumerate(theirs):
+                mine[i] += count
+        for i, total in enumerate(other.sums):
+            self.sums[i] += total
+        self.db_queries += other.db_queries
+        self.db_seconds += other.db_seconds
+
+
+class Shard:
+    """The metrics recorded by one thread"""
+    __slots__ = ('views', 'in_flight', 'throttled')
+
+    def __init__(self):
+        self.views = {}  # view -> {method: ViewSeries}
+        self.in_flight = 0
+        self.throttled = 0
+
+    def merge(self, other):
+        for view, methods in list(other.views.items()):
+            mine = self.views.setdefault(view, {})
+            for method, series in list(methods.items()):
+                mine.setdefault(method, ViewSeries()).merge(series)
+        self.in_flight += other.in_flight
+        self.throttled += other.throttled
+
+
+class Registry:
+    """Per-thread shards, merged when read"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []  # (thread, shard)
+        self._retired = Shard()
+
+    def shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = Shard()
+            with self._lock:
+                self._retire_finished()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def request_started(self):
+        self.shard().in_flight += 1
+
+    def request_finished(self, view, method, status, duration, db_queries, db_seconds):
+        shard = self.shard()
+        shard.in_flight -= 1
+        if method not in METHODS:
+            method = OTHER_METHOD
+        methods = shard.views.get(view)
+        if methods is None:
+            methods = shard.views[view] = {}
+        series = methods.get(method)
+        if series is None:
+            series = methods[method] = ViewSeries()
+        status_class = min(max(status // 100, 1), 5) - 1
+        series.buckets[status_class][bisect_left(BUCKETS, duration)] += 1
+        series.sums[status_class] += duration
+        series.db_queries += db_queries
+        series.db_seconds += db_seconds
+
+    def throttled(self):
+        self.shard().throttled += 1
+
+    def snapshot(self):
+        """All shards merged into one"""
+        total = Shard()
+        with self._lock:
+            self._retire_finished()
+            total.merge(self._retired)
+            for _, shard in self._shards:
+                total.merge(shard)
+        return total
+
+    def _retire_finished(self):
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._retired.merge(shard)
+        self._shards = live
+
+    def render(self):
+        """Prometheus text exposition of the current values"""
+        total = self.snapshot()
+        lines = [
+            '# HELP chats_http_requests_total Requests by view, method and status class.',
+            '# TYPE chats_http_requests_total counter',
+        ]
+        series_list = [
+            (f'view="{view}",method="{method}"', series)
+            for view, methods in sorted(total.views.items())
+            for method, series in sorted(methods.items())
+        ]
+        for labels, series in series_list:
+            for status_class, buckets in zip(STATUS_CLASSES, series.buckets):
+                if any(buckets):
+                    lines.append(
+                        f'chats_http_requests_total{{{labels},status="{status_class}"}} '
+                        f'{sum(buckets)}'
+                    )
+
+        lines += [
+            '# HELP chats_http_request_duration_seconds Request latency by view, method and status class.',
+            '# TYPE chats_http_request_duration_seconds histogram',
+        ]
+        for series_labels, series in series_list:
+            for status_class, buckets, total_seconds in zip(
+                STATUS_CLASSES, series.buckets, series.sums
+            ):
+                if not any(buckets):
+                    continue
+                labels = f'{series_labels},status="{status_class}"'
+                cumulative = 0
+                for bound, count in zip((*BUCKETS, '+Inf'), buckets):
+                    cumulative += count
+                    lines.append(
+                        f'chats_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} '
+                        f'{cumulative}'
+                    )
+                lines.append(f'chats_http_request_duration_seconds_sum{{{labels}}} {total_seconds}')
+                lines.append(f'chats_http_request_duration_seconds_count{{{labels}}} {cumulative}')
+
+        lines += [
+            '# HELP chats_db_queries_total SQL queries run by view and method.',
+            '# TYPE chats_db_queries_total counter',
+            *(f'chats_db_queries_total{{{labels}}} {series.db_queries}'
+              for labels, series in series_list),
+            '# HELP chats_db_seconds_total Time spent in SQL queries by view and method.',
+            '# TYPE chats_db_seconds_total counter',
+            *(f'chats_db_seconds_total{{{labels}}} {series.db_seconds}'
+              for labels, series in series_list),
+            '# HELP chats_http_requests_in_flight Requests being handled.',
+            '# TYPE chats_http_requests_in_flight gauge',
+            f'chats_http_requests_in_flight {total.in_flight}',
+            '# HELP chats_http_throttled_total Requests rejected by the rate limiter.',
+            '# TYPE chats_http_throttled_total counter',
+            f'chats_http_throttled_total {total.throttled}',
+            '# HELP chats_access_log_dropped_total Access log lines dropped on a full queue.',
+            '# TYPE chats_access_log_dropped_total counter',
+            f'chats_access_log_dropped_total {access_log.dropped()}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def metrics_view(request):
+    """``/metrics``, served to requests bearing ``settings.METRICS_TOKEN`` only"""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not token or not hmac.compare_digest(header.encode(), f'Bearer {token}'.encode()):
+        raise Http404
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4')
@@ -1,24 +1,341 @@
 # chats/middleware.py
-import logging
-from datetime import datetime
+import json
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import JsonResponse
 from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject, empty
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from . import access_log
+from .metrics import UNMATCHED, registry as metrics
+
+# The QueryTimer of the request being handled. A context variable rather
+# than a wrapper per connection: under ASGI the view's queries run on a
+# worker thread with its own connections, and asgiref copies the context
+# into that thread.
+current_queries = ContextVar('current_queries', default=None)
+
+
+class QueryTimer:
+    """Database execute wrapper counting queries and their total time"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+def time_queries(execute, sql, params, many, context):
+    queries = current_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    return queries(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    if time_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_queries)
+
 
 class RequestLoggingMiddleware:
+    """
+    Writes one JSON line per request to the access log: latency, view,
+    status, response size, SQL query count and DB time. The same timings
+    go out in a ``Server-Timing`` header for browser devtools, and into
+    the request metrics served on ``/metrics``.
+
+    Belongs first in ``settings.MIDDLEWARE``: the timings then cover every
+    other middleware, and requests answered before the view (such as
+    ``RateLimitMiddleware``'s 429s) are logged and counted as well.
+
+    Sync only, deliberately: under ASGI, Django then runs the stack of
+    ``settings.MIDDLEWARE`` and the view in one thread hop. An async-capable
+    logger first in the stack would make Django run the stack async, and
+    each MiddlewareMixin-based entry below it would then cost a hop per
+    hook. An async variant, measured with ``manage.py benchmark_asgi``, was
+    no faster with the full stack (about 1.0x throughput, worse p99) and was
+    removed. Revisit once the other middleware is async-native.
+    """
+    sync_capable = True
+    async_capable = False
+
     def __init__(self, get_response):
         self.get_response = get_response
-        self.logger = logging.getLogger(__name__)
+        # Queued: the file is written by a background thread, in batches
+        self.logger = access_log.get_logger()
+        # Connections opened before this module was imported (e.g. by
+        # startup checks) missed connection_created
+        for connection in connections.all(initialized_only=True):
+            install_query_timer(sender=None, connection=connection)
+
+    def __call__(self, request):
+        metrics.request_started()
+        queries = QueryTimer()
+        token = current_queries.set(queries)
+        start = time.perf_counter()
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            current_queries.reset(token)
+            duration = time.perf_counter() - start
+            # Also when get_response raised, or the in-flight gauge would leak
+            metrics.request_finished(
+                view_name(request) or UNMATCHED, request.method,
+                500 if response is None else response.status_code,
+                duration, queries.count, queries.duration,
+            )
+        return self.log(request, response, duration, queries)
+
+    def log(self, request, response, duration, queries):
+        response['Server-Timing'] = server_timing(duration, queries)
+        self.logger.info(json.dumps(
+            access_record(request, response, duration, queries),
+            separators=(',', ':'),
+            default=str,
+        ))
+        return response
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    return match.view_name or match._func_path
+
+
+def response_size(response):
+    if response.streaming:
+        return None
+    return len(response.content)
+
+
+def resolved_user(request):
+    """
+    The request's user if something already resolved it, else None.
+
+    Read after the view ran: DRF authenticates JWTs inside the view and
+    stores the user on the underlying request. A session user nobody asked
+    for stays unresolved, since loading it would cost a query (and is not
+    allowed on the event loop).
+    """
+    user = getattr(request, 'user', None)
+    if isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+        return None
+    return user
 
-        # Configure logging to file
-        handler = logging.FileHandler('requests.log')
-        formatter = logging.Formatter('%(message)s')
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
-        self.logger.setLevel(logging.INFO)
+
+def access_record(request, response, duration, queries):
+    user = resolved_user(request)
+    return {
+        'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        'method': request.method,
+        'path': request.path,
+        'view': view_name(request),
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 2),
+        'db_queries': queries.count,
+        'db_ms': round(queries.duration * 1000, 2),
+        'bytes': response_size(response),
+        'user': str(user.pk) if user is not None and user.is_authenticated else None,
+    }
+
+
+def server_timing(duration, queries):
+    app = max(duration - queries.duration, 0)
+    return (
+        f'db;dur={queries.duration * 1000:.2f};desc="{queries.count} queries", '
+        f'app;dur={app * 1000:.2f}, '
+        f'total;dur={duration * 1000:.2f}'
+    )
+
+
+RATE_LIMIT_DEFAULTS = {
+    'DEFAULT': '600/min',
+    'ROUTES': [],
+    'MAX_KEYS': 100000,
+    'NUM_PROXIES': None,
+}
+# Period names accepted in rates, in seconds
+PERIODS = {
+    's': 1, 'sec': 1, 'second': 1,
+    'm': 60, 'min': 60, 'minute': 60,
+    'h': 3600, 'hour': 3600,
+    'd': 86400, 'day': 86400,
+}
+
+
+def parse_rate(rate):
+    """
+    ``'30/min'`` -> ``(capacity, tokens per second)``; periods are those of
+    ``PERIODS``. None means unlimited.
+    """
+    if rate is None:
+        return None, None
+    count, _, period = rate.partition('/')
+    if not count.isdigit() or int(count) == 0 or period not in PERIODS:
+        raise ImproperlyConfigured(
+            f"Invalid rate {rate!r} in RATE_LIMIT: expected '<requests>/<period>' "
+            f"with a period among {', '.join(PERIODS)}"
+        )
+    count = int(count)
+    return count, count / PERIODS[period]
+
+
+class TokenBucketLimiter:
+    """
+    Token buckets by key, kept in an LRU of at most ``max_keys`` entries.
+
+    Each check is O(1) and allocates nothing for known keys. Under a flood
+    of new keys (IP spraying), the least recently seen buckets are evicted,
+    so memory stays bounded; an evicted client just starts a full bucket.
+    """
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, last refill]
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, refill_rate, now=None):
+        """Take one token; returns 0 if allowed, else seconds until one is available"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [capacity, now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / refill_rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RateLimitMiddleware:
+    """
+    Token-bucket rate limiting per user (valid JWT) or per client IP, with
+    per-route limits from ``settings.RATE_LIMIT``::
+
+        RATE_LIMIT = {
+            'DEFAULT': '600/min',
+            # (methods or None, path regex, rate or None): first match wins
+            'ROUTES': [('POST', r'^/api/conversations/[^/]+/messages/$', '30/min')],
+            'MAX_KEYS': 100000,
+            # Reverse proxies in front of the app; None trusts REMOTE_ADDR
+            'NUM_PROXIES': None,
+        }
+
+    Runs before sessions, authentication and the view: a throttled request
+    gets a 429 with ``Retry-After`` without any database work.
+
+    A request with a valid access token is limited per user. Its signature
+    is verified on every request (an HMAC, no database), so a forged token
+    cannot pick someone else's bucket. Other requests are limited per
+    client IP: ``REMOTE_ADDR`` by default, which behind a reverse proxy is
+    the proxy's. With ``NUM_PROXIES = n``, the client is the address the
+    outermost of the ``n`` trusted proxies appended to ``X-Forwarded-For``,
+    as in DRF's throttles; entries further left are client-supplied and
+    ignored. Set it to exactly the number of proxies: a larger value lets
+    clients choose their key.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        options = {**RATE_LIMIT_DEFAULTS, **getattr(settings, 'RATE_LIMIT', {})}
+        self.default = parse_rate(options['DEFAULT'])
+        self.routes = [
+            (
+                index,
+                frozenset(methods.split()) if isinstance(methods, str) else methods,
+                re.compile(pattern),
+                parse_rate(rate),
+            )
+            for index, (methods, pattern, rate) in enumerate(options['ROUTES'])
+        ]
+        self.limiter = TokenBucketLimiter(options['MAX_KEYS'])
+        self.num_proxies = options['NUM_PROXIES']
+        self.jwt = JWTAuthentication()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        user = request.user if request.user.is_authenticated else 'AnonymousUser'
-        path = request.path
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.logger.info(f"{timestamp} - User: {user} - Path: {path}")
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.throttle(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.throttle(request) or await self.get_response(request)
+
+    def throttle(self, request):
+        scope, (capacity, refill_rate) = self.limit_for(request)
+        if capacity is None:
+            return None
+        wait = self.limiter.consume((scope, self.client_key(request)), capacity, refill_rate)
+        if not wait:
+            return None
+        metrics.throttled()
+        retry_after = math.ceil(wait)
+        response = JsonResponse(
+            {'detail': f'Request was throttled. Expected available in {retry_after} seconds.'},
+            status=429,
+        )
+        response['Retry-After'] = str(retry_after)
+        return response
+
+    def limit_for(self, request):
+        for index, methods, pattern, limit in self.routes:
+            if (methods is None or request.method in methods) and pattern.match(request.path_info):
+                return index, limit
+        return 'default', self.default
+
+    def client_key(self, request):
+        header = self.jwt.get_header(request)
+        if header is not None:
+            try:
+                raw_token = self.jwt.get_raw_token(header)
+                if raw_token is not None:
+                    token = self.jwt.get_validated_token(raw_token)
+                    return f'user:{token[jwt_settings.USER_ID_CLAIM]}'
+            except (AuthenticationFailed, KeyError):
+                pass
+        return f'ip:{self.client_ip(request)}'
 
-        return self.get_response(request)
+    def client_ip(self, request):
+        remote_addr = request.META.get('REMOTE_ADDR', '')
+        forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+        if not self.num_proxies or not forwarded_for:
+            return remote_addr
+        addresses = [address.strip() for address in forwarded_for.split(',')]
+        return addresses[-min(self.num_proxies, len(addresses))]
@@ -1,3 +1,578 @@
-from django.test import TestCase
+import asyncio
+import json
+import logging
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+from datetime import datetime
+from unittest.mock import patch
 
-# Create your tests here.
+import uuid
+
+from django.core.exceptions import ImproperlyConfigured
+from django.http import Http404, HttpResponse, JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from django.urls import path
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import access_log
+from .metrics import Registry, metrics_view, registry
+from .middleware import (
+    RateLimitMiddleware, RequestLoggingMiddleware, TokenBucketLimiter, parse_rate,
+)
+from .models import User
+
+
+class Clock:
+    """Stand-in for the ``time`` module with a monotonic clock under test control"""
+
+    def __init__(self):
+        self.now = time.monotonic()
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return time.time()
+
+
+def record(message):
+    return logging.makeLogRecord({'msg': message, 'levelno': logging.INFO})
+
+
+class TempDirMixin:
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir = directory.name
+        self.path = os.path.join(self.dir, 'requests.log')
+
+    def read(self, suffix=''):
+        path = self.path + suffix
+        if not os.path.exists(path):
+            return []
+        with open(path, encoding='utf-8') as log:
+            return log.read().splitlines()
+
+
+class BatchingRotatingFileHandlerTests(TempDirMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.clock = Clock()
+        patcher = patch.object(access_log, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def handler(self, **options):
+        options = {'batch_size': 1, 'flush_interval': 60, **options}
+        handler = access_log.BatchingRotatingFileHandler(self.path, **options)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.addCleanup(handler.close)
+        return handler
+
+    def emit(self, handler, *messages):
+        for message in messages:
+            handler.handle(record(message))
+
+    def test_lines_are_written_in_batches(self):
+        handler = self.handler(batch_size=3)
+
+        self.emit(handler, 'a', 'b')
+        self.assertEqual(self.read(), [])
+        self.emit(handler, 'c', 'd')
+        self.assertEqual(self.read(), ['a', 'b', 'c'])
+
+        handler.flush()
+        self.assertEqual(self.read(), ['a', 'b', 'c', 'd'])
+
+    def test_pending_lines_are_written_once_the_flush_interval_passed(self):
+        handler = self.handler(batch_size=100, flush_interval=1)
+
+        self.emit(handler, 'a')
+        self.assertEqual(self.read(), [])
+        self.clock.now += 1
+        self.emit(handler, 'b')
+
+        self.assertEqual(self.read(), ['a', 'b'])
+
+    def test_rolls_over_by_size(self):
+        handler = self.handler(max_bytes=10, backup_count=2)
+
+        self.emit(handler, 'line-1', 'line-2', 'line-3', 'line-4')
+
+        self.assertEqual(self.read(), ['line-4'])
+        self.assertEqual(self.read('.1'), ['line-3'])
+        self.assertEqual(self.read('.2'), ['line-2'])
+        self.assertFalse(os.path.exists(self.path + '.3'))
+
+    def test_a_batch_is_never_split_across_files(self):
+        handler = self.handler(max_bytes=10, backup_count=1, batch_size=3)
+
+        self.emit(handler, 'line-1', 'line-2', 'line-3')
+
+        self.assertEqual(self.read(), ['line-1', 'line-2', 'line-3'])
+        self.assertFalse(os.path.exists(self.path + '.1'))
+
+    def test_rolls_over_by_age(self):
+        handler = self.handler(rotate_interval=60, backup_count=1)
+
+        self.emit(handler, 'old')
+        self.clock.now += 59
+        self.emit(handler, 'still current')
+        self.clock.now += 1
+        self.emit(handler, 'new')
+
+        self.assertEqual(self.read(), ['new'])
+        self.assertEqual(self.read('.1'), ['old', 'still current'])
+
+    def test_age_counts_from_opening_the_file_not_its_mtime(self):
+        with open(self.path, 'w', encoding='utf-8') as log:
+            log.write('from a previous run\n')
+        two_days_ago = time.time() - 2 * 24 * 60 * 60
+        os.utime(self.path, (two_days_ago, two_days_ago))
+        handler = self.handler(rotate_interval=24 * 60 * 60, backup_count=1)
+
+        self.emit(handler, 'appended')
+
+        self.assertEqual(self.read(), ['from a previous run', 'appended'])
+        self.clock.now += 24 * 60 * 60
+        self.emit(handler, 'next day')
+        self.assertEqual(self.read(), ['next day'])
+
+
+class DroppingQueueHandlerTests(SimpleTestCase):
+
+    def test_full_queue_drops_and_counts(self):
+        handler = access_log.DroppingQueueHandler(queue.Queue(maxsize=2))
+
+        for message in ('a', 'b', 'c', 'd'):
+            handler.handle(record(message))
+
+        self.assertEqual(handler.queue.qsize(), 2)
+        self.assertEqual(handler.dropped, 2)
+
+    def test_dropped_sums_the_access_logger_handlers(self):
+        handler = access_log.DroppingQueueHandler(queue.Queue(maxsize=1))
+        logger = logging.getLogger(access_log.LOGGER_NAME)
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        before = access_log.dropped() - handler.dropped
+
+        for message in ('a', 'b', 'c'):
+            handler.handle(record(message))
+
+        self.assertEqual(access_log.dropped() - before, 2)
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.flushed = threading.Event()
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+    def flush(self):
+        self.flushed.set()
+
+
+class FlushingQueueListenerTests(SimpleTestCase):
+
+    def test_flushes_whenever_the_queue_runs_dry(self):
+        records = queue.Queue()
+        handler = RecordingHandler()
+        listener = access_log.FlushingQueueListener(records, handler)
+        for message in ('a', 'b', 'c'):
+            records.put(record(message))
+
+        listener.start()
+        self.addCleanup(listener.stop)
+
+        self.assertTrue(handler.flushed.wait(5))
+        self.assertEqual(handler.messages, ['a', 'b', 'c'])
+
+        handler.flushed.clear()
+        records.put(record('d'))
+        self.assertTrue(handler.flushed.wait(5))
+        self.assertEqual(handler.messages, ['a', 'b', 'c', 'd'])
+
+
+class AccessLoggerTests(TempDirMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        access_log.shutdown()
+        self.addCleanup(access_log.shutdown)
+
+    def test_lines_reach_the_file_through_the_listener(self):
+        with override_settings(ACCESS_LOG={'PATH': self.path, 'BATCH_SIZE': 100}):
+            logger = access_log.get_logger()
+            self.assertIs(access_log.get_logger(), logger)
+        for i in range(3):
+            logger.info('line %d', i)
+
+        access_log.shutdown()
+
+        self.assertEqual(self.read(), ['line 0', 'line 1', 'line 2'])
+        self.assertFalse(any(
+            isinstance(handler, access_log.DroppingQueueHandler) for handler in logger.handlers
+        ))
+
+
+def count_users(request):
+    return JsonResponse({'users': User.objects.count(), 'any': User.objects.exists()})
+
+
+async def ping(request):
+    return JsonResponse({'ok': True})
+
+
+def whoami(request):
+    return JsonResponse({'user': str(request.user.pk)})
+
+
+urlpatterns = [
+    path('users/', count_users, name='count-users'),
+    path('ping/', ping, name='ping'),
+    path('me/', whoami, name='whoami'),
+]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class RequestLoggingMiddlewareTests(TempDirMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        access_log.shutdown()
+        self.addCleanup(access_log.shutdown)
+        settings = override_settings(ACCESS_LOG={'PATH': self.path, 'BATCH_SIZE': 1})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def records(self):
+        access_log.shutdown()
+        return [json.loads(line) for line in self.read()]
+
+    @override_settings(MIDDLEWARE=['chats.middleware.RequestLoggingMiddleware'])
+    def test_counts_the_queries_of_a_request(self):
+        response = self.client.get('/users/')
+
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+        [record] = self.records()
+        self.assertEqual(record['view'], 'count-users')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['db_queries'], 2)
+
+    def test_record_and_server_timing_of_a_request(self):
+        user = User.objects.create_user(
+            username='alice', email='alice@example.com', password='testpass123',
+            first_name='Alice', last_name='Smith',
+        )
+        self.client.force_login(user)
+
+        response = self.client.get('/me/?verbose=1')
+
+        [record] = self.records()
+        self.assertEqual(set(record), {
+            'time', 'method', 'path', 'view', 'status', 'duration_ms',
+            'db_queries', 'db_ms', 'bytes', 'user',
+        })
+        self.assertIsNotNone(datetime.fromisoformat(record['time']).tzinfo)
+        self.assertEqual(record['method'], 'GET')
+        self.assertEqual(record['path'], '/me/')
+        self.assertEqual(record['view'], 'whoami')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['bytes'], len(response.content))
+        self.assertEqual(record['user'], str(user.pk))
+        # The session and its user
+        self.assertEqual(record['db_queries'], 2)
+        self.assertGreaterEqual(record['duration_ms'], record['db_ms'])
+        self.assertGreaterEqual(record['db_ms'], 0)
+
+        timing = re.fullmatch(
+            r'db;dur=(\d+\.\d\d);desc="(\d+) queries", '
+            r'app;dur=(\d+\.\d\d), total;dur=(\d+\.\d\d)',
+            response['Server-Timing'],
+        )
+        self.assertIsNotNone(timing, response['Server-Timing'])
+        db, count, app, total = timing.groups()
+        self.assertEqual(int(count), record['db_queries'])
+        self.assertAlmostEqual(float(db), record['db_ms'], delta=0.01)
+        self.assertAlmostEqual(float(total), record['duration_ms'], delta=0.01)
+        self.assertAlmostEqual(float(db) + float(app), float(total), delta=0.02)
+
+    @override_settings(RATE_LIMIT={'DEFAULT': '1/min', 'ROUTES': []})
+    def test_throttled_requests_are_logged(self):
+        self.client.get('/ping/')
+        response = self.client.get('/ping/')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('total;dur=', response['Server-Timing'])
+        self.assertEqual(
+            [(record['view'], record['status']) for record in self.records()],
+            [('ping', 200), (None, 429)],
+        )
+
+    @override_settings(MIDDLEWARE=['chats.middleware.RequestLoggingMiddleware'])
+    def test_queries_outside_a_request_are_not_counted(self):
+        self.client.get('/users/')
+        User.objects.count()
+        self.client.get('/ping/')
+
+        self.assertEqual([record['db_queries'] for record in self.records()], [2, 0])
+
+    @override_settings(MIDDLEWARE=['chats.middleware.RequestLoggingMiddleware'])
+    async def test_sync_only_middleware_under_asgi(self):
+        response = await self.async_client.get('/users/')
+
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+
+    @override_settings(MIDDLEWARE=['chats.middleware.RequestLoggingMiddleware'])
+    async def test_concurrent_asgi_requests_are_counted_apart(self):
+        responses = await asyncio.gather(
+            self.async_client.get('/users/'),
+            self.async_client.get('/ping/'),
+            self.async_client.get('/users/'),
+        )
+
+        self.assertEqual([response.status_code for response in responses], [200] * 3)
+        records = sorted(self.records(), key=lambda record: record['view'])
+        self.assertEqual(
+            [(record['view'], record['db_queries']) for record in records],
+            [('count-users', 2), ('count-users', 2), ('ping', 0)],
+        )
+
+    def test_failed_requests_leave_the_in_flight_gauge(self):
+        def failing_view(request):
+            raise RuntimeError('boom')
+
+        middleware = RequestLoggingMiddleware(failing_view)
+        in_flight = registry.snapshot().in_flight
+
+        with self.assertRaises(RuntimeError):
+            middleware(RequestFactory().get('/ping/'))
+
+        self.assertEqual(registry.snapshot().in_flight, in_flight)
+        self.assertEqual(self.records(), [])
+
+
+class ParseRateTests(SimpleTestCase):
+
+    def test_periods(self):
+        self.assertEqual(parse_rate('5/s'), (5, 5))
+        self.assertEqual(parse_rate('30/min'), (30, 0.5))
+        self.assertEqual(parse_rate('30/minute'), (30, 0.5))
+        self.assertEqual(parse_rate('360/hour'), (360, 0.1))
+        self.assertEqual(parse_rate('864/d'), (864, 0.01))
+        self.assertEqual(parse_rate(None), (None, None))
+
+    def test_invalid_rates_are_configuration_errors(self):
+        for rate in ('5/xyz', '5/mo', '5/mins', '5/', '5', 'five/min', '-5/min', '0/min'):
+            with self.subTest(rate=rate), self.assertRaises(ImproperlyConfigured):
+                parse_rate(rate)
+
+
+class TokenBucketLimiterTests(SimpleTestCase):
+
+    def test_allows_a_burst_then_refills(self):
+        limiter = TokenBucketLimiter(max_keys=10)
+
+        self.assertEqual(limiter.consume('a', 2, 1.0, now=0), 0)
+        self.assertEqual(limiter.consume('a', 2, 1.0, now=0), 0)
+        self.assertEqual(limiter.consume('a', 2, 1.0, now=0), 1.0)
+        self.assertEqual(limiter.consume('a', 2, 1.0, now=0.5), 0.5)
+        self.assertEqual(limiter.consume('a', 2, 1.0, now=1.0), 0)
+        # Idle time refills up to the capacity, not beyond
+        self.assertEqual(limiter.consume('a', 2, 1.0, now=100), 0)
+        self.assertEqual(limiter.consume('a', 2, 1.0, now=100), 0)
+        self.assertGreater(limiter.consume('a', 2, 1.0, now=100), 0)
+
+    def test_keys_have_their_own_buckets(self):
+        limiter = TokenBucketLimiter(max_keys=10)
+
+        self.assertEqual(limiter.consume('a', 1, 1.0, now=0), 0)
+        self.assertGreater(limiter.consume('a', 1, 1.0, now=0), 0)
+        self.assertEqual(limiter.consume('b', 1, 1.0, now=0), 0)
+
+    def test_evicts_the_least_recently_used_key(self):
+        limiter = TokenBucketLimiter(max_keys=2)
+        limiter.consume('a', 1, 1.0, now=0)
+        limiter.consume('b', 1, 1.0, now=0)
+        limiter.consume('a', 1, 1.0, now=0)
+
+        limiter.consume('c', 1, 1.0, now=0)
+
+        self.assertEqual(len(limiter), 2)
+        # 'a' was kept, still empty; 'b' was evicted and starts a full bucket
+        self.assertGreater(limiter.consume('a', 1, 1.0, now=0), 0)
+        self.assertEqual(limiter.consume('b', 1, 1.0, now=0), 0)
+
+
+class RateLimitMiddlewareTests(SimpleTestCase):
+    factory = RequestFactory()
+
+    def middleware(self, **options):
+        with override_settings(RATE_LIMIT={'DEFAULT': '2/min', **options}):
+            return RateLimitMiddleware(lambda request: HttpResponse('ok'))
+
+    def statuses(self, middleware, count, method='get', path='/api/conversations/', **extra):
+        request = getattr(self.factory, method)
+        return [middleware(request(path, **extra)).status_code for _ in range(count)]
+
+    def bearer(self, user_id, tamper=False):
+        token = AccessToken()
+        token['user_id'] = str(user_id)
+        token = str(token)
+        if tamper:
+            token = token[:-2] + ('AA' if not token.endswith('AA') else 'BB')
+        return {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def test_throttled_requests_get_429_with_retry_after(self):
+        middleware = self.middleware()
+
+        self.assertEqual(self.statuses(middleware, 2), [200, 200])
+        response = middleware(self.factory.get('/api/conversations/'))
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+
+    def test_first_matching_route_wins(self):
+        middleware = self.middleware(ROUTES=[
+            ('POST', r'^/api/conversations/[^/]+/messages/$', '1/min'),
+            (None, r'^/api/conversations/', None),
+        ])
+
+        self.assertEqual(
+            self.statuses(middleware, 2, 'post', '/api/conversations/1/messages/'), [200, 429]
+        )
+        self.assertEqual(self.statuses(middleware, 5, 'get', '/api/conversations/1/messages/'),
+                         [200] * 5)
+        self.assertEqual(self.statuses(middleware, 3, 'get', '/api/users/'), [200, 200, 429])
+
+    def test_users_with_a_valid_token_have_their_own_buckets(self):
+        middleware = self.middleware()
+        alice, bob = uuid.uuid4(), uuid.uuid4()
+
+        self.assertEqual(self.statuses(middleware, 3, **self.bearer(alice)), [200, 200, 429])
+        self.assertEqual(self.statuses(middleware, 2, **self.bearer(bob)), [200, 200])
+        self.assertEqual(self.statuses(middleware, 2), [200, 200])
+
+    def test_forged_tokens_are_limited_by_ip(self):
+        middleware = self.middleware()
+        request = self.factory.get('/', **self.bearer(uuid.uuid4(), tamper=True))
+
+        self.assertEqual(middleware.client_key(request), 'ip:127.0.0.1')
+
+    def test_forwarded_for_is_ignored_without_trusted_proxies(self):
+        middleware = self.middleware()
+        request = self.factory.get('/', HTTP_X_FORWARDED_FOR='203.0.113.7')
+
+        self.assertEqual(middleware.client_key(request), 'ip:127.0.0.1')
+
+    def test_client_ip_behind_trusted_proxies(self):
+        forwarded_for = 'spoofed, 203.0.113.7, 10.0.0.2'
+
+        for num_proxies, expected in ((1, '10.0.0.2'), (2, '203.0.113.7'), (5, 'spoofed')):
+            with self.subTest(num_proxies=num_proxies):
+                middleware = self.middleware(NUM_PROXIES=num_proxies)
+                request = self.factory.get('/', HTTP_X_FORWARDED_FOR=forwarded_for)
+                self.assertEqual(middleware.client_key(request), f'ip:{expected}')
+
+
+class RegistryTests(SimpleTestCase):
+
+    def record(self, registry, view='conversation-list', method='GET', status=200,
+               duration=0.02, db_queries=3, db_seconds=0.004):
+        registry.request_started()
+        registry.request_finished(view, method, status, duration, db_queries, db_seconds)
+
+    def test_render(self):
+        registry = Registry()
+        self.record(registry)
+        self.record(registry, duration=0.3)
+        self.record(registry, status=404, duration=20, db_queries=1, db_seconds=0.001)
+        registry.request_started()
+        registry.throttled()
+
+        lines = registry.render().splitlines()
+
+        labels = 'view="conversation-list",method="GET"'
+        for line in (
+            f'chats_http_requests_total{{{labels},status="2xx"}} 2',
+            f'chats_http_requests_total{{{labels},status="4xx"}} 1',
+            f'chats_http_request_duration_seconds_bucket{{{labels},status="2xx",le="0.01"}} 0',
+            f'chats_http_request_duration_seconds_bucket{{{labels},status="2xx",le="0.025"}} 1',
+            f'chats_http_request_duration_seconds_bucket{{{labels},status="2xx",le="0.25"}} 1',
+            f'chats_http_request_duration_seconds_bucket{{{labels},status="2xx",le="0.5"}} 2',
+            f'chats_http_request_duration_seconds_bucket{{{labels},status="2xx",le="+Inf"}} 2',
+            f'chats_http_request_duration_seconds_sum{{{labels},status="2xx"}} 0.32',
+            f'chats_http_request_duration_seconds_count{{{labels},status="2xx"}} 2',
+            f'chats_http_request_duration_seconds_bucket{{{labels},status="4xx",le="10.0"}} 0',
+            f'chats_http_request_duration_seconds_bucket{{{labels},status="4xx",le="+Inf"}} 1',
+            f'chats_db_queries_total{{{labels}}} 7',
+            'chats_http_requests_in_flight 1',
+            'chats_http_throttled_total 1',
+            '# TYPE chats_http_request_duration_seconds histogram',
+        ):
+            self.assertIn(line, lines)
+        self.assertFalse(any('status="5xx"' in line for line in lines))
+        self.assertTrue(any(line.startswith('chats_access_log_dropped_total ') for line in lines))
+
+    def test_unknown_methods_are_counted_as_other(self):
+        registry = Registry()
+        for method in ('GET', 'PROPFIND', 'X' * 100):
+            self.record(registry, view='unmatched', method=method, status=405)
+
+        self.assertEqual(sorted(registry.snapshot().views['unmatched']), ['GET', 'other'])
+        self.assertIn(
+            'chats_http_requests_total{view="unmatched",method="other",status="4xx"} 2',
+            registry.render().splitlines(),
+        )
+
+    def test_shards_of_finished_threads_are_retired(self):
+        registry = Registry()
+        threads = [threading.Thread(target=self.record, args=(registry,)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+
+        self.record(registry)
+
+        self.assertEqual([thread for thread, _ in registry._shards], [threading.current_thread()])
+        series = registry.snapshot().views['conversation-list']['GET']
+        self.assertEqual(sum(series.buckets[1]), 6)
+        self.assertEqual(series.db_queries, 18)
+
+
+class MetricsViewTests(SimpleTestCase):
+    factory = RequestFactory()
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_served_with_the_token(self):
+        response = metrics_view(self.factory.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'# TYPE chats_http_requests_total counter', response.content)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_hidden_without_the_token(self):
+        for extra in ({}, {'HTTP_AUTHORIZATION': 'Bearer wrong'}, {'HTTP_AUTHORIZATION': 's3cret'}):
+            with self.subTest(extra=extra), self.assertRaises(Http404):
+                metrics_view(self.factory.get('/metrics', **extra))
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_disabled_without_a_token_setting(self):
+        for extra in ({}, {'HTTP_AUTHORIZATION': 'Bearer '}, {'HTTP_AUTHORIZATION': 'Bearer None'}):
+            with self.subTest(extra=extra), self.assertRaises(Http404):
+                metrics_view(self.factory.get('/metrics', **extra))
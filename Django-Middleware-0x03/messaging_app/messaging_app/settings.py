@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -27,6 +28,9 @@ DEBUG = True
 
 ALLOWED_HOSTS = []
 
+# Bearer token the scraper sends to read /metrics; unset disables the endpoint
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
 
 # Application definition
 
@@ -45,14 +49,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost: times every other middleware and logs throttled requests too
+    'chats.middleware.RequestLoggingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Before sessions and auth: throttled requests never reach the database
+    'chats.middleware.RateLimitMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'chats.middleware.RequestLoggingMiddleware',
 ]
 
 ROOT_URLCONF = 'messaging_app.urls'
@@ -127,6 +134,9 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Custom user model
+AUTH_USER_MODEL = 'chats.User'
+
 # Django REST Framework configuration
 REST_FRAMEWORK = {
    'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -148,3 +158,31 @@ REST_FRAMEWORK = {
 SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
+
+# Token-bucket limits of chats.middleware.RateLimitMiddleware, per user
+# (JWT) or client IP. Routes: (methods, path regex, rate); first match wins.
+# Behind reverse proxies, set NUM_PROXIES to their number so the client IP
+# is read from X-Forwarded-For.
+RATE_LIMIT = {
+    'DEFAULT': '600/min',
+    'ROUTES': [
+        # Sending messages
+        ('POST', r'^/api/conversations/[^/]+/messages/$', '30/min'),
+        # Polling conversations and messages
+        ('GET', r'^/api/conversations/', '300/min'),
+    ],
+    'MAX_KEYS': 100000,
+    'NUM_PROXIES': None,
+}
+
+# Access log written by chats.middleware.RequestLoggingMiddleware through a
+# background thread; see chats/access_log.py
+ACCESS_LOG = {
+    'PATH': 'requests.log',
+    'MAX_BYTES': 10 * 1024 * 1024,
+    'ROTATE_INTERVAL': 24 * 60 * 60,
+    'BACKUP_COUNT': 5,
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL': 1.0,
+    'QUEUE_SIZE': 10000,
+}
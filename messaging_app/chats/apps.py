@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ChatsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chats'
+
+    def ready(self):
+        # Import and connect signals
+        from . import signals  # noqa: F401
+        from .search import install_index
+
+        # Table rebuilds during migrations drop the search index triggers
+        post_migrate.connect(install_index, sender=self)
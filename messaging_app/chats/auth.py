@@ -1 +1,93 @@
-
+"""
+JWT authentication with a process-local cache of users.
+
+``JWTAuthentication`` loads the user by primary key on every request.
+``CachedJWTAuthentication`` keeps recently seen users in a bounded LRU with
+a TTL, so the token is verified cryptographically as before but the
+lookup is skipped. Entries are dropped when the user is saved or deleted
+(password changes and deactivation included); the TTL bounds staleness
+for changes made by other processes.
+"""
+import copy
+
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .lru import LRUCache
+
+CACHE_SIZE = 10000
+CACHE_TTL = 60  # seconds
+
+
+class UserCache(LRUCache):
+    """LRU of ``user_id -> User`` with hit counters"""
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        super().__init__(maxsize, ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """A private copy of the cached user, or None when missing or expired"""
+        with self._lock:
+            user = super().get(str(user_id))
+            if user is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # Requests may modify request.user; never hand out the shared instance
+        return copy.copy(user)
+
+    def set(self, user_id, user):
+        super().set(str(user_id), copy.copy(user))
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._discard(str(user_id))
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+            }
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """``JWTAuthentication`` resolving users through ``user_cache``"""
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+
+        user = user_cache.get(user_id)
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, user)
+            return user
+
+        # Same per-token checks as the uncached lookup
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+            api_settings.REVOKE_TOKEN_CLAIM
+        ) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(
+                "The user's password has been changed.", code='password_changed'
+            )
+        return user
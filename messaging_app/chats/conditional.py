@@ -0,0 +1,129 @@
+"""
+Conditional GETs for list and detail endpoints.
+
+Validators describe only the rows a response renders: one cheap key per
+row (its primary key, ``updated_at`` and a few denormalized or indexed
+columns the view annotates onto the same query) plus the pagination
+metadata. Keys include the presence of the users a row renders, since
+presence changes without touching ``updated_at``. They are hashed into an ETag, so a client that sends a matching
+``If-None-Match`` gets a 304 without the response being built.
+
+Nothing is aggregated over everything the viewer can see. Requests with
+``If-None-Match``/``If-Modified-Since`` fetch the keys of the page they
+would get (the same pagination, only the key columns); other requests
+take the keys from the rows the handler loaded anyway, so they run no
+extra query. ``Last-Modified`` only has one-second resolution; clients
+should prefer the ETag.
+"""
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+CONDITIONAL_HEADERS = ('HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE')
+
+
+def latest(*timestamps):
+    """Newest of ``timestamps``, ignoring None"""
+    return max((t for t in timestamps if t is not None), default=None)
+
+
+def is_conditional(request):
+    return any(header in request.META for header in CONDITIONAL_HEADERS)
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag/Last-Modified validation to viewset handlers.
+
+    Subclasses implement ``row_validators(row)``, returning a hashable key
+    and the newest ``datetime`` (or None) of one rendered row, which may be
+    a model instance or a ``values_list(named=True)`` row; and
+    ``get_validator_queryset()``, the handler's queryset reduced to the
+    columns ``row_validators`` reads. Handlers opt in with
+    ``return self.respond_conditionally(super().list, request, ...)``.
+    When the validators cannot be computed (e.g. a malformed id in the URL),
+    the handler runs unconditionally and reports the error itself.
+    """
+    _rendered_rows = None
+
+    def row_validators(self, row):
+        raise NotImplementedError('Views using ConditionalGetMixin must define row_validators()')
+
+    def get_validator_queryset(self):
+        raise NotImplementedError('Views using ConditionalGetMixin must define get_validator_queryset()')
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        self._rendered_rows = page
+        return page
+
+    def get_object(self):
+        instance = super().get_object()
+        self._rendered_rows = [instance]
+        return instance
+
+    def get_validator_rows(self):
+        """Keys of the rows the handler would render; None if it would not render any"""
+        queryset = self.get_validator_queryset()
+        if self.lookup_field in self.kwargs:
+            return list(queryset.filter(**{self.lookup_field: self.kwargs[self.lookup_field]})) or None
+        return self.paginate_queryset(queryset)
+
+    def get_validators(self, rows):
+        """``(values, last_modified)`` of ``rows`` and the pagination around them"""
+        keys, timestamps = [], []
+        for row in rows:
+            key, changed = self.row_validators(row)
+            keys.append(key)
+            timestamps.append(changed)
+        page = None
+        if self.lookup_field not in self.kwargs and self.paginator is not None:
+            data = self.paginator.get_paginated_response([]).data
+            page = tuple((name, value) for name, value in data.items() if name != 'results')
+        return (tuple(keys), page), latest(*timestamps)
+
+    def compute_etag(self, values):
+        request = self.request
+        renderer = getattr(request, 'accepted_renderer', None)
+        key = repr((
+            str(request.user.pk),
+            request.get_full_path(),
+            getattr(renderer, 'format', None),
+            values,
+        ))
+        return quote_etag(hashlib.sha1(key.encode()).hexdigest())
+
+    def respond_conditionally(self, handler, request, *args, **kwargs):
+        if not is_conditional(request):
+            response = handler(request, *args, **kwargs)
+            if response.status_code == 200 and self._rendered_rows is not None:
+                self.add_validators(response, *self.get_validators(self._rendered_rows))
+            return response
+
+        try:
+            rows = self.get_validator_rows()
+        except (ValueError, ValidationError):
+            rows = None
+        if rows is None:
+            return handler(request, *args, **kwargs)
+        values, last_modified = self.get_validators(rows)
+        etag = self.compute_etag(values)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=timestamp
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        return self.add_validators(response, values, last_modified, etag)
+
+    def add_validators(self, response, values, last_modified, etag=None):
+        response['ETag'] = etag or self.compute_etag(values)
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(int(last_modified.timestamp()))
+        patch_vary_headers(response, ('Accept', 'Authorization'))
+        return response
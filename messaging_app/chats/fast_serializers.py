@@ -0,0 +1,111 @@
+"""
+Read-only fast path for the hot message list endpoints.
+
+Rows are read with ``values_list()`` and turned into dicts by a row builder
+compiled once per request, skipping DRF's per-field machinery and
+``strftime``. The output must match ``MessageSerializer`` (nested sender)
+and ``CompactMessageSerializer`` (``sender_id`` only) exactly; the tests
+compare the rendered JSON byte for byte.
+"""
+from django.conf import settings
+from django.utils import timezone
+
+MESSAGE_COLUMNS = (
+    'message_id', 'conversation_id', 'sender_id',
+    'message_body', 'sent_at', 'is_read',
+)
+SENDER_COLUMNS = (
+    'sender__user_id', 'sender__email', 'sender__first_name', 'sender__last_name',
+    'sender__phone_number', 'sender__online_status', 'sender__last_activity',
+)
+
+
+def datetime_converter():
+    """Equivalent of DRF ``DateTimeField.to_representation`` for ISO 8601 output"""
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+
+    def convert(value):
+        if not value:
+            return None
+        if tz is not None:
+            value = value.astimezone(tz)
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+def format_sent_at(value):
+    """Same output as ``value.strftime('%Y-%m-%d %H:%M:%S')``, without strftime"""
+    return (
+        f'{value.year:04d}-{value.month:02d}-{value.day:02d} '
+        f'{value.hour:02d}:{value.minute:02d}:{value.second:02d}'
+    )
+
+
+class MessageRows:
+    """
+    Builds message representations straight from ``values_list()`` rows.
+
+    Use ``prepare()`` on a message queryset, paginate the result as usual,
+    then call ``build()`` on the page. Rows are named tuples, so keyset
+    pagination and sender sideloading read ``sent_at``/``message_id``/
+    ``sender_id`` from them like from model instances. ``extra_columns``
+    are fetched for the caller's use but left out of the output.
+    """
+
+    def __init__(self, compact=False, extra_columns=()):
+        self.compact = compact
+        self.columns = MESSAGE_COLUMNS if compact else MESSAGE_COLUMNS + SENDER_COLUMNS
+        self.columns += tuple(extra_columns)
+        self.build_row = self.compile()
+
+    def prepare(self, queryset):
+        return queryset.values_list(*self.columns, named=True)
+
+    def build(self, rows):
+        build_row = self.build_row
+        return [build_row(row) for row in rows]
+
+    def compile(self):
+        iso = datetime_converter()
+
+        if self.compact:
+            def build_row(row):
+                sent_at = row.sent_at
+                return {
+                    'message_id': str(row.message_id),
+                    'conversation_id': row.conversation_id,
+                    'sender_id': str(row.sender_id),
+                    'message_body': row.message_body,
+                    'sent_at': iso(sent_at),
+                    'formatted_sent_at': format_sent_at(sent_at),
+                    'is_read': row.is_read,
+                }
+            return build_row
+
+        def build_row(row):
+            sent_at = row.sent_at
+            first_name = row.sender__first_name
+            last_name = row.sender__last_name
+            phone_number = row.sender__phone_number
+            return {
+                'message_id': str(row.message_id),
+                'conversation_id': row.conversation_id,
+                'sender': {
+                    'user_id': str(row.sender__user_id),
+                    'email': row.sender__email,
+                    'first_name': first_name,
+                    'last_name': last_name,
+                    'full_name': f'{first_name} {last_name}',
+                    'phone_number': phone_number,
+                    'online_status': row.sender__online_status,
+                    'last_activity': iso(row.sender__last_activity),
+                },
+                'message_body': row.message_body,
+                'sent_at': iso(sent_at),
+                'formatted_sent_at': format_sent_at(sent_at),
+                'is_read': row.is_read,
+            }
+        return build_row
@@ -0,0 +1,72 @@
+"""
+Background flushing for the write-behind buffers.
+
+A ``Flusher`` is a daemon thread that calls a buffer's flush function
+every ``interval`` seconds, or as soon as it is woken. Buffered writes
+therefore reach the database within a bounded time even when no further
+requests arrive, and no request ever waits for another user's writes.
+
+Threads start on first use, so management commands that never touch a
+buffer never start one. ``settings.CHATS_BACKGROUND_FLUSH = False`` keeps
+them from starting; the test suite flushes explicitly instead.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+def background_flush_enabled():
+    return getattr(settings, 'CHATS_BACKGROUND_FLUSH', True)
+
+
+class Flusher:
+    """Daemon thread calling ``flush()`` periodically and on ``wake()``"""
+
+    def __init__(self, name, flush, interval):
+        self.name = name
+        self.flush = flush
+        self.interval = interval
+        self._thread = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the thread unless it runs already or flushing is disabled"""
+        if self._thread is not None or not background_flush_enabled():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        """Flush now rather than at the end of the interval"""
+        self.start()
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        """Stop the thread after one last flush"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            self._wake.set()
+            thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('%s failed', self.name)
+            finally:
+                # This thread's connection, like a request's, honours CONN_MAX_AGE
+                close_old_connections()
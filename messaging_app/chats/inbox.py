@@ -0,0 +1,54 @@
+"""
+Denormalized "latest message" pointer on conversations.
+
+``Conversation.last_message_at``/``last_message_id`` are moved forward in
+the same transaction as message inserts, so inbox ordering and previews
+read one indexed column instead of aggregating over messages. The update
+is conditional: its WHERE clause only matches while the stored pointer is
+older than the new message, so concurrent or out-of-order inserts never
+move it backwards.
+"""
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Conversation, Message
+
+
+def record_last_message(conversation_id, message):
+    """Advance the pointer of ``conversation_id`` to ``message`` if it is newer"""
+    newer = (
+        Q(last_message_at__lt=message.sent_at)
+        | Q(last_message_id__isnull=True)
+        | Q(last_message_at=message.sent_at, last_message_id__lt=message.message_id)
+    )
+    return Conversation.objects.filter(newer, conversation_id=conversation_id).update(
+        last_message_at=message.sent_at,
+        last_message_id=message.message_id,
+        updated_at=timezone.now(),
+    )
+
+
+def record_last_of(conversation_id, messages):
+    """``record_last_message`` for the newest of a batch of messages"""
+    if messages:
+        newest = max(messages, key=lambda m: (m.sent_at, m.message_id))
+        record_last_message(conversation_id, newest)
+
+
+def refresh_last_message(conversation_id, removed_id=None):
+    """
+    Recompute the pointer from the messages. With ``removed_id``, only when
+    that (deleted) message was the newest one.
+    """
+    conversations = Conversation.objects.filter(conversation_id=conversation_id)
+    if removed_id is not None:
+        conversations = conversations.filter(last_message_id=removed_id)
+    latest = Message.objects.filter(
+        conversation_id=OuterRef('pk')
+    ).order_by('-sent_at', '-message_id')
+    return conversations.update(
+        last_message_at=Coalesce(Subquery(latest.values('sent_at')[:1]), F('created_at')),
+        last_message_id=Subquery(latest.values('message_id')[:1]),
+        updated_at=timezone.now(),
+    )
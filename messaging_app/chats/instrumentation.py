@@ -0,0 +1,113 @@
+"""
+Per-request SQL instrumentation for the chats API.
+
+``QueryInstrumentationMixin`` wraps every DRF action in a database
+execute wrapper that records the number of queries, total DB time and
+how often each query shape (fingerprint) ran. Repeated fingerprints are
+the signature of an N+1 pattern. The stats are attached to the response
+as ``response.query_stats`` and, when ``DEBUG`` is on, exposed as headers.
+
+The wrapper costs time on every query, so it only runs when the
+``CHATS_QUERY_INSTRUMENTATION`` setting is on (default: ``DEBUG``), as in
+development and in the query budget tests.
+"""
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+_WHITESPACE = re.compile(r'\s+')
+_PLACEHOLDER_LIST = re.compile(r'%s(?:\s*,\s*%s)+')
+
+
+def fingerprint(sql):
+    """Normalize ``sql`` so queries differing only in parameters compare equal"""
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    return _PLACEHOLDER_LIST.sub('%s, ...', sql)
+
+
+class QueryStats:
+    """Aggregated query metrics for one unit of work"""
+
+    def __init__(self, label=''):
+        self.label = label
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.statements[sql] += 1
+
+    @property
+    def fingerprints(self):
+        """Executions per query shape; normalized when read, not per query"""
+        fingerprints = Counter()
+        for sql, n in self.statements.items():
+            fingerprints[fingerprint(sql)] += n
+        return fingerprints
+
+    @property
+    def duplicates(self):
+        """Fingerprints that ran more than once, with their counts"""
+        return {sql: n for sql, n in self.fingerprints.items() if n > 1}
+
+    @property
+    def duplicate_count(self):
+        """Number of executions that repeated an earlier fingerprint"""
+        return self.count - len(self.fingerprints)
+
+    def as_headers(self):
+        return {
+            'X-DB-Query-Count': str(self.count),
+            'X-DB-Time-Ms': f'{self.duration * 1000:.2f}',
+            'X-DB-Duplicate-Queries': str(self.duplicate_count),
+        }
+
+    def __repr__(self):
+        return (
+            f'<QueryStats {self.label}: {self.count} queries, '
+            f'{self.duration * 1000:.2f}ms, {self.duplicate_count} duplicates>'
+        )
+
+
+@contextmanager
+def record_queries(label='', using=DEFAULT_DB_ALIAS):
+    """Context manager yielding a ``QueryStats`` filled while the block runs"""
+    stats = QueryStats(label)
+    with connections[using].execute_wrapper(stats):
+        yield stats
+
+
+def instrumentation_enabled():
+    return getattr(settings, 'CHATS_QUERY_INSTRUMENTATION', settings.DEBUG)
+
+
+class QueryInstrumentationMixin:
+    """
+    Viewset mixin recording query stats for every action while
+    ``CHATS_QUERY_INSTRUMENTATION`` is on; otherwise it adds nothing.
+    """
+
+    def get_instrumentation_label(self):
+        return f'{self.__class__.__name__}.{getattr(self, "action", None) or "unknown"}'
+
+    def dispatch(self, request, *args, **kwargs):
+        if not instrumentation_enabled():
+            return super().dispatch(request, *args, **kwargs)
+        with record_queries() as stats:
+            response = super().dispatch(request, *args, **kwargs)
+        stats.label = self.get_instrumentation_label()
+        response.query_stats = stats
+        if settings.DEBUG:
+            for header, value in stats.as_headers().items():
+                response[header] = value
+        return response
@@ -0,0 +1,199 @@
+"""
+Async load generator for the HTTP API.
+
+Drives a running server (``runserver``, gunicorn, or the in-process server
+of the ``loadtest`` command) the way clients do: every worker coroutine
+plays one authenticated user, picks endpoints by weight and sends real
+HTTP/1.1 requests over asyncio streams, so the numbers include routing,
+authentication, serialization and the database. Standard library only.
+
+``run`` returns a report with request counts, error counts, throughput
+and latency percentiles per endpoint; reports are plain dicts so runs can
+be saved as JSON and compared with ``compare``.
+"""
+import asyncio
+import json
+import math
+import random
+import time
+from urllib.parse import urlsplit
+
+SEARCH_TERMS = ['meeting', 'deploy', 'lunch', 'review', 'ticket', 'coffee', 'plan']
+
+
+def inbox(rng, session):
+    return 'GET', '/api/conversations/inbox/', None
+
+
+def conversations(rng, session):
+    return 'GET', '/api/conversations/', None
+
+
+def conversation_messages(rng, session):
+    conversation_id = rng.choice(session['conversations'])
+    return 'GET', f'/api/conversations/{conversation_id}/messages/?pagination=cursor', None
+
+
+def messages(rng, session):
+    return 'GET', '/api/messages/?pagination=cursor&count=false', None
+
+
+def sync(rng, session):
+    return 'GET', '/api/conversations/sync/', None
+
+
+def profile(rng, session):
+    return 'GET', '/api/users/me/', None
+
+
+def search(rng, session):
+    return 'GET', f'/api/messages/search/?q={rng.choice(SEARCH_TERMS)}', None
+
+
+def send_message(rng, session):
+    return 'POST', '/api/messages/', {
+        'conversation_id': rng.choice(session['conversations']),
+        'message_body': f'Load test message {rng.getrandbits(32):08x}',
+    }
+
+
+# (name, weight, request builder): mostly reads, like a chat client
+SCENARIOS = [
+    ('inbox', 25, inbox),
+    ('conversation_messages', 25, conversation_messages),
+    ('messages', 10, messages),
+    ('sync', 10, sync),
+    ('profile', 10, profile),
+    ('send_message', 10, send_message),
+    ('conversations', 5, conversations),
+    ('search', 5, search),
+]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def summarize(latencies, errors, elapsed):
+    """Report entry for one endpoint; latencies in seconds, output in ms"""
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'throughput': round(len(ordered) / elapsed, 2) if elapsed else None,
+        'mean': _ms(sum(ordered) / len(ordered)) if ordered else None,
+        'p50': _ms(percentile(ordered, 50)),
+        'p95': _ms(percentile(ordered, 95)),
+        'p99': _ms(percentile(ordered, 99)),
+        'max': _ms(ordered[-1] if ordered else None),
+    }
+
+
+async def send(host, port, method, path, token, body=None, timeout=30):
+    """One request on a fresh connection; returns ``(status, response bytes)``"""
+    payload = json.dumps(body).encode() if body is not None else b''
+    head = [
+        f'{method} {path} HTTP/1.1',
+        f'Host: {host}:{port}',
+        f'Authorization: Bearer {token}',
+        'Accept: application/json',
+        'Connection: close',
+    ]
+    if body is not None:
+        head += ['Content-Type: application/json', f'Content-Length: {len(payload)}']
+
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write('\r\n'.join(head).encode() + b'\r\n\r\n' + payload)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    status_line = response.split(b'\r\n', 1)[0].split()
+    return int(status_line[1]) if len(status_line) > 1 else 0, len(response)
+
+
+async def run(url, sessions, requests=None, duration=None, concurrency=10,
+              seed=1, scenarios=SCENARIOS):
+    """
+    Load ``url`` until ``requests`` have been sent or ``duration`` seconds
+    have passed. ``sessions`` are dicts with a JWT ``token`` and the
+    ``conversations`` the user belongs to; worker ``i`` plays session
+    ``i % len(sessions)`` with its own seeded random choices.
+    """
+    if requests is None and duration is None:
+        raise ValueError('Pass requests or duration')
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    names = [name for name, _, _ in scenarios]
+    weights = [weight for _, weight, _ in scenarios]
+    builders = {name: build for name, _, build in scenarios}
+    latencies = {name: [] for name in names}
+    errors = dict.fromkeys(names, 0)
+    remaining = [requests]
+    response_bytes = [0]
+    start = time.perf_counter()
+    deadline = start + duration if duration is not None else None
+
+    async def worker(index):
+        rng = random.Random(f'{seed}-{index}')
+        session = sessions[index % len(sessions)]
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            if remaining[0] is not None:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            name = rng.choices(names, weights=weights)[0]
+            if not session['conversations'] and name in ('conversation_messages', 'send_message'):
+                name = 'inbox'
+            method, path, body = builders[name](rng, session)
+            sent = time.perf_counter()
+            try:
+                status, size = await send(host, port, method, path, session['token'], body)
+            except (OSError, asyncio.TimeoutError):
+                status, size = 0, 0
+            latencies[name].append(time.perf_counter() - sent)
+            response_bytes[0] += size
+            if not 200 <= status < 400:
+                errors[name] += 1
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    everything = [latency for values in latencies.values() for latency in values]
+    return {
+        'url': url,
+        'concurrency': concurrency,
+        'elapsed': round(elapsed, 3),
+        'response_bytes': response_bytes[0],
+        'endpoints': {
+            name: summarize(latencies[name], errors[name], elapsed)
+            for name in names if latencies[name]
+        },
+        'total': summarize(everything, sum(errors.values()), elapsed),
+    }
+
+
+def compare(report, baseline):
+    """``{endpoint: {metric: relative change}}`` of p50/p95/p99/throughput"""
+    changes = {}
+    for name, current in [*report['endpoints'].items(), ('total', report['total'])]:
+        before = baseline['total'] if name == 'total' else baseline['endpoints'].get(name)
+        if not before:
+            continue
+        changes[name] = {
+            metric: round(current[metric] / before[metric] - 1, 4)
+            for metric in ('p50', 'p95', 'p99', 'throughput')
+            if current[metric] is not None and before[metric]
+        }
+    return changes
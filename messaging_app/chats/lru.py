@@ -0,0 +1,57 @@
+"""
+Bounded process-local caches.
+
+``LRUCache`` keeps at most ``maxsize`` entries, evicting the least recently
+used, and forgets each entry ``ttl`` seconds after it was stored. The TTL
+bounds staleness for changes made by other processes, which no signal
+handler in this process hears about.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe LRU of ``key -> value`` with a TTL"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # Reentrant so subclasses can extend methods under the same lock
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        """Cached value, or None when missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+
+    def discard(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _discard(self, key):
+        """Remove ``key``; called with the lock held, for expiry and eviction too"""
+        self._entries.pop(key, None)
@@ -0,0 +1,104 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from chats.fast_serializers import MessageRows
+from chats.models import Conversation, Message, User
+from chats.renderers import FastJSONRenderer, orjson
+from chats.serializers import CompactMessageSerializer, MessageSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare DRF serializers with the values_list() fast path on a large "
+        "message page. Test data is created in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=10000,
+                            help='Number of messages on the page (default: 10000)')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Timed runs per path; the best run is reported')
+
+    def handle(self, *args, **options):
+        count, repeat = options['messages'], options['repeat']
+        if count <= 0 or repeat <= 0:
+            raise CommandError('--messages and --repeat must be positive')
+
+        with transaction.atomic():
+            conversation = self.create_page(count)
+            queryset = Message.objects.filter(
+                conversation_id=conversation
+            ).order_by('sent_at', 'message_id')
+
+            self.stdout.write(
+                f"{count} messages, best of {repeat} runs, "
+                f"orjson {'available' if orjson else 'not installed'}"
+            )
+            for compact in (False, True):
+                self.compare(queryset, compact, repeat)
+
+            transaction.set_rollback(True)
+
+    def create_page(self, count):
+        senders = [
+            User(
+                username=f'bench-{i}',
+                email=f'bench-{i}@example.com',
+                first_name='Bench',
+                last_name=f'User {i}',
+            )
+            for i in range(2)
+        ]
+        User.objects.bulk_create(senders)
+        conversation = Conversation.objects.create()
+        conversation.participants.set(senders)
+
+        Message.objects.bulk_create(
+            [
+                Message(
+                    conversation_id=conversation,
+                    sender=senders[i % 2],
+                    message_body=f'Benchmark message number {i}',
+                )
+                for i in range(count)
+            ],
+            batch_size=1000,
+        )
+        return conversation
+
+    def drf_path(self, queryset, compact):
+        if compact:
+            data = CompactMessageSerializer(list(queryset), many=True).data
+        else:
+            data = MessageSerializer(list(queryset.select_related('sender')), many=True).data
+        return JSONRenderer().render(data)
+
+    def fast_path(self, queryset, compact):
+        rows = MessageRows(compact=compact)
+        return FastJSONRenderer().render(rows.build(rows.prepare(queryset)))
+
+    def time_best(self, func, repeat):
+        best, output = None, None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, output
+
+    def compare(self, queryset, compact, repeat):
+        mode = 'sideloaded' if compact else 'nested'
+        drf_time, drf_bytes = self.time_best(lambda: self.drf_path(queryset, compact), repeat)
+        fast_time, fast_bytes = self.time_best(lambda: self.fast_path(queryset, compact), repeat)
+
+        if drf_bytes != fast_bytes:
+            raise CommandError(f'{mode}: fast path output differs from DRF serializers')
+
+        self.stdout.write(
+            f"{mode:>10}: drf {drf_time * 1000:8.1f}ms  "
+            f"fast {fast_time * 1000:8.1f}ms  "
+            f"speedup {drf_time / fast_time:4.1f}x  ({len(fast_bytes)} bytes)"
+        )
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import threading
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chats import loadgen
+from chats.models import Conversation, User
+
+from .seed_chats import USERNAME_PREFIX
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the API with concurrent simulated users and report p50/p95/p99 "
+        "latency and throughput per endpoint. Uses the users created by "
+        "seed_chats. Without --url the API is served from a threaded server "
+        "inside this process, which shares the CPU with the load generator; "
+        "point --url at a separately started server for cleaner numbers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url',
+                            help='Base URL of a running server (default: start one in-process)')
+        parser.add_argument('--users', type=int, default=20,
+                            help='Distinct simulated users (default: 20)')
+        parser.add_argument('--concurrency', type=int, default=20,
+                            help='Requests in flight at once (default: 20)')
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Total requests to send (default: 2000)')
+        parser.add_argument('--duration', type=float,
+                            help='Run for this many seconds instead of a request count')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Seed of the endpoint choices (default: 1)')
+        parser.add_argument('--json', dest='json_path',
+                            help='Write the report as JSON to this file')
+        parser.add_argument('--baseline',
+                            help='JSON report of an earlier run to compare against')
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['concurrency'], options['requests']) <= 0:
+            raise CommandError('--users, --concurrency and --requests must be positive')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        sessions = self.sessions(options['users'])
+        server = None
+        url = options['url']
+        if not url:
+            server = self.start_server()
+            url = 'http://%s:%s' % server.server_address[:2]
+
+        try:
+            report = asyncio.run(loadgen.run(
+                url, sessions,
+                requests=None if options['duration'] else options['requests'],
+                duration=options['duration'],
+                concurrency=options['concurrency'],
+                seed=options['seed'],
+            ))
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        self.print_report(report, baseline)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def sessions(self, count):
+        users = list(
+            User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('username')[:count]
+        )
+        if not users:
+            raise CommandError('No generated users; run "manage.py seed_chats" first')
+        # Tokens are minted directly so password hashing stays out of the numbers
+        return [
+            {
+                'token': str(AccessToken.for_user(user)),
+                'conversations': [
+                    str(pk) for pk in Conversation.objects.filter(participants=user)
+                    .order_by('-last_message_at').values_list('pk', flat=True)[:50]
+                ],
+            }
+            for user in users
+        ]
+
+    def start_server(self):
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+        server.set_app(WSGIHandler())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def print_report(self, report, baseline):
+        changes = loadgen.compare(report, baseline) if baseline else {}
+        self.stdout.write(
+            f"{report['total']['requests']} requests in {report['elapsed']}s "
+            f"against {report['url']} (concurrency {report['concurrency']})"
+        )
+        self.stdout.write(
+            f"{'endpoint':<22} {'reqs':>6} {'errors':>6} {'req/s':>8} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+            + (f" {'p95 vs base':>12}" if baseline else '')
+        )
+        rows = [*report['endpoints'].items(), ('total', report['total'])]
+        for name, stats in rows:
+            line = (
+                f"{name:<22} {stats['requests']:>6} {stats['errors']:>6} "
+                f"{stats['throughput']:>8.1f} {stats['p50']:>8.1f} "
+                f"{stats['p95']:>8.1f} {stats['p99']:>8.1f}"
+            )
+            if baseline:
+                change = changes.get(name, {}).get('p95')
+                line += f" {change:>+12.1%}" if change is not None else f" {'-':>12}"
+            self.stdout.write(line)
@@ -0,0 +1,265 @@
+import random
+import uuid
+from bisect import bisect
+from contextlib import contextmanager
+from datetime import datetime, time as dt_time, timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from chats.models import Conversation, ConversationReadState, Message, User
+from chats.participants import participant_key
+
+USERNAME_PREFIX = 'load-'
+
+FIRST_NAMES = [
+    'Ada', 'Ben', 'Chloe', 'Dan', 'Esi', 'Farid', 'Grace', 'Hugo', 'Ines', 'Jun',
+    'Kofi', 'Lena', 'Mateo', 'Nia', 'Omar', 'Priya', 'Quinn', 'Rosa', 'Sami', 'Tara',
+]
+LAST_NAMES = [
+    'Adeyemi', 'Berg', 'Costa', 'Dubois', 'Evans', 'Fischer', 'Garcia', 'Haddad',
+    'Ito', 'Jensen', 'Kim', 'Lopez', 'Mensah', 'Novak', 'Okafor', 'Patel',
+]
+WORDS = (
+    'ok thanks see you tomorrow meeting lunch call later sounds good great idea '
+    'project deadline review draft update send file photo weekend trip ticket '
+    'coffee morning tonight sorry late running traffic home office question '
+    'answer budget plan release bug deploy test green done almost ready'
+).split()
+
+# Share of conversations by participant count (2..10): mostly one-to-one chats
+PARTICIPANT_WEIGHTS = [60, 12, 8, 6, 5, 3, 3, 2, 1]
+
+
+def zipf_weights(count, exponent):
+    """Cumulative Zipf weights for sampling with ``bisect``: rank r gets 1 / r**exponent"""
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def random_uuid(rng):
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """Let bulk inserts keep the auto_now/auto_now_add values they are given"""
+    saved = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                saved.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a deterministic synthetic dataset for load testing: users, "
+        "conversations with realistic participant counts and a skewed message "
+        "distribution, written with bulk inserts. The same --seed always "
+        "produces the same ids, participants and message bodies."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000,
+                            help='Number of users (default: 1000)')
+        parser.add_argument('--conversations', type=int, default=2000,
+                            help='Number of conversations (default: 2000)')
+        parser.add_argument('--messages', type=int, default=100000,
+                            help='Total number of messages (default: 100000)')
+        parser.add_argument('--days', type=int, default=90,
+                            help='Days of history the messages span (default: 90)')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Random seed (default: 1)')
+        parser.add_argument('--password', default='loadtest',
+                            help='Password of every generated user (default: loadtest)')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rows per bulk insert (default: 5000)')
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete a previously generated dataset first')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['conversations'] < 1:
+            raise CommandError('--users must be at least 2 and --conversations at least 1')
+        if options['messages'] < 0:
+            raise CommandError('--messages must not be negative')
+        if options['days'] <= 0 or options['batch_size'] <= 0:
+            raise CommandError('--days and --batch-size must be positive')
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        # Timestamps are offsets from midnight, so reruns on the same day match
+        self.end = timezone.make_aware(datetime.combine(timezone.localdate(), dt_time.min))
+        self.start = self.end - timedelta(days=options['days'])
+
+        generated = User.objects.filter(username__startswith=USERNAME_PREFIX)
+        with transaction.atomic():
+            if generated.exists():
+                if not options['clear']:
+                    raise CommandError('A generated dataset exists; pass --clear to replace it')
+                self.clear(generated)
+            with explicit_timestamps(User, Conversation, Message, ConversationReadState):
+                users = self.create_users(options['users'], options['password'])
+                conversations = self.create_conversations(users, options['conversations'])
+                total = self.create_messages(conversations, options['messages'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {len(users)} users, {len(conversations)} conversations "
+            f"and {total} messages (seed {options['seed']}); "
+            f"users log in as {USERNAME_PREFIX}000000.. with password {options['password']!r}"
+        ))
+
+    def clear(self, generated):
+        Conversation.objects.filter(participants__in=generated).distinct().delete()
+        generated.delete()
+
+    def between(self, start, end):
+        return start + (end - start) * self.rng.random()
+
+    def create_users(self, count, password):
+        # Hashing is the slow part of creating users; every user shares one hash
+        password = make_password(password)
+        users = []
+        for i in range(count):
+            first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+            joined = self.between(self.start, self.end)
+            users.append(User(
+                user_id=random_uuid(self.rng),
+                username=f'{USERNAME_PREFIX}{i:06d}',
+                email=f'{USERNAME_PREFIX}{i:06d}@example.com',
+                first_name=first,
+                last_name=last,
+                password=password,
+                date_joined=joined,
+                last_activity=self.between(joined, self.end),
+                updated_at=joined,
+            ))
+        User.objects.bulk_create(users, batch_size=self.batch_size)
+        return users
+
+    def create_conversations(self, users, count):
+        """
+        Conversations with 2-10 participants. A few users take part in most
+        conversations, like the heavy users of a real deployment.
+        """
+        user_weights = zipf_weights(len(users), 0.8)
+        sizes = list(range(2, 2 + len(PARTICIPANT_WEIGHTS)))
+        direct_keys = set()
+        conversations, members = [], []
+        for _ in range(count):
+            size = min(self.rng.choices(sizes, weights=PARTICIPANT_WEIGHTS)[0], len(users))
+            chosen = set()
+            while len(chosen) < size:
+                chosen.add(users[bisect(user_weights, self.rng.random() * user_weights[-1])])
+            chosen = sorted(chosen, key=lambda user: user.username)
+
+            key = participant_key(user.pk for user in chosen)
+            is_direct = size == 2 and key not in direct_keys
+            if is_direct:
+                direct_keys.add(key)
+            created = self.between(self.start, self.end)
+            conversations.append(Conversation(
+                conversation_id=random_uuid(self.rng),
+                participant_key=key,
+                is_direct=is_direct,
+                created_at=created,
+                updated_at=created,
+                last_message_at=created,
+            ))
+            members.append(chosen)
+
+        Conversation.objects.bulk_create(conversations, batch_size=self.batch_size)
+        Through = Conversation.participants.through
+        Through.objects.bulk_create(
+            [
+                Through(conversation_id=conversation.pk, user_id=user.pk)
+                for conversation, chosen in zip(conversations, members)
+                for user in chosen
+            ],
+            batch_size=self.batch_size,
+        )
+        self.members = dict(zip((c.pk for c in conversations), members))
+        return conversations
+
+    def create_messages(self, conversations, total):
+        """
+        Distribute ``total`` messages over conversations by a Zipf law, then
+        write them with the read states and inbox pointers that the signals
+        would have maintained for one-by-one inserts.
+        """
+        order = conversations[:]
+        self.rng.shuffle(order)
+        per_conversation = dict.fromkeys((c.pk for c in order), 0)
+        weights = zipf_weights(len(order), 1.1)
+        for _ in range(total):
+            per_conversation[order[bisect(weights, self.rng.random() * weights[-1])].pk] += 1
+
+        batch, read_states = [], []
+        for conversation in conversations:
+            messages = self.conversation_messages(
+                conversation, per_conversation[conversation.pk]
+            )
+            read_states.extend(self.read_states(conversation, messages))
+            batch.extend(messages)
+            if len(batch) >= self.batch_size:
+                Message.objects.bulk_create(batch, batch_size=self.batch_size)
+                batch = []
+        Message.objects.bulk_create(batch, batch_size=self.batch_size)
+
+        ConversationReadState.objects.bulk_create(read_states, batch_size=self.batch_size)
+        Conversation.objects.bulk_update(
+            conversations,
+            ['last_message_at', 'last_message_id', 'updated_at'],
+            batch_size=self.batch_size,
+        )
+        return total
+
+    def conversation_messages(self, conversation, count):
+        members = self.members[conversation.pk]
+        times = sorted(
+            self.between(conversation.created_at, self.end) for _ in range(count)
+        )
+        # The first participants do most of the talking
+        sender_weights = zipf_weights(len(members), 1.0)
+        messages = []
+        for sent_at in times:
+            sender = members[bisect(sender_weights, self.rng.random() * sender_weights[-1])]
+            words = self.rng.choices(WORDS, k=self.rng.randint(2, 24))
+            messages.append(Message(
+                message_id=random_uuid(self.rng),
+                conversation_id=conversation,
+                sender=sender,
+                message_body=' '.join(words).capitalize(),
+                sent_at=sent_at,
+                updated_at=sent_at,
+            ))
+        if messages:
+            conversation.last_message_at = conversation.updated_at = messages[-1].sent_at
+            conversation.last_message_id = messages[-1].message_id
+        return messages
+
+    def read_states(self, conversation, messages):
+        """Most participants are caught up; the rest read up to a random point"""
+        states, watermarks = [], []
+        for user in self.members[conversation.pk]:
+            read = len(messages) if self.rng.random() < 0.7 else self.rng.randint(0, len(messages))
+            watermarks.append(read)
+            unread = sum(1 for message in messages[read:] if message.sender_id != user.pk)
+            states.append(ConversationReadState(
+                user=user,
+                conversation=conversation,
+                last_read_at=messages[read - 1].sent_at if read else None,
+                unread_count=unread,
+                updated_at=messages[read - 1].sent_at if read else conversation.created_at,
+            ))
+        # The legacy is_read flag: read once every participant has read it
+        for message in messages[:min(watermarks)]:
+            message.is_read = True
+        return states
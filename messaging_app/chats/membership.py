@@ -0,0 +1,121 @@
+"""
+Conversation membership checks.
+
+``is_participant`` answers "is this user in this conversation?" with one
+indexed EXISTS query on the participants table instead of loading every
+participant. Answers are memoized on the request and in a process-local
+LRU. Signal handlers invalidate the LRU when participants change, and a
+TTL bounds staleness for changes made by other processes.
+"""
+import uuid
+
+from django.db.models import Q
+
+from .lru import LRUCache
+from .models import Conversation, Message
+
+CACHE_SIZE = 10000
+CACHE_TTL = 60  # seconds
+
+_REQUEST_CACHE_ATTR = '_chats_membership'
+
+
+class MembershipCache(LRUCache):
+    """LRU of ``(conversation_id, user_id) -> bool``, invalidated per conversation"""
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        super().__init__(maxsize, ttl)
+        self._by_conversation = {}
+
+    def get(self, conversation_id, user_id):
+        """Cached answer, or None when missing or expired"""
+        return super().get((conversation_id, user_id))
+
+    def set(self, conversation_id, user_id, value):
+        with self._lock:
+            self._by_conversation.setdefault(conversation_id, set()).add(user_id)
+            super().set((conversation_id, user_id), value)
+
+    def invalidate(self, conversation_id, user_ids=None):
+        """Forget one conversation, or only some of its users"""
+        with self._lock:
+            users = self._by_conversation.get(conversation_id, set())
+            for user_id in list(users if user_ids is None else users & set(user_ids)):
+                self._discard((conversation_id, user_id))
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self._by_conversation.clear()
+
+    def _discard(self, key):
+        super()._discard(key)
+        users = self._by_conversation.get(key[0])
+        if users is not None:
+            users.discard(key[1])
+            if not users:
+                del self._by_conversation[key[0]]
+
+
+cache = MembershipCache()
+
+
+def _pk(value):
+    """Normalize a model instance, UUID or UUID string to a UUID"""
+    value = getattr(value, 'pk', value)
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+def is_participant(user, conversation, request=None):
+    """
+    True if ``user`` participates in ``conversation`` (an instance or its id).
+
+    Raises ValueError for a malformed conversation id.
+    """
+    if not getattr(user, 'is_authenticated', False):
+        return False
+    conversation_id, user_id = _pk(conversation), _pk(user)
+
+    memo = None
+    if request is not None:
+        http_request = getattr(request, '_request', request)
+        memo = getattr(http_request, _REQUEST_CACHE_ATTR, None)
+        if memo is None:
+            memo = {}
+            setattr(http_request, _REQUEST_CACHE_ATTR, memo)
+        if (conversation_id, user_id) in memo:
+            return memo[conversation_id, user_id]
+
+    answer = cache.get(conversation_id, user_id)
+    if answer is None:
+        answer = Conversation.participants.through.objects.filter(
+            conversation_id=conversation_id, user_id=user_id
+        ).exists()
+        cache.set(conversation_id, user_id, answer)
+
+    if memo is not None:
+        memo[conversation_id, user_id] = answer
+    return answer
+
+
+def invalidate(conversation, user_ids=None):
+    """Drop cached answers after participants of ``conversation`` changed"""
+    cache.invalidate(_pk(conversation), None if user_ids is None else [_pk(u) for u in user_ids])
+
+
+def member_conversations(user):
+    """``conversation_id`` values of the conversations ``user`` is in, for ``__in`` filters"""
+    return Conversation.participants.through.objects.filter(user=user).values('conversation_id')
+
+
+def visible_messages(user):
+    """
+    Messages ``user`` may read: those in their conversations plus their own.
+
+    A semi-join on the user's conversations instead of a join on the
+    participants table: no duplicate rows, so no DISTINCT, and both branches
+    of the OR can use an index.
+    """
+    return Message.objects.filter(
+        Q(conversation_id__in=member_conversations(user)) | Q(sender=user)
+    )
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:06
+
+from collections import Counter
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_read_states(apps, schema_editor):
+    """
+    Seed one read state per participant from the legacy is_read flags.
+
+    Unread messages are counted once per (conversation, sender); a
+    participant's count is the conversation's total minus their own.
+    """
+    Conversation = apps.get_model('chats', 'Conversation')
+    Message = apps.get_model('chats', 'Message')
+    ConversationReadState = apps.get_model('chats', 'ConversationReadState')
+    Participant = Conversation.participants.through
+
+    per_conversation, per_sender = Counter(), {}
+    unread = (
+        Message.objects.filter(is_read=False)
+        .values_list('conversation_id', 'sender')
+        .annotate(total=models.Count('pk'))
+        .order_by()
+    )
+    for conversation_id, sender_id, total in unread:
+        per_conversation[conversation_id] += total
+        per_sender[conversation_id, sender_id] = total
+
+    ConversationReadState.objects.bulk_create(
+        (
+            ConversationReadState(
+                user_id=user_id,
+                conversation_id=conversation_id,
+                unread_count=(
+                    per_conversation[conversation_id]
+                    - per_sender.get((conversation_id, user_id), 0)
+                ),
+            )
+            for conversation_id, user_id in Participant.objects.values_list(
+                'conversation_id', 'user_id'
+            )
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationReadState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_at', models.DateTimeField(blank=True, help_text='sent_at of the newest message the user has read', null=True)),
+                ('unread_count', models.PositiveIntegerField(default=0, help_text='Messages from other participants sent after last_read_at')),
+                ('conversation', models.ForeignKey(help_text='Conversation this read state tracks', on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='chats.conversation')),
+                ('user', models.ForeignKey(help_text='Participant this read state belongs to', on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Conversation Read State',
+                'verbose_name_plural': 'Conversation Read States',
+                'constraints': [models.UniqueConstraint(fields=('user', 'conversation'), name='unique_read_state_per_participant')],
+            },
+        ),
+        migrations.RunPython(backfill_read_states, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:26
+
+from django.db import migrations, models
+
+
+def messages_unchanged_since_sent(apps, schema_editor):
+    """Existing messages were last modified when they were sent"""
+    Message = apps.get_model('chats', 'Message')
+    Message.objects.update(updated_at=models.F('sent_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0003_message_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationreadstate',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, help_text='Last change to this read state; bulk updates must set it explicitly'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, help_text='Last change to the message; bulk updates must set it explicitly'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, help_text='Last change to the profile; used for sync and ETags'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation_id', 'updated_at'], name='message_conversation_upd_idx'),
+        ),
+        migrations.RunPython(messages_unchanged_since_sent, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:34
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_last_message(apps, schema_editor):
+    """Point every conversation at its newest message"""
+    Conversation = apps.get_model('chats', 'Conversation')
+    Message = apps.get_model('chats', 'Message')
+    latest = Message.objects.filter(
+        conversation_id=OuterRef('pk')
+    ).order_by('-sent_at', '-message_id')
+    Conversation.objects.update(
+        last_message_at=Coalesce(Subquery(latest.values('sent_at')[:1]), F('created_at')),
+        last_message_id=Subquery(latest.values('message_id')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0004_updated_at_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='sent_at of the newest message; creation time while empty'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_id',
+            field=models.UUIDField(blank=True, help_text='ID of the newest message, maintained with last_message_at', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['last_message_at', 'conversation_id'], name='conversation_last_message_idx'),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+"""
+Full-text index over message bodies (SQLite only).
+
+``chats_message_fts`` stores each body together with its ``message_id``
+(UNINDEXED, for the join) under an integer document id from
+``chats_message_search_doc``: an INTEGER PRIMARY KEY, which VACUUM keeps,
+unlike the rowids of ``chats_message``, with a unique index on
+``message_id`` so the triggers find a message's row without scanning the
+index. Triggers keep it in sync with inserts, updates and deletes,
+including ``bulk_create`` and queryset updates.
+"""
+from django.db import migrations
+
+CREATE_SQL = [
+    """
+    CREATE TABLE chats_message_search_doc (
+        doc integer NOT NULL PRIMARY KEY,
+        message_id char(32) NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE chats_message_fts USING fts5(
+        message_body,
+        message_id UNINDEXED,
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER chats_message_fts_insert AFTER INSERT ON chats_message BEGIN
+        INSERT OR IGNORE INTO chats_message_search_doc(message_id) VALUES (new.message_id);
+        INSERT OR REPLACE INTO chats_message_fts(rowid, message_body, message_id)
+        SELECT doc, new.message_body, new.message_id
+        FROM chats_message_search_doc WHERE message_id = new.message_id;
+    END
+    """,
+    """
+    CREATE TRIGGER chats_message_fts_delete AFTER DELETE ON chats_message BEGIN
+        DELETE FROM chats_message_fts
+        WHERE rowid = (SELECT doc FROM chats_message_search_doc WHERE message_id = old.message_id);
+        DELETE FROM chats_message_search_doc WHERE message_id = old.message_id;
+    END
+    """,
+    """
+    CREATE TRIGGER chats_message_fts_update
+    AFTER UPDATE OF message_body ON chats_message BEGIN
+        UPDATE chats_message_fts SET message_body = new.message_body
+        WHERE rowid = (SELECT doc FROM chats_message_search_doc WHERE message_id = new.message_id);
+    END
+    """,
+    # Index the messages that already exist
+    'INSERT INTO chats_message_search_doc(message_id) SELECT message_id FROM chats_message',
+    """
+    INSERT INTO chats_message_fts(rowid, message_body, message_id)
+    SELECT d.doc, m.message_body, m.message_id FROM chats_message_search_doc d
+    INNER JOIN chats_message m ON m.message_id = d.message_id
+    """,
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS chats_message_fts_insert',
+    'DROP TRIGGER IF EXISTS chats_message_fts_delete',
+    'DROP TRIGGER IF EXISTS chats_message_fts_update',
+    'DROP TABLE IF EXISTS chats_message_fts',
+    'DROP TABLE IF EXISTS chats_message_search_doc',
+]
+
+
+def run_on_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0005_last_message'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_sqlite(CREATE_SQL), run_on_sqlite(DROP_SQL)),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:53
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_participant_keys(apps, schema_editor):
+    """Key every conversation; the oldest of each two-person set becomes direct"""
+    Conversation = apps.get_model('chats', 'Conversation')
+    Participant = Conversation.participants.through
+
+    members = {}
+    for conversation_id, user_id in Participant.objects.values_list('conversation_id', 'user_id'):
+        members.setdefault(conversation_id, []).append(str(user_id))
+
+    direct_keys = set()
+    conversations = []
+    for conversation in Conversation.objects.order_by('created_at', 'conversation_id'):
+        user_ids = sorted(set(members.get(conversation.conversation_id, ())))
+        conversation.participant_key = hashlib.sha256(','.join(user_ids).encode()).hexdigest()
+        conversation.is_direct = (
+            len(user_ids) == 2 and conversation.participant_key not in direct_keys
+        )
+        if conversation.is_direct:
+            direct_keys.add(conversation.participant_key)
+        conversations.append(conversation)
+    Conversation.objects.bulk_update(
+        conversations, ['participant_key', 'is_direct'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0007_user_online_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='is_direct',
+            field=models.BooleanField(default=False, help_text='One-to-one conversation; at most one exists per pair of users'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='participant_key',
+            field=models.CharField(blank=True, help_text='Hash of the sorted participant IDs, maintained on participant changes', max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_participant_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_direct', True)), fields=('participant_key',), name='unique_direct_conversation'),
+        ),
+    ]
@@ -22,8 +22,16 @@ class User(AbstractUser):
     first_name = models.CharField(max_length=30, blank=False)
     last_name = models.CharField(max_length=150, blank=False)
     phone_number = models.CharField(max_length=20, blank=True, null=True)
-    last_activity = models.DateTimeField(default=timezone.now)
+    last_activity = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text='Time of the latest request; empty until the user makes one'
+    )
     online_status = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        help_text='Last change to the profile; used for sync and ETags'
+    )
     
     # Password field is inherited from AbstractUser
     password = models.CharField(_("password"), max_length=128)
@@ -35,6 +43,13 @@ class User(AbstractUser):
     class Meta:
         verbose_name = 'User'
         verbose_name_plural = 'Users'
+        indexes = [
+            # Expiring online flags in presence flushes
+            models.Index(
+                fields=['online_status', 'last_activity'],
+                name='user_online_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.email})"
@@ -49,22 +64,76 @@ class Conversation(models.Model):
     )
     participants = models.ManyToManyField(
         User,
+        through='ConversationParticipant',
         related_name='conversations',
         help_text='Users participating in this conversation'
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    last_message_at = models.DateTimeField(
+        default=timezone.now,
+        help_text='sent_at of the newest message; creation time while empty'
+    )
+    last_message_id = models.UUIDField(
+        null=True,
+        blank=True,
+        help_text='ID of the newest message, maintained with last_message_at'
+    )
+    participant_key = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        help_text='Hash of the sorted participant IDs, maintained on participant changes'
+    )
+    is_direct = models.BooleanField(
+        default=False,
+        help_text='One-to-one conversation; at most one exists per pair of users'
+    )
     
     class Meta:
         ordering = ['-updated_at']
         verbose_name = 'Conversation'
         verbose_name_plural = 'Conversations'
+        indexes = [
+            # Inbox ordering by latest activity
+            models.Index(
+                fields=['last_message_at', 'conversation_id'],
+                name='conversation_last_message_idx'
+            ),
+        ]
+        constraints = [
+            # "The conversation between A and B" is one indexed lookup
+            models.UniqueConstraint(
+                fields=['participant_key'],
+                condition=models.Q(is_direct=True),
+                name='unique_direct_conversation'
+            ),
+        ]
     
     def __str__(self):
         participants = self.participants.all()
         names = [f"{user.first_name} {user.last_name}" for user in participants]
         return f"Conversation: {', '.join(names)}"
 
+class ConversationParticipant(models.Model):
+    """Membership of a user in a conversation (the participants table)"""
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    class Meta:
+        db_table = 'chats_conversation_participants'
+        unique_together = [('conversation', 'user')]
+        indexes = [
+            # "Conversations of user X" joins, index-only
+            models.Index(
+                fields=['user', 'conversation'],
+                name='participant_user_conv_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} in {self.conversation_id}"
+
 class Message(models.Model):
     """Model representing a message within a conversation"""
     message_id = models.UUIDField(
@@ -99,11 +168,78 @@ class Message(models.Model):
         default=False,
         help_text='Has the message been read by the recipient?'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        help_text='Last change to the message; bulk updates must set it explicitly'
+    )
     
     class Meta:
         ordering = ['sent_at']
         verbose_name = 'Message'
         verbose_name_plural = 'Messages'
+        indexes = [
+            # Message listings within a conversation, incl. keyset pagination
+            models.Index(
+                fields=['conversation_id', 'sent_at', 'message_id'],
+                name='message_conversation_sent_idx'
+            ),
+            # Unread counting on the legacy is_read flag
+            models.Index(
+                fields=['conversation_id', 'is_read', 'sender'],
+                name='message_conversation_read_idx'
+            ),
+            # "Messages I sent", newest first
+            models.Index(
+                fields=['sender', 'sent_at'],
+                name='message_sender_sent_idx'
+            ),
+            # Delta sync and ETags: changes per conversation since a point in time
+            models.Index(
+                fields=['conversation_id', 'updated_at'],
+                name='message_conversation_upd_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.sender.email}: {self.message_body[:50]}"
+
+class ConversationReadState(models.Model):
+    """Per-participant read watermark and unread counter for a conversation"""
+    user = models.ForeignKey(
+        User,
+        related_name='read_states',
+        on_delete=models.CASCADE,
+        help_text='Participant this read state belongs to'
+    )
+    conversation = models.ForeignKey(
+        Conversation,
+        related_name='read_states',
+        on_delete=models.CASCADE,
+        help_text='Conversation this read state tracks'
+    )
+    last_read_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text='sent_at of the newest message the user has read'
+    )
+    unread_count = models.PositiveIntegerField(
+        default=0,
+        help_text='Messages from other participants sent after last_read_at'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        help_text='Last change to this read state; bulk updates must set it explicitly'
+    )
+
+    class Meta:
+        verbose_name = 'Conversation Read State'
+        verbose_name_plural = 'Conversation Read States'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'conversation'],
+                name='unique_read_state_per_participant'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} in {self.conversation_id}: {self.unread_count} unread"
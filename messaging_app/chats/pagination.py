@@ -0,0 +1,297 @@
+import uuid
+from base64 import b64decode, b64encode
+from urllib import parse
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class StandardResultsSetPagination(PageNumberPagination):
+    """
+    Default page-number pagination for chats endpoints.
+
+    ``?count=false`` skips the ``COUNT(*)`` entirely (``count`` is null and
+    ``next`` is detected by fetching one extra row); ``?count=estimate``
+    counts at most ``count_estimate_cap`` rows and reports whether the
+    figure is exact.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    count_query_param = 'count'
+    count_estimate_cap = 1000
+
+    def get_count_mode(self, request):
+        mode = request.query_params.get(self.count_query_param, 'exact').lower()
+        if mode in ('false', 'none', '0'):
+            return 'none'
+        if mode == 'estimate':
+            return 'estimate'
+        return 'exact'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_mode = self.get_count_mode(request)
+        if self.count_mode == 'exact':
+            return super().paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        page_number = request.query_params.get(self.page_query_param) or 1
+        try:
+            page_number = int(page_number)
+            if page_number < 1:
+                raise ValueError
+        except ValueError:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message='Invalid page.'
+            ))
+
+        offset = (page_number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        if not rows and page_number != 1:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message='That page contains no results'
+            ))
+
+        self.request = request
+        self.page_number = page_number
+        self.has_next = len(rows) > page_size
+        self.count = None
+        self.count_is_exact = False
+        if self.count_mode == 'estimate':
+            self.count = queryset.order_by()[:self.count_estimate_cap].count()
+            self.count_is_exact = self.count < self.count_estimate_cap
+        return rows[:page_size]
+
+    def get_next_link(self):
+        if self.count_mode == 'exact':
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if self.count_mode == 'exact':
+            return super().get_previous_link()
+        if self.page_number == 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page_number - 1)
+
+    def get_paginated_response(self, data):
+        if self.count_mode == 'exact':
+            return super().get_paginated_response(data)
+        return Response({
+            'count': self.count,
+            'count_is_exact': self.count_is_exact,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class MessageKeysetPagination(BasePagination):
+    """
+    Opaque-cursor pagination for messages keyed on ``(sent_at, message_id)``.
+
+    Every page is fetched with a ``WHERE (sent_at, message_id) > cursor``
+    style filter and ``LIMIT page_size + 1``, so there is no OFFSET scan and
+    no ``COUNT(*)``; the cost of a page does not depend on how deep it is.
+    """
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    mode_query_value = 'cursor'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-sent_at', '-message_id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    @classmethod
+    def is_requested(cls, request):
+        """True when the client asked for cursor pagination"""
+        params = request.query_params
+        return (
+            cls.cursor_query_param in params
+            or params.get(cls.mode_query_param) == cls.mode_query_value
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = tuple(getattr(view, 'keyset_ordering', self.ordering))
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor[0] == 'p'
+        results = self.fetch(queryset, None if cursor is None else cursor[1:], reverse)
+        has_more = len(results) > self.page_size
+        page = results[:self.page_size]
+
+        if reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        self.page = page
+        return page
+
+    def fetch(self, queryset, after, reverse):
+        """
+        Up to ``page_size + 1`` rows following the ``(sent_at, message_id)``
+        position ``after``, in ``ordering`` or, with ``reverse``, against it
+        """
+        ordering = self._reversed(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if after is not None:
+            queryset = queryset.filter(self._after(ordering, *after))
+        return list(queryset[:self.page_size + 1])
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor('n', self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor('p', self.page[0])
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def cursor_position(self, message):
+        """The sort value of ``message`` as cursor text, and its key"""
+        return message.sent_at.isoformat(), message.message_id
+
+    def parse_position(self, text):
+        """The sort value encoded by ``cursor_position``; ValueError if malformed"""
+        sent_at = parse_datetime(text)
+        if sent_at is None:
+            raise ValueError(text)
+        return sent_at
+
+    def encode_cursor(self, direction, message):
+        """Build the URL for a page starting after/before ``message``"""
+        position, key = self.cursor_position(message)
+        querystring = parse.urlencode({
+            'd': direction,
+            't': position,
+            'k': str(key),
+        })
+        encoded = b64encode(querystring.encode('ascii')).decode('ascii')
+        url = remove_query_param(self.base_url, self.mode_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        """Return ``(direction, position, message_id)`` or None for the first page"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+            direction = tokens['d'][0]
+            position = self.parse_position(tokens['t'][0])
+            message_id = uuid.UUID(tokens['k'][0])
+        except (TypeError, ValueError, KeyError, IndexError):
+            raise NotFound(self.invalid_cursor_message)
+        if direction not in ('n', 'p'):
+            raise NotFound(self.invalid_cursor_message)
+        return direction, position, message_id
+
+    @staticmethod
+    def _reversed(ordering):
+        return tuple(
+            field[1:] if field.startswith('-') else f'-{field}'
+            for field in ordering
+        )
+
+    @staticmethod
+    def _after(ordering, sent_at, message_id):
+        """Row-value comparison ``(sent_at, message_id) > cursor`` in ``ordering``"""
+        (time_field, key_field) = ordering
+        time_op = 'lt' if time_field.startswith('-') else 'gt'
+        key_op = 'lt' if key_field.startswith('-') else 'gt'
+        time_name = time_field.lstrip('-')
+        key_name = key_field.lstrip('-')
+        return (
+            Q(**{f'{time_name}__{time_op}': sent_at})
+            | Q(**{time_name: sent_at, f'{key_name}__{key_op}': message_id})
+        )
+
+
+class SearchKeysetPagination(MessageKeysetPagination):
+    """
+    Keyset pagination for ``MessageSearch`` results: the cursor holds the
+    rank (the send time without FTS5) and id of the last hit, so deep pages
+    cost the same as the first and no ``COUNT(*)`` runs over the matches.
+    """
+
+    def paginate_queryset(self, search, request, view=None):
+        self.search = search
+        return super().paginate_queryset(search, request, view)
+
+    def fetch(self, search, after, reverse):
+        return search.page(self.page_size + 1, after=after, reverse=reverse)
+
+    def cursor_position(self, hit):
+        return hit.sort_key, hit.message_id
+
+    def parse_position(self, text):
+        return self.search.parse_key(text)
+
+
+class KeysetPaginationMixin:
+    """
+    Viewset mixin that switches selected actions to keyset pagination when
+    the client passes ``?pagination=cursor`` or a ``cursor`` token.
+    """
+    keyset_actions = ()
+    keyset_ordering = MessageKeysetPagination.ordering
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if (
+                self.action in self.keyset_actions
+                and MessageKeysetPagination.is_requested(self.request)
+            ):
+                self._paginator = MessageKeysetPagination()
+            else:
+                return super().paginator
+        return self._paginator
@@ -0,0 +1,58 @@
+"""
+Canonical participant sets and direct conversations.
+
+Every conversation stores ``participant_key``, a hash of its sorted
+participant IDs, kept current by a signal on participant changes. A
+two-person conversation is marked ``is_direct`` unless another direct
+conversation already covers the pair, and a partial unique index on the
+key of direct conversations makes "the conversation between A and B" a
+single indexed lookup that cannot be duplicated.
+"""
+import hashlib
+
+from django.db import IntegrityError, transaction
+
+from .models import Conversation
+
+
+def participant_key(user_ids):
+    """Order-independent hash of a set of user IDs"""
+    members = sorted({str(user_id) for user_id in user_ids})
+    return hashlib.sha256(','.join(members).encode()).hexdigest()
+
+
+def refresh_participant_key(conversation_id):
+    """Recompute the key and direct flag after participants changed"""
+    user_ids = list(
+        Conversation.participants.through.objects.filter(
+            conversation_id=conversation_id
+        ).values_list('user_id', flat=True)
+    )
+    key = participant_key(user_ids)
+    # A group shrinking to a pair that already has a direct chat stays a group
+    is_direct = len(set(user_ids)) == 2 and not Conversation.objects.filter(
+        participant_key=key, is_direct=True
+    ).exclude(conversation_id=conversation_id).exists()
+    Conversation.objects.filter(conversation_id=conversation_id).update(
+        participant_key=key, is_direct=is_direct
+    )
+
+
+def get_or_create_direct(user, other):
+    """
+    The direct conversation between two users, created if needed.
+
+    Returns ``(conversation, created)``. Concurrent creators race on the
+    unique index; the loser returns the winner's conversation.
+    """
+    key = participant_key([user.pk, other.pk])
+    existing = Conversation.objects.filter(participant_key=key, is_direct=True).first()
+    if existing is not None:
+        return existing, False
+    try:
+        with transaction.atomic():
+            conversation = Conversation.objects.create(participant_key=key, is_direct=True)
+            conversation.participants.add(user, other)
+    except IntegrityError:
+        return Conversation.objects.get(participant_key=key, is_direct=True), False
+    return conversation, True
@@ -1,5 +1,7 @@
 from rest_framework import permissions
 
+from . import membership
+
 class IsMessageOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         # For messages: access only if user is sender
@@ -8,4 +10,4 @@ class IsMessageOwner(permissions.BasePermission):
 class IsConversationParticipant(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         # For conversations: access only if user is a participant
-        return request.user in obj.participants.all()
+        return membership.is_participant(request.user, obj, request)
@@ -0,0 +1,131 @@
+"""
+Write-behind presence tracking.
+
+Requests only record "user X was active at T" in an in-memory buffer.
+Every ``FLUSH_INTERVAL`` seconds (sooner once ``MAX_BUFFERED`` users are
+waiting) a background ``Flusher`` thread writes all buffered activity with
+one bulk UPDATE and, in the same pass, clears ``online_status`` for users
+whose activity is older than ``ONLINE_TTL``. Write load therefore grows
+with the flush rate, not with the request rate, and no request waits for
+a flush.
+
+Presence is not part of a user's versioned data: flushes leave
+``updated_at`` alone, so they change no ETag and retire no cached profile
+or authenticated user. Cached profiles are stored without presence and
+get it added from ``states`` when served.
+
+Online status is derived from ``last_activity``: a user is online while
+their latest activity is younger than ``ONLINE_TTL``. ``lookup`` answers
+that for many users with one query, overlaid with the activity still
+buffered in this process. The stored ``online_status`` column follows the
+same rule, lagging by at most one flush interval.
+"""
+import threading
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .flusher import Flusher
+from .models import User
+
+ONLINE_TTL = timedelta(minutes=5)
+FLUSH_INTERVAL = 30  # seconds
+MAX_BUFFERED = 10000
+FLUSH_BATCH_SIZE = 500
+
+
+def is_online(last_activity, now=None):
+    if last_activity is None:
+        return False
+    return last_activity >= (now or timezone.now()) - ONLINE_TTL
+
+
+class PresenceBuffer:
+    """Thread-safe buffer of the latest activity per user"""
+
+    def __init__(self, interval=FLUSH_INTERVAL, max_buffered=MAX_BUFFERED):
+        self.interval = interval
+        self.max_buffered = max_buffered
+        self._activity = {}
+        self._lock = threading.Lock()
+        self.flusher = Flusher('presence-flush', self.flush, interval)
+
+    def touch(self, user_id, when=None):
+        """
+        Record activity for ``user_id``. Never touches the database, so
+        async code may call it too.
+        """
+        when = when or timezone.now()
+        with self._lock:
+            if user_id not in self._activity or when > self._activity[user_id]:
+                self._activity[user_id] = when
+            full = len(self._activity) >= self.max_buffered
+        if full:
+            self.flusher.wake()
+        else:
+            self.flusher.start()
+
+    def recent(self, user_ids):
+        """Buffered activity for ``user_ids`` that is not in the database yet"""
+        with self._lock:
+            return {
+                user_id: self._activity[user_id]
+                for user_id in user_ids if user_id in self._activity
+            }
+
+    def flush(self):
+        """Write buffered activity and expire stale online flags; returns users written"""
+        with self._lock:
+            activity, self._activity = self._activity, {}
+
+        users = [
+            User(user_id=user_id, last_activity=when, online_status=True)
+            for user_id, when in activity.items()
+        ]
+        if users:
+            User.objects.bulk_update(
+                users, ['last_activity', 'online_status'], batch_size=FLUSH_BATCH_SIZE
+            )
+        User.objects.filter(
+            online_status=True, last_activity__lt=timezone.now() - ONLINE_TTL
+        ).update(online_status=False)
+        return len(users)
+
+    def clear(self):
+        with self._lock:
+            self._activity.clear()
+
+
+buffer = PresenceBuffer()
+
+
+def lookup(users):
+    """
+    ``{user_id: {'online': bool, 'last_activity': datetime}}`` for ``users``
+    (ids, or a queryset/subquery of ids), in one query.
+    """
+    return states(User.objects.filter(pk__in=users).values_list('pk', 'last_activity'))
+
+
+def states(stored):
+    """
+    ``lookup``'s answer from ``(user_id, last_activity)`` pairs already read
+    from the database, overlaid with the activity buffered in this process
+    """
+    now = timezone.now()
+    stored = dict(stored)
+    for user_id, when in buffer.recent(stored).items():
+        stored[user_id] = max(when, stored[user_id] or when)
+    return {
+        user_id: {'online': is_online(last_activity, now), 'last_activity': last_activity}
+        for user_id, last_activity in stored.items()
+    }
+
+
+class PresenceMixin:
+    """Viewset mixin recording the authenticated user's activity on every request"""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.user.is_authenticated:
+            buffer.touch(request.user.pk)
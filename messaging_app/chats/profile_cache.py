@@ -0,0 +1,78 @@
+"""
+Cache of serialized user profiles on Django's cache framework.
+
+Each user has a version token under its own key, and profiles are stored
+under keys that embed that token. Invalidation just replaces the token
+once the transaction that changed the user commits (``post_save`` and
+``post_delete`` of ``User``), so every process sharing the cache stops
+seeing old entries at once and they age out on their own. A missing token
+is replaced by a fresh random one rather than a counter restarting at
+zero, so an evicted token can never resurrect an old entry.
+
+Tokens expire as well, after the profiles stored under them, and are only
+created together with a profile to store: looking up users that do not
+exist leaves nothing behind.
+"""
+import uuid
+
+from django.core.cache import cache
+
+PROFILE_TIMEOUT = 60 * 60  # seconds
+# Outlives the profiles stored under it; an expired token only costs a reload
+VERSION_TIMEOUT = 2 * PROFILE_TIMEOUT
+
+_VERSION_KEY = 'chats:profile-version:{}'
+_PROFILE_KEY = 'chats:profile:{}:{}'
+
+
+def _token():
+    return uuid.uuid4().hex[:12]
+
+
+def versions(user_ids):
+    """Current version token per user id; users without one are left out"""
+    keys = {_VERSION_KEY.format(user_id): user_id for user_id in user_ids}
+    return {keys[key]: version for key, version in cache.get_many(keys).items()}
+
+
+def invalidate(user_ids):
+    """Make every cached profile of ``user_ids`` unreachable"""
+    cache.set_many(
+        {_VERSION_KEY.format(user_id): _token() for user_id in user_ids},
+        timeout=VERSION_TIMEOUT,
+    )
+
+
+def get_many(user_ids, load):
+    """
+    Serialized profiles for ``user_ids``, in order.
+
+    ``load(missing_ids)`` returns ``{user_id: data}`` for the profiles that
+    were not cached; users it does not return are left out. Versions are
+    read before loading, so data loaded while a user changes is stored
+    under the outdated version and never served. A user without a version
+    gets one only if nobody created one meanwhile (``cache.add``);
+    otherwise the loaded profile is not stored.
+    """
+    current = versions(user_ids)
+    keys = {
+        user_id: _PROFILE_KEY.format(user_id, current[user_id])
+        for user_id in user_ids if user_id in current
+    }
+    cached = cache.get_many(keys.values())
+
+    profiles = {user_id: cached[key] for user_id, key in keys.items() if key in cached}
+    missing = [user_id for user_id in user_ids if user_id not in profiles]
+    if missing:
+        loaded = load(missing)
+        store = {}
+        for user_id, data in loaded.items():
+            if user_id not in current:
+                version = _token()
+                if not cache.add(_VERSION_KEY.format(user_id), version, timeout=VERSION_TIMEOUT):
+                    continue
+                keys[user_id] = _PROFILE_KEY.format(user_id, version)
+            store[keys[user_id]] = data
+        cache.set_many(store, timeout=PROFILE_TIMEOUT)
+        profiles.update(loaded)
+    return [profiles[user_id] for user_id in user_ids if user_id in profiles]
@@ -0,0 +1,159 @@
+"""
+Read-state bookkeeping for conversations.
+
+Each participant has one ``ConversationReadState`` row holding a last-read
+watermark and a denormalized unread counter, so unread counts are read
+from a single indexed row instead of counting messages on every request.
+"""
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ConversationReadState, Message
+
+
+def ensure_read_states(conversation, user_ids):
+    """Create read states for participants added to ``conversation``"""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    existing = set(
+        ConversationReadState.objects.filter(
+            conversation=conversation, user_id__in=user_ids
+        ).values_list('user_id', flat=True)
+    )
+    missing = user_ids - existing
+    if not missing:
+        return
+
+    # Messages already in the conversation count as unread for newcomers,
+    # except the ones they sent themselves
+    per_sender = dict(
+        Message.objects.filter(conversation_id=conversation)
+        .values_list('sender')
+        .annotate(total=Count('pk'))
+        .order_by()
+    )
+    total = sum(per_sender.values())
+    ConversationReadState.objects.bulk_create(
+        [
+            ConversationReadState(
+                user_id=user_id,
+                conversation=conversation,
+                unread_count=total - per_sender.get(user_id, 0),
+            )
+            for user_id in missing
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def remove_read_states(conversation, user_ids=None):
+    """Drop read states for participants removed from ``conversation``"""
+    states = ConversationReadState.objects.filter(conversation=conversation)
+    if user_ids is not None:
+        states = states.filter(user_id__in=user_ids)
+    states.delete()
+
+
+def record_new_messages(conversation_id, sender_id, count=1):
+    """Bump the unread counter of every participant except the sender"""
+    return ConversationReadState.objects.filter(
+        conversation_id=conversation_id
+    ).exclude(user_id=sender_id).update(
+        unread_count=F('unread_count') + count, updated_at=timezone.now()
+    )
+
+
+def mark_read_up_to(user, message):
+    """
+    Move ``user``'s watermark in the message's conversation forward to
+    ``message`` and recount what is still unread after it.
+    """
+    state, _ = ConversationReadState.objects.get_or_create(
+        user=user, conversation_id=message.conversation_id_id
+    )
+    if state.last_read_at is not None and state.last_read_at >= message.sent_at:
+        return state
+
+    unread = Message.objects.filter(
+        conversation_id=message.conversation_id_id,
+        sent_at__gt=message.sent_at,
+    ).exclude(sender=user).count()
+    # The guard is part of the UPDATE: a concurrent call that already moved
+    # the watermark further must not be overwritten with an older one
+    moved = ConversationReadState.objects.filter(
+        Q(last_read_at__isnull=True) | Q(last_read_at__lt=message.sent_at),
+        pk=state.pk,
+    ).update(
+        last_read_at=message.sent_at, unread_count=unread, updated_at=timezone.now()
+    )
+    if moved:
+        state.last_read_at, state.unread_count = message.sent_at, unread
+    else:
+        state.refresh_from_db(fields=['last_read_at', 'unread_count', 'updated_at'])
+    return state
+
+
+def apply_receipt(user_id, conversation_id, read_up_to):
+    """
+    Move a watermark forward to ``read_up_to`` (a ``sent_at``) with one
+    conditional UPDATE, and flag the newly read messages with one bulk
+    UPDATE. Returns False when the watermark was already there.
+    """
+    now = timezone.now()
+    still_unread = Message.objects.filter(
+        conversation_id=OuterRef('conversation_id'), sent_at__gt=read_up_to
+    ).exclude(sender_id=user_id).order_by().values('conversation_id').annotate(
+        total=Count('pk')
+    ).values('total')
+
+    with transaction.atomic():
+        moved = ConversationReadState.objects.filter(
+            Q(last_read_at__isnull=True) | Q(last_read_at__lt=read_up_to),
+            user_id=user_id,
+            conversation_id=conversation_id,
+        ).update(
+            last_read_at=read_up_to,
+            unread_count=Coalesce(Subquery(still_unread), Value(0)),
+            updated_at=now,
+        )
+        if moved:
+            Message.objects.filter(
+                conversation_id=conversation_id, is_read=False, sent_at__lte=read_up_to
+            ).exclude(sender_id=user_id).update(is_read=True, updated_at=now)
+    return bool(moved)
+
+
+def mark_conversation_read(user, conversation):
+    """Move ``user``'s watermark to now and clear the unread counter"""
+    conversation_id = getattr(conversation, 'pk', conversation)
+    now = timezone.now()
+    updated = ConversationReadState.objects.filter(
+        user=user, conversation_id=conversation_id
+    ).update(last_read_at=now, unread_count=0, updated_at=now)
+    if not updated:
+        ConversationReadState.objects.create(
+            user=user, conversation_id=conversation_id, last_read_at=now
+        )
+
+
+def unread_count_subquery(user):
+    """Expression annotating each conversation with ``user``'s unread count"""
+    return Coalesce(
+        Subquery(
+            ConversationReadState.objects.filter(
+                conversation=OuterRef('pk'), user=user
+            ).values('unread_count')[:1]
+        ),
+        Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def unread_count_for(user, conversation):
+    """Unread count for a single conversation (one indexed lookup)"""
+    return ConversationReadState.objects.filter(
+        user=user, conversation=conversation
+    ).values_list('unread_count', flat=True).first() or 0
@@ -0,0 +1,132 @@
+"""
+In-process pub/sub for pushing new messages to connected clients.
+
+Each server process keeps a ``Broker`` mapping conversation ids to the
+subscriptions of clients streaming that conversation. ``publish`` is
+thread-safe and may be called from sync request threads; delivery happens
+on each subscriber's event loop. Nothing leaves the process, so a
+multi-process deployment needs a shared broker behind the same interface.
+"""
+import asyncio
+import threading
+
+from rest_framework.renderers import JSONRenderer
+
+from .serializers import CompactMessageSerializer
+
+QUEUE_SIZE = 100
+
+
+class SubscriptionOverflow(Exception):
+    """The subscriber fell too far behind and missed events"""
+
+
+class Subscription:
+    """A single client's queue of events for one channel"""
+
+    def __init__(self, broker, channel, maxsize=QUEUE_SIZE):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def deliver(self, event):
+        """Runs on the subscriber's loop"""
+        if self.queue.full():
+            self.overflowed = True
+            return
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        """Next event, or None after ``timeout`` seconds without one"""
+        if self.overflowed:
+            raise SubscriptionOverflow(self.channel)
+        try:
+            event = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            event = None
+        if self.overflowed:
+            raise SubscriptionOverflow(self.channel)
+        return event
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    """Thread-safe in-memory fan-out of events to per-channel subscribers"""
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        """Subscribe the running event loop to ``channel``"""
+        subscription = Subscription(self, channel, self.queue_size)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._channels[subscription.channel]
+
+    def publish(self, channel, event):
+        """Hand ``event`` to every subscriber of ``channel``; returns the fan-out"""
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        delivered = 0
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+                delivered += 1
+            except RuntimeError:
+                # The subscriber's loop is gone
+                self.unsubscribe(subscription)
+        return delivered
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if channel is not None:
+                return len(self._channels.get(channel, ()))
+            return sum(len(s) for s in self._channels.values())
+
+
+broker = Broker()
+
+
+def message_channel(conversation_id):
+    return f'conversation:{conversation_id}'
+
+
+def publish_messages(messages):
+    """Publish new messages to their conversations' subscribers"""
+    renderer = JSONRenderer()
+    for message in messages:
+        channel = message_channel(message.conversation_id_id)
+        # Nobody listening: skip serialization entirely
+        if not broker.subscriber_count(channel):
+            continue
+        data = renderer.render(CompactMessageSerializer(message).data).decode()
+        broker.publish(
+            channel,
+            {'id': str(message.message_id), 'event': 'message', 'data': data},
+        )
+
+
+def format_sse(event):
+    """Encode a broker event as a Server-Sent Events frame"""
+    lines = []
+    if event.get('id'):
+        lines.append(f"id: {event['id']}")
+    if event.get('event'):
+        lines.append(f"event: {event['event']}")
+    for line in event.get('data', '').splitlines() or ['']:
+        lines.append(f'data: {line}')
+    return ('\n'.join(lines) + '\n\n').encode()
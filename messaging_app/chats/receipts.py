@@ -0,0 +1,145 @@
+"""
+Read receipts: "read up to message X in conversation Y".
+
+A receipt moves a watermark, so a newer receipt supersedes every older one
+for the same user and conversation. ``ReceiptBuffer`` uses that to bound
+writes: per (user, conversation) at most one receipt is applied every
+``interval`` seconds; receipts arriving in between only replace the
+pending watermark in memory, and receipts at or behind the watermark are
+dropped. A client scrolling through a backlog therefore costs a couple of
+UPDATEs, not one per message.
+
+Pending receipts are written when a later receipt for the same pair
+arrives after the interval, by a background ``Flusher`` thread once they
+are due (so within two intervals, whether or not more traffic arrives),
+and before the user's own conversations or messages are read (``flush``
+with ``user_id``), so nobody observes their own stale unread counts. Due
+receipts are found through a heap ordered by due time, so a flush only
+looks at the receipts it writes.
+Buffers are process-local; a process that dies loses at most two
+intervals of receipts, which clients resend on their next read.
+"""
+import heapq
+import threading
+import time
+from collections import OrderedDict
+
+from . import read_state
+from .flusher import Flusher
+
+RECEIPT_INTERVAL = 2  # seconds between writes per (user, conversation)
+MAX_TRACKED = 10000
+
+APPLIED, QUEUED, STALE = 'applied', 'queued', 'stale'
+
+
+class ReceiptBuffer:
+    """Thread-safe per-(user, conversation) coalescing of read receipts"""
+
+    def __init__(self, interval=RECEIPT_INTERVAL, max_tracked=MAX_TRACKED):
+        self.interval = interval
+        self.max_tracked = max_tracked
+        # user_id -> {conversation_id: read_up_to}
+        self._pending = {}
+        # (user_id, conversation_id) -> (read_up_to, monotonic time of the write)
+        self._applied = OrderedDict()
+        # Heap of (due time, user_id, conversation_id), one per pending receipt;
+        # entries whose receipt was written early are skipped when popped
+        self._due = []
+        self._lock = threading.Lock()
+        self.flusher = Flusher('receipt-flush', lambda: self.flush(due_only=True), interval)
+
+    def submit(self, user_id, conversation_id, read_up_to):
+        """Record a receipt; returns ``APPLIED``, ``QUEUED`` or ``STALE``"""
+        key = (user_id, conversation_id)
+        now = time.monotonic()
+        with self._lock:
+            applied = self._applied.get(key)
+            pending = self._pending.get(user_id, {}).get(conversation_id)
+            seen = [w for w in (pending, applied[0] if applied else None) if w is not None]
+            if seen and read_up_to <= max(seen):
+                outcome = STALE
+            elif applied is not None and now - applied[1] < self.interval:
+                if pending is None:
+                    heapq.heappush(self._due, (applied[1] + self.interval, user_id, conversation_id))
+                self._pending.setdefault(user_id, {})[conversation_id] = read_up_to
+                outcome = QUEUED
+            else:
+                self._discard_pending(user_id, conversation_id)
+                self._mark_applied(key, read_up_to, now)
+                outcome = APPLIED
+
+        if outcome == APPLIED:
+            read_state.apply_receipt(user_id, conversation_id, read_up_to)
+        elif outcome == QUEUED:
+            self.flusher.start()
+        return outcome
+
+    def flush(self, user_id=None, due_only=False):
+        """
+        Write pending receipts: all of them, only ``user_id``'s, or (with
+        ``due_only``) those whose interval has passed. Returns how many
+        were written.
+        """
+        now = time.monotonic()
+        batch = []
+        with self._lock:
+            if due_only:
+                keys = self._pop_due(now)
+            else:
+                users = [user_id] if user_id is not None else list(self._pending)
+                keys = [
+                    (user, conversation_id)
+                    for user in users
+                    for conversation_id in self._pending.get(user, ())
+                ]
+            for user, conversation_id in keys:
+                read_up_to = self._pending[user][conversation_id]
+                self._discard_pending(user, conversation_id)
+                self._mark_applied((user, conversation_id), read_up_to, now)
+                batch.append((user, conversation_id, read_up_to))
+
+        for user, conversation_id, read_up_to in batch:
+            read_state.apply_receipt(user, conversation_id, read_up_to)
+        return len(batch)
+
+    def pending_count(self):
+        with self._lock:
+            return sum(len(pending) for pending in self._pending.values())
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._applied.clear()
+            self._due.clear()
+
+    def _pop_due(self, now):
+        """Pending keys whose interval has passed, taken off the heap"""
+        keys = []
+        while self._due and self._due[0][0] <= now:
+            _, user_id, conversation_id = heapq.heappop(self._due)
+            if conversation_id not in self._pending.get(user_id, ()):
+                continue
+            applied = self._applied.get((user_id, conversation_id))
+            # Written early and queued again since: its newer entry is in the heap
+            if applied is not None and now - applied[1] < self.interval:
+                continue
+            keys.append((user_id, conversation_id))
+        return keys
+
+    def _mark_applied(self, key, read_up_to, now):
+        self._applied[key] = (read_up_to, now)
+        self._applied.move_to_end(key)
+        # Forgetting a write only makes the next receipt for that pair due
+        while len(self._applied) > self.max_tracked:
+            self._applied.popitem(last=False)
+
+    def _discard_pending(self, user_id, conversation_id):
+        pending = self._pending.get(user_id)
+        if pending is not None:
+            pending.pop(conversation_id, None)
+            if not pending:
+                del self._pending[user_id]
+
+
+buffer = ReceiptBuffer()
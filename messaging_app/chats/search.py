@@ -0,0 +1,222 @@
+"""
+Ranked full-text search over the messages a user can read.
+
+On SQLite, queries go to the ``chats_message_fts`` FTS5 index: matches
+come from the inverted index, are restricted to the user's conversations
+by joining ``chats_message`` on the ``message_id`` stored in the index, and
+are ordered by bm25. Other databases fall back to a case-insensitive
+substring filter without ranking or snippets.
+
+The index keeps its own copy of each body under a stable integer document
+id from ``chats_message_search_doc`` (migration 0006), so nothing depends
+on the rowids of ``chats_message``, which VACUUM may renumber. Triggers on
+``chats_message`` keep it in sync; table rebuilds drop them, so
+``install_index`` recreates them after every migrate.
+
+User input never reaches the FTS query language directly: every term is
+quoted, and the last one matches as a prefix so results update while the
+user types.
+"""
+import html
+import re
+import uuid
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .membership import visible_messages
+from .models import Conversation, Message
+
+FTS_TABLE = 'chats_message_fts'
+DOC_TABLE = 'chats_message_search_doc'
+
+# Same statements as migration 0006, recreated when missing
+TRIGGERS = {
+    'chats_message_fts_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS chats_message_fts_insert AFTER INSERT ON chats_message BEGIN
+            INSERT OR IGNORE INTO {DOC_TABLE}(message_id) VALUES (new.message_id);
+            INSERT OR REPLACE INTO {FTS_TABLE}(rowid, message_body, message_id)
+            SELECT doc, new.message_body, new.message_id
+            FROM {DOC_TABLE} WHERE message_id = new.message_id;
+        END
+    """,
+    'chats_message_fts_delete': f"""
+        CREATE TRIGGER IF NOT EXISTS chats_message_fts_delete AFTER DELETE ON chats_message BEGIN
+            DELETE FROM {FTS_TABLE}
+            WHERE rowid = (SELECT doc FROM {DOC_TABLE} WHERE message_id = old.message_id);
+            DELETE FROM {DOC_TABLE} WHERE message_id = old.message_id;
+        END
+    """,
+    'chats_message_fts_update': f"""
+        CREATE TRIGGER IF NOT EXISTS chats_message_fts_update
+        AFTER UPDATE OF message_body ON chats_message BEGIN
+            UPDATE {FTS_TABLE} SET message_body = new.message_body
+            WHERE rowid = (SELECT doc FROM {DOC_TABLE} WHERE message_id = new.message_id);
+        END
+    """,
+}
+
+# Highlight markers used inside SQLite; replaced after HTML-escaping
+_MARK_START, _MARK_END = '\x02', '\x03'
+SNIPPET_TOKENS = 12
+
+_TERM = re.compile(r'\w+')
+
+
+def fts_available(using=None):
+    db = connection if using is None else connections[using]
+    return db.vendor == 'sqlite'
+
+
+def rebuild_index(using=DEFAULT_DB_ALIAS):
+    """Re-index every message, e.g. after writes made while triggers were missing"""
+    if not fts_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(f'DELETE FROM {DOC_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {DOC_TABLE}(message_id) '
+            f'SELECT message_id FROM {Message._meta.db_table}'
+        )
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE}(rowid, message_body, message_id) '
+            f'SELECT d.doc, m.message_body, m.message_id FROM {DOC_TABLE} d '
+            f'INNER JOIN {Message._meta.db_table} m ON m.message_id = d.message_id'
+        )
+
+
+def install_index(using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Recreate index triggers dropped by a rebuild of ``chats_message`` (the
+    SQLite schema editor remakes tables for most field changes), then
+    re-index, since writes made in between were missed. Connected to
+    ``post_migrate``; does nothing before migration 0006 has run.
+    """
+    if not fts_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name IN (%s, %s)", [FTS_TABLE, DOC_TABLE]
+        )
+        if len(cursor.fetchall()) < 2:
+            return
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s",
+            [Message._meta.db_table],
+        )
+        missing = set(TRIGGERS) - {name for name, in cursor.fetchall()}
+        for name in sorted(missing):
+            cursor.execute(TRIGGERS[name])
+    if missing:
+        rebuild_index(using)
+
+
+def match_expression(text):
+    """FTS5 query matching every word of ``text``, or None when there are none"""
+    terms = _TERM.findall(text)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def highlight(snippet):
+    """HTML-escape a snippet and wrap matched terms in ``<mark>``"""
+    return (
+        html.escape(snippet)
+        .replace(_MARK_START, '<mark>')
+        .replace(_MARK_END, '</mark>')
+    )
+
+
+class SearchHit:
+    """One result; ``sort_key`` is its rank (or send time) as cursor text"""
+    __slots__ = ('message_id', 'snippet', 'sort_key')
+
+    def __init__(self, message_id, snippet, sort_key):
+        self.message_id = message_id
+        self.snippet = snippet
+        self.sort_key = sort_key
+
+
+class MessageSearch:
+    """
+    Search results, best match first, read a page at a time.
+
+    ``page()`` continues after a previous hit with a ``(rank, message_id)
+    > (hit rank, hit id)`` filter and a LIMIT, so a page never re-reads the
+    matches before it and nothing counts them all.
+    """
+
+    def __init__(self, user, text):
+        self.user = user
+        self.text = text
+        self.expression = match_expression(text)
+
+    def parse_key(self, text):
+        """The sort value of a hit's ``sort_key``; ValueError if malformed"""
+        if fts_available():
+            return float(text)
+        value = parse_datetime(text)
+        if value is None:
+            raise ValueError(text)
+        return value
+
+    def page(self, limit, after=None, reverse=False):
+        """
+        Up to ``limit`` hits following ``after``, a ``(sort value,
+        message_id)`` pair; with ``reverse``, the hits preceding it, nearest
+        first.
+        """
+        if self.expression is None:
+            return []
+        if not fts_available():
+            return self._fallback_page(limit, after, reverse)
+
+        comparison, direction = ('<', 'DESC') if reverse else ('>', 'ASC')
+        participants = Conversation.participants.through._meta.db_table
+        # UUIDs are stored as 32-character hex strings on SQLite
+        user_id = self.user.pk.hex
+        sql = (
+            f'SELECT m.message_id, snippet({FTS_TABLE}, 0, %s, %s, %s, %s), {FTS_TABLE}.rank '
+            f'FROM {FTS_TABLE} '
+            f'INNER JOIN {Message._meta.db_table} m ON m.message_id = {FTS_TABLE}.message_id '
+            f'WHERE {FTS_TABLE} MATCH %s AND ('
+            f'm.conversation_id IN (SELECT conversation_id FROM {participants} WHERE user_id = %s) '
+            f'OR m.sender_id = %s)'
+        )
+        params = [_MARK_START, _MARK_END, '…', SNIPPET_TOKENS, self.expression, user_id, user_id]
+        if after is not None:
+            rank, message_id = after
+            sql += (
+                f' AND ({FTS_TABLE}.rank {comparison} %s'
+                f' OR ({FTS_TABLE}.rank = %s AND m.message_id {comparison} %s))'
+            )
+            params += [rank, rank, message_id.hex]
+        sql += f' ORDER BY {FTS_TABLE}.rank {direction}, m.message_id {direction} LIMIT %s'
+        params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [
+                SearchHit(uuid.UUID(message_id), highlight(snippet), repr(rank))
+                for message_id, snippet, rank in cursor.fetchall()
+            ]
+
+    def _fallback_page(self, limit, after, reverse):
+        queryset = visible_messages(self.user)
+        for term in _TERM.findall(self.text):
+            queryset = queryset.filter(message_body__icontains=term)
+        # Newest first; reversed, oldest first from the cursor
+        op = 'gt' if reverse else 'lt'
+        if after is not None:
+            sent_at, message_id = after
+            queryset = queryset.filter(
+                Q(**{f'sent_at__{op}': sent_at})
+                | Q(sent_at=sent_at, **{f'message_id__{op}': message_id})
+            )
+        ordering = ('sent_at', 'message_id') if reverse else ('-sent_at', '-message_id')
+        rows = queryset.order_by(*ordering).values_list('message_id', 'sent_at')[:limit]
+        return [SearchHit(pk, None, sent_at.isoformat()) for pk, sent_at in rows]
@@ -1,5 +1,7 @@
 from rest_framework import serializers
 from .models import User, Conversation, Message
+from .participants import get_or_create_direct
+from . import read_state
 import uuid
 import re
 
@@ -106,12 +108,58 @@ class MessageSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Message is too long (max 1000 characters)")
         return value
 
+class BulkMessageItemSerializer(serializers.Serializer):
+    """One message in a bulk import; validated like MessageSerializer"""
+    message_body = serializers.CharField(trim_whitespace=False)
+
+    validate_message_body = MessageSerializer.validate_message_body
+
+class BulkMessageSerializer(serializers.Serializer):
+    """Batch of messages imported into a single conversation"""
+    MAX_MESSAGES = 5000
+
+    conversation_id = serializers.UUIDField()
+    messages = BulkMessageItemSerializer(
+        many=True,
+        allow_empty=False,
+        max_length=MAX_MESSAGES
+    )
+
+class ReadReceiptSerializer(serializers.Serializer):
+    """A read receipt: read up to ``message_id`` in ``conversation_id``"""
+    conversation_id = serializers.UUIDField()
+    message_id = serializers.UUIDField()
+
+class CompactMessageSerializer(serializers.ModelSerializer):
+    """Read-only message representation referencing the sender by ID"""
+    sender_id = serializers.UUIDField(read_only=True)
+    formatted_sent_at = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Message
+        fields = [
+            'message_id', 'conversation_id', 'sender_id',
+            'message_body', 'sent_at', 'formatted_sent_at', 'is_read'
+        ]
+        read_only_fields = fields
+
+    get_formatted_sent_at = MessageSerializer.get_formatted_sent_at
+
+    @staticmethod
+    def sideload_users(messages, context=None):
+        """Serialize each distinct sender of ``messages`` once, keyed by user ID"""
+        sender_ids = {message.sender_id for message in messages}
+        if not sender_ids:
+            return {}
+        users = User.objects.filter(user_id__in=sender_ids)
+        data = UserSerializer(users, many=True, context=context).data
+        return {user['user_id']: user for user in data}
+
 class ConversationSerializer(serializers.ModelSerializer):
     """Serializer for the Conversation model with nested messages"""
     participants = UserSerializer(many=True, read_only=True)
-    participant_ids = serializers.PrimaryKeyRelatedField(
-        queryset=User.objects.all(),
-        many=True,
+    participant_ids = serializers.ListField(
+        child=serializers.UUIDField(),
         source='participants',
         write_only=True
     )
@@ -130,28 +178,46 @@ class ConversationSerializer(serializers.ModelSerializer):
     
     def get_unread_count(self, obj):
         """Count of unread messages for current user"""
+        # List querysets annotate the count for the whole page in one query
+        annotated = getattr(obj, 'viewer_unread_count', None)
+        if annotated is not None:
+            return annotated
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return obj.messages.filter(is_read=False).exclude(sender=request.user).count()
+            return read_state.unread_count_for(request.user, obj)
         return 0
     
     def validate_participant_ids(self, value):
-        """Validate conversation participants"""
-        if len(value) < 2:
+        """Validate conversation participants and resolve them in one query"""
+        user_ids = list(dict.fromkeys(value))
+        if len(user_ids) < 2:
             raise serializers.ValidationError(
                 "A conversation must have at least 2 participants"
             )
-        if len(value) > 10:
+        if len(user_ids) > 10:
             raise serializers.ValidationError(
                 "A conversation can have at most 10 participants"
             )
-        return value
+        users = {user.pk: user for user in User.objects.filter(user_id__in=user_ids)}
+        missing = [str(user_id) for user_id in user_ids if user_id not in users]
+        if missing:
+            raise serializers.ValidationError(
+                f"Invalid pk \"{missing[0]}\" - object does not exist."
+            )
+        return [users[user_id] for user_id in user_ids]
     
     def create(self, validated_data):
-        """Create a conversation with participants"""
+        """
+        Create a conversation with participants. Two participants get their
+        existing direct conversation back; ``self.created`` tells which.
+        """
         participants = validated_data.pop('participants')
+        if len(participants) == 2 and not validated_data:
+            conversation, self.created = get_or_create_direct(*participants)
+            return conversation
         conversation = Conversation.objects.create(**validated_data)
         conversation.participants.set(participants)
+        self.created = True
         return conversation
 
 class ConversationDetailSerializer(ConversationSerializer):
@@ -160,3 +226,52 @@ class ConversationDetailSerializer(ConversationSerializer):
     
     class Meta(ConversationSerializer.Meta):
         fields = ConversationSerializer.Meta.fields
+
+class ConversationListSerializer(ConversationSerializer):
+    """
+    Conversation list entry nesting only the latest ``message_limit``
+    messages, oldest first. The queryset must prefetch the newest
+    ``message_limit + 1`` messages into ``recent_messages``, newest first;
+    older messages are paged through the conversation's messages endpoint.
+    """
+    message_limit = 20
+
+    messages = serializers.SerializerMethodField()
+    has_more_messages = serializers.SerializerMethodField()
+
+    class Meta(ConversationSerializer.Meta):
+        fields = ConversationSerializer.Meta.fields + ['has_more_messages']
+
+    def get_messages(self, obj):
+        recent = obj.recent_messages[:self.message_limit]
+        return MessageSerializer(recent[::-1], many=True, context=self.context).data
+
+    def get_has_more_messages(self, obj):
+        return len(obj.recent_messages) > self.message_limit
+
+class ConversationSummarySerializer(serializers.ModelSerializer):
+    """Inbox representation: participants, last message preview and unread count"""
+    participants = UserSerializer(many=True, read_only=True)
+    last_message = serializers.SerializerMethodField()
+    last_activity = serializers.DateTimeField(source='last_message_at', read_only=True)
+    unread_count = serializers.IntegerField(source='viewer_unread_count', read_only=True)
+
+    class Meta:
+        model = Conversation
+        fields = [
+            'conversation_id', 'participants', 'last_message',
+            'last_activity', 'unread_count'
+        ]
+        read_only_fields = fields
+
+    def get_last_message(self, obj):
+        """Preview of the latest message, taken from queryset annotations"""
+        # The sender is missing when the message was deleted behind the API's back
+        if obj.last_message_id is None or obj.last_message_sender_id is None:
+            return None
+        return {
+            'message_id': obj.last_message_id,
+            'sender_id': obj.last_message_sender_id,
+            'preview': obj.last_message_preview,
+            'sent_at': serializers.DateTimeField().to_representation(obj.last_message_at),
+        }
@@ -0,0 +1,139 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Conversation, Message, User
+from . import inbox, membership, participants, profile_cache, read_state, realtime
+from .auth import user_cache
+
+# ---------- READ STATE MAINTENANCE ----------
+
+@receiver(post_save, sender=Message)
+def count_new_message_as_unread(sender, instance, created, **kwargs):
+    """
+    Bumps the unread counter of the other participants when a message is sent
+    """
+    if created:
+        read_state.record_new_messages(instance.conversation_id_id, instance.sender_id)
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def sync_read_states(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keeps one read state per (participant, conversation) pair
+    """
+    if action == 'post_add':
+        if reverse:
+            for conversation in Conversation.objects.filter(pk__in=pk_set):
+                read_state.ensure_read_states(conversation, [instance.pk])
+        else:
+            read_state.ensure_read_states(instance, pk_set)
+    elif action == 'post_remove':
+        if reverse:
+            for conversation_pk in pk_set:
+                read_state.remove_read_states(conversation_pk, [instance.pk])
+        else:
+            read_state.remove_read_states(instance, pk_set)
+    elif action == 'pre_clear':
+        if reverse:
+            instance.read_states.all().delete()
+        else:
+            read_state.remove_read_states(instance)
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def touch_conversation(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Marks conversations as changed when their participants change, for
+    delta sync and ETags
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        conversations = Conversation.objects.filter(pk=instance.pk)
+    elif action == 'pre_clear':
+        conversations = Conversation.objects.filter(participants=instance)
+    else:
+        conversations = Conversation.objects.filter(pk__in=pk_set)
+    conversations.update(updated_at=timezone.now())
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def refresh_participant_keys(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keeps participant_key and is_direct in step with the participant set
+    """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            participants.refresh_participant_key(instance.pk)
+        return
+    if action == 'pre_clear':
+        instance._conversations_before_clear = list(
+            instance.conversations.values_list('pk', flat=True)
+        )
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_conversations_before_clear', ())
+    elif action not in ('post_add', 'post_remove'):
+        return
+    for conversation_pk in pk_set:
+        participants.refresh_participant_key(conversation_pk)
+
+# ---------- INBOX ORDERING ----------
+
+@receiver(post_save, sender=Message)
+def advance_last_message(sender, instance, created, **kwargs):
+    """
+    Moves the conversation's latest-message pointer to a new message
+    """
+    if created:
+        inbox.record_last_message(instance.conversation_id_id, instance)
+
+# ---------- MEMBERSHIP CACHE INVALIDATION ----------
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def invalidate_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Drops cached membership answers whenever participants change
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        membership.invalidate(instance, None if action == 'pre_clear' else pk_set)
+        return
+    if action == 'pre_clear':
+        pk_set = instance.conversations.values_list('pk', flat=True)
+    for conversation_pk in pk_set:
+        membership.invalidate(conversation_pk, [instance.pk])
+
+@receiver(post_delete, sender=Conversation)
+def forget_deleted_conversation(sender, instance, **kwargs):
+    membership.invalidate(instance)
+
+# ---------- USER CACHE INVALIDATION ----------
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_profile(sender, instance, **kwargs):
+    """
+    Retires the cached profile and authenticated user whenever a user is
+    saved or deleted (including password changes and deactivation), once
+    the change is committed: before that, a concurrent request could cache
+    the old row again under the new version
+    """
+    # delete() clears the pk before the transaction commits
+    user_ids = [instance.pk]
+
+    def invalidate():
+        profile_cache.invalidate(user_ids)
+        user_cache.invalidate(user_ids)
+
+    transaction.on_commit(invalidate)
+
+# ---------- PUSH DELIVERY ----------
+
+@receiver(post_save, sender=Message)
+def publish_new_message(sender, instance, created, **kwargs):
+    """
+    Pushes new messages to streaming clients once the insert is committed
+    """
+    if created:
+        transaction.on_commit(lambda: realtime.publish_messages([instance]))
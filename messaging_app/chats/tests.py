@@ -1,3 +1,1895 @@
-from django.test import TestCase
+import asyncio
+import json
+import re
+import tempfile
+import threading
+import time
+import uuid
+from importlib import import_module
+from base64 import b64encode
+from io import StringIO
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import skipUnless
+from unittest.mock import patch
+from urllib import parse
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.servers.basehttp import WSGIServer
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.db.models import Count
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase
+from django.test.testcases import LiveServerThread, QuietWSGIRequestHandler
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .auth import user_cache
+from .fast_serializers import MessageRows
+from .flusher import Flusher
+from .instrumentation import record_queries
+from . import inbox, loadgen, membership, participants, presence, profile_cache, read_state, realtime, receipts, search
+from .models import User, Conversation, Message, ConversationReadState
+from .pagination import StandardResultsSetPagination
+from .renderers import FastJSONRenderer, orjson
+from .serializers import CompactMessageSerializer, ConversationListSerializer, MessageSerializer
+from .views import MessageListMixin
+
+
+@override_settings(CHATS_BACKGROUND_FLUSH=False)
+class ChatsTestCase(TestCase):
+    """Shared fixtures: two users in one conversation"""
+
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        membership.cache.clear()
+        receipts.buffer.clear()
+        presence.buffer.clear()
+        self.alice = User.objects.create_user(
+            username='alice',
+            email='alice@example.com',
+            password='testpass123',
+            first_name='Alice',
+            last_name='Smith'
+        )
+        self.bob = User.objects.create_user(
+            username='bob',
+            email='bob@example.com',
+            password='testpass123',
+            first_name='Bob',
+            last_name='Jones'
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.alice, self.bob])
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.alice)
+
+    def create_user(self, name):
+        return User.objects.create_user(
+            username=name,
+            email=f'{name}@example.com',
+            password='testpass123',
+            first_name=name.title(),
+            last_name='Test'
+        )
+
+    def create_messages(self, count, sender=None, start=None):
+        """Create ``count`` messages one second apart, oldest first"""
+        start = start or timezone.now() - timedelta(days=1)
+        messages = []
+        for i in range(count):
+            message = Message.objects.create(
+                conversation_id=self.conversation,
+                sender=sender or self.bob,
+                message_body=f"Message {i}"
+            )
+            Message.objects.filter(pk=message.pk).update(
+                sent_at=start + timedelta(seconds=i)
+            )
+            messages.append(message)
+        # Backdating bypasses the insert-time bookkeeping
+        inbox.refresh_last_message(self.conversation.pk)
+        return messages
+
+
+class KeysetPaginationTests(ChatsTestCase):
+    def walk(self, url):
+        """Follow ``next`` links and return the ids of every page"""
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            pages.append([m['message_id'] for m in response.data['results']])
+            url = response.data['next']
+        return pages
+
+    def test_list_messages_pages_forward_oldest_first(self):
+        messages = self.create_messages(5)
+        url = (f'/api/conversations/{self.conversation.conversation_id}'
+               '/messages/?pagination=cursor&page_size=2')
+
+        pages = self.walk(url)
+
+        expected = [str(m.message_id) for m in messages]
+        self.assertEqual(pages, [expected[0:2], expected[2:4], expected[4:5]])
+
+    def test_message_list_pages_newest_first_and_back(self):
+        messages = self.create_messages(5)
+
+        first = self.client.get('/api/messages/?pagination=cursor&page_size=2')
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+
+        ids = [str(m.message_id) for m in reversed(messages)]
+        self.assertEqual([m['message_id'] for m in second.data['results']], ids[2:4])
+        self.assertEqual(back.data['results'], first.data['results'])
+        self.assertIsNone(back.data['previous'])
+
+    def test_ties_on_sent_at_are_broken_by_message_id(self):
+        self.create_messages(5)
+        Message.objects.update(sent_at=timezone.now())
+
+        pages = self.walk('/api/messages/?pagination=cursor&page_size=2')
+
+        seen = [message_id for page in pages for message_id in page]
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get('/api/messages/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_with_malformed_key_returns_404(self):
+        querystring = parse.urlencode({'d': 'n', 't': timezone.now().isoformat(), 'k': 'zzz'})
+        cursor = b64encode(querystring.encode('ascii')).decode('ascii')
+
+        response = self.client.get('/api/messages/', {'cursor': cursor})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_number_pagination_remains_default(self):
+        self.create_messages(3)
+        response = self.client.get('/api/messages/')
+        self.assertEqual(response.data['count'], 3)
+
+
+class MembershipTests(ChatsTestCase):
+    def test_answers_are_cached_across_requests(self):
+        self.assertTrue(membership.is_participant(self.alice, self.conversation))
+        with self.assertNumQueries(0):
+            self.assertTrue(membership.is_participant(self.alice, self.conversation))
+
+    def test_participant_changes_invalidate_the_cache(self):
+        carol = self.create_user('carol')
+        self.assertFalse(membership.is_participant(carol, self.conversation))
+
+        self.conversation.participants.add(carol)
+        self.assertTrue(membership.is_participant(carol, self.conversation))
+
+        carol.conversations.clear()
+        self.assertFalse(membership.is_participant(carol, self.conversation))
+
+    def test_request_memo_is_consulted_before_the_lru(self):
+        request = SimpleNamespace()
+        membership.is_participant(self.alice, self.conversation, request)
+        membership.cache.clear()
+        with self.assertNumQueries(0):
+            self.assertTrue(membership.is_participant(self.alice, self.conversation, request))
+
+    def test_lru_is_bounded_and_expires(self):
+        cache = membership.MembershipCache(maxsize=2, ttl=60)
+        for i in range(3):
+            cache.set(i, 'user', True)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(0, 'user'))
+
+        cache.ttl = -1
+        cache.set(3, 'user', True)
+        self.assertIsNone(cache.get(3, 'user'))
+
+    def test_create_message_checks_membership(self):
+        carol = self.create_user('carol')
+        url = '/api/messages/'
+        payload = {'conversation_id': str(self.conversation.conversation_id), 'message_body': 'Hi'}
+
+        self.assertEqual(self.client.post(url, payload, format='json').status_code, 201)
+
+        self.client.force_authenticate(user=carol)
+        self.assertEqual(self.client.post(url, payload, format='json').status_code, 403)
+        for bad_id in ('not-a-uuid', '00000000-0000-0000-0000-000000000000'):
+            response = self.client.post(
+                url, {'conversation_id': bad_id, 'message_body': 'Hi'}, format='json'
+            )
+            self.assertEqual(response.status_code, 400)
+
+
+class BulkIngestionTests(ChatsTestCase):
+    url = '/api/messages/bulk/'
+
+    def payload(self, count, conversation=None):
+        conversation = conversation or self.conversation
+        return {
+            'conversation_id': str(conversation.conversation_id),
+            'messages': [{'message_body': f'Imported {i}'} for i in range(count)],
+        }
+
+    def test_bulk_import_creates_messages_and_bumps_read_state(self):
+        response = self.client.post(self.url, self.payload(25), format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 25)
+        self.assertEqual(Message.objects.filter(sender=self.alice).count(), 25)
+        self.assertEqual(
+            ConversationReadState.objects.get(user=self.bob).unread_count, 25
+        )
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(self.url, self.payload(2), format='json')
+        with CaptureQueriesContext(connection) as large:
+            self.client.post(self.url, self.payload(200), format='json')
+        self.assertEqual(len(large), len(small))
+
+    def test_invalid_item_rejects_the_whole_batch(self):
+        payload = self.payload(3)
+        payload['messages'][1]['message_body'] = '   '
+
+        response = self.client.post(self.url, payload, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('messages', response.data)
+        self.assertFalse(Message.objects.exists())
+
+    def test_malformed_body_is_rejected(self):
+        for body in ([{'message_body': 'Hi'}], 'Hi', {'messages': [{'message_body': 'Hi'}]}):
+            response = self.client.post(self.url, body, format='json')
+
+            self.assertEqual(response.status_code, 400, body)
+        self.assertFalse(Message.objects.exists())
+
+    def test_non_participant_is_forbidden(self):
+        other = Conversation.objects.create()
+        other.participants.set([self.bob, self.create_user('carol')])
+
+        response = self.client.post(self.url, self.payload(1, other), format='json')
+
+        self.assertEqual(response.status_code, 403)
+
+
+class FlusherTests(SimpleTestCase):
+
+    def test_flushes_periodically_on_wake_and_once_more_on_stop(self):
+        calls = []
+        flushed = threading.Event()
+
+        def flush():
+            calls.append(time.monotonic())
+            flushed.set()
+
+        flusher = Flusher('test-flush', flush, interval=0.05)
+        with override_settings(CHATS_BACKGROUND_FLUSH=True):
+            flusher.start()
+        self.addCleanup(flusher.stop)
+        self.assertTrue(flushed.wait(5))
+
+        flusher.interval = 60
+        flushed.clear()
+        flusher.wake()
+        self.assertTrue(flushed.wait(5))
+        before = len(calls)
+        flusher.stop(timeout=5)
+        self.assertEqual(len(calls), before + 1)
+
+    @override_settings(CHATS_BACKGROUND_FLUSH=False)
+    def test_disabled_by_setting(self):
+        flusher = Flusher('test-flush', lambda: None, interval=0.01)
+        flusher.wake()
+        self.assertIsNone(flusher._thread)
+
+    def test_failing_flush_keeps_the_thread_alive(self):
+        flushed = threading.Event()
+        results = iter([RuntimeError('database is locked')])
+
+        def flush():
+            error = next(results, None)
+            if error is not None:
+                raise error
+            flushed.set()
+
+        flusher = Flusher('test-flush', flush, interval=0.01)
+        with override_settings(CHATS_BACKGROUND_FLUSH=True), self.assertLogs('chats.flusher'):
+            flusher.start()
+            self.addCleanup(flusher.stop)
+            self.assertTrue(flushed.wait(5))
+
+
+class BrokerTests(SimpleTestCase):
+    async def test_publish_fans_out_to_channel_subscribers(self):
+        broker = realtime.Broker()
+        first = broker.subscribe('a')
+        second = broker.subscribe('a')
+        other = broker.subscribe('b')
+
+        self.assertEqual(broker.publish('a', {'data': 'hi'}), 2)
+
+        self.assertEqual(await first.get(timeout=1), {'data': 'hi'})
+        self.assertEqual(await second.get(timeout=1), {'data': 'hi'})
+        self.assertIsNone(await other.get(timeout=0.01))
+
+        first.close()
+        self.assertEqual(broker.subscriber_count('a'), 1)
+
+    async def test_publish_from_another_thread(self):
+        broker = realtime.Broker()
+        subscription = broker.subscribe('a')
+
+        await sync_to_async(broker.publish, thread_sensitive=False)('a', {'data': 'x'})
+
+        self.assertEqual(await subscription.get(timeout=1), {'data': 'x'})
+
+    async def test_slow_subscriber_overflows(self):
+        broker = realtime.Broker(queue_size=1)
+        subscription = broker.subscribe('a')
+        broker.publish('a', {'data': '1'})
+        broker.publish('a', {'data': '2'})
+        await asyncio.sleep(0)
+
+        with self.assertRaises(realtime.SubscriptionOverflow):
+            await subscription.get(timeout=1)
+
+    def test_format_sse(self):
+        frame = realtime.format_sse({'id': '1', 'event': 'message', 'data': 'a\nb'})
+        self.assertEqual(frame, b'id: 1\nevent: message\ndata: a\ndata: b\n\n')
+
+
+class ConversationEventsTests(ChatsTestCase):
+    def url(self, conversation=None):
+        conversation = conversation or self.conversation
+        return f'/api/conversations/{conversation.conversation_id}/events/'
+
+    def test_new_message_is_published_after_commit(self):
+        with patch.object(realtime.broker, 'subscriber_count', return_value=1), \
+                patch.object(realtime.broker, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                message = Message.objects.create(
+                    conversation_id=self.conversation, sender=self.bob, message_body='Hi'
+                )
+
+        channel, event = publish.call_args.args
+        self.assertEqual(channel, f'conversation:{self.conversation.conversation_id}')
+        self.assertEqual(event['id'], str(message.message_id))
+        self.assertIn('"message_body":"Hi"', event['data'])
+
+    async def test_stream_delivers_published_messages(self):
+        await self.async_client.aforce_login(self.alice)
+        response = await self.async_client.get(self.url())
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await anext(stream)).startswith(b'retry:'))
+
+        channel = realtime.message_channel(self.conversation.conversation_id)
+        self.assertEqual(realtime.broker.subscriber_count(channel), 1)
+        realtime.broker.publish(channel, {'id': '1', 'event': 'message', 'data': '{}'})
+
+        self.assertEqual(await anext(stream), b'id: 1\nevent: message\ndata: {}\n\n')
+
+        # A client disconnect cancels the pending read, like the ASGI handler does
+        pending = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertEqual(realtime.broker.subscriber_count(channel), 0)
+
+    async def test_stream_requires_membership(self):
+        response = await self.async_client.get(self.url())
+        self.assertEqual(response.status_code, 401)
+
+        carol = await sync_to_async(self.create_user)('carol')
+        await self.async_client.aforce_login(carol)
+        response = await self.async_client.get(self.url())
+        self.assertEqual(response.status_code, 403)
+
+
+class ConditionalGetTests(ChatsTestCase):
+
+    def assertNotModified(self, url, response):
+        repeat = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repeat.status_code, 304)
+        self.assertEqual(repeat['ETag'], response['ETag'])
+
+    def test_unchanged_lists_and_details_return_304(self):
+        message = self.create_messages(1)[0]
+        for url in (
+            '/api/conversations/',
+            f'/api/conversations/{self.conversation.conversation_id}/',
+            '/api/messages/',
+            f'/api/messages/{message.message_id}/',
+        ):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertIn('Last-Modified', response)
+            self.assertNotModified(url, response)
+
+    def test_304_does_not_render_the_list(self):
+        self.create_messages(3)
+        etag = self.client.get('/api/messages/')['ETag']
+
+        with patch.object(MessageRows, 'build') as build:
+            response = self.client.get('/api/messages/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        build.assert_not_called()
+
+    def test_etag_changes_with_messages_and_read_state(self):
+        url = '/api/conversations/'
+        first = self.client.get(url)['ETag']
+
+        self.create_messages(1)
+        second = self.client.get(url)['ETag']
+        self.client.post(
+            '/api/messages/mark-conversation-read/',
+            {'conversation_id': str(self.conversation.conversation_id)}
+        )
+        third = self.client.get(url)['ETag']
+
+        self.assertEqual(len({first, second, third}), 3)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=second).status_code, 200
+        )
+
+    def test_etag_changes_when_a_message_is_deleted(self):
+        messages = self.create_messages(2)
+        etag = self.client.get('/api/messages/')['ETag']
+
+        Message.objects.filter(pk=messages[0].pk).delete()
+
+        self.assertNotEqual(self.client.get('/api/messages/')['ETag'], etag)
+
+    def test_etag_is_per_user(self):
+        self.create_messages(1)
+        etag = self.client.get('/api/messages/')['ETag']
+
+        self.client.force_authenticate(user=self.bob)
+
+        response = self.client.get('/api/messages/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_validators_only_read_the_page(self):
+        self.create_messages(3)
+        for url in (
+            '/api/messages/?pagination=cursor&page_size=2',
+            '/api/messages/?count=false&page_size=2',
+        ):
+            etag = self.client.get(url)['ETag']
+
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(len(queries), 1, url)
+            self.assertNotIn('COUNT(', queries[0]['sql'], url)
+            self.assertIn('LIMIT 3', queries[0]['sql'], url)
+
+    def test_unconditional_requests_run_no_validator_queries(self):
+        self.create_messages(1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/messages/?count=false')
+
+        self.assertIn('ETag', response)
+        self.assertEqual(len(queries), 1)
+
+    def test_conversation_etag_changes_when_an_older_message_is_deleted(self):
+        messages = self.create_messages(3)
+        url = f'/api/conversations/{self.conversation.conversation_id}/'
+        etag = self.client.get(url)['ETag']
+
+        self.client.force_authenticate(user=self.bob)
+        self.client.delete(f'/api/messages/{messages[0].message_id}/')
+        self.client.force_authenticate(user=self.alice)
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message_id, messages[2].message_id)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_sender_profile_change_changes_the_etag(self):
+        self.create_messages(1)
+        etag = self.client.get('/api/messages/')['ETag']
+
+        self.bob.first_name = 'Robert'
+        self.bob.save()
+
+        self.assertEqual(
+            self.client.get('/api/messages/', HTTP_IF_NONE_MATCH=etag).status_code, 200
+        )
+
+    def test_presence_changes_change_the_etag(self):
+        message = self.create_messages(1)[0]
+        urls = (
+            '/api/conversations/',
+            f'/api/conversations/{self.conversation.conversation_id}/',
+            '/api/messages/',
+            f'/api/messages/{message.message_id}/',
+        )
+        # Bob is marked online, but his activity is old enough to expire
+        User.objects.filter(pk=self.bob.pk).update(
+            online_status=True, last_activity=timezone.now() - 2 * presence.ONLINE_TTL
+        )
+
+        def changed(etags):
+            return [
+                url for url in urls
+                if self.client.get(url, HTTP_IF_NONE_MATCH=etags[url]).status_code == 200
+            ]
+
+        def flush_only(*user_ids):
+            # Drop Alice's own activity, buffered by her requests
+            presence.buffer.clear()
+            for user_id in user_ids:
+                presence.buffer.touch(user_id)
+            presence.buffer.flush()
+
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        self.assertEqual(changed(etags), [])
+        flush_only()
+        self.assertEqual(changed(etags), list(urls))
+
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        flush_only(self.bob.pk)
+        self.assertEqual(changed(etags), list(urls))
+
+
+class SyncTests(ChatsTestCase):
+    url = '/api/conversations/sync/'
+
+    def sync(self, token=None):
+        response = self.client.get(self.url, {'since': token} if token else None)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_first_sync_returns_everything(self):
+        self.create_messages(3)
+
+        data = self.sync()
+
+        self.assertEqual(
+            [c['conversation_id'] for c in data['conversations']],
+            [str(self.conversation.conversation_id)]
+        )
+        self.assertEqual(len(data['messages']), 3)
+        self.assertIn(str(self.bob.user_id), data['users'])
+        self.assertFalse(data['has_more'])
+
+    def test_returns_only_changes_since_token(self):
+        old = self.create_messages(2)
+        token = self.sync()['sync_token']
+
+        self.assertEqual(self.sync(token)['messages'], [])
+
+        new = Message.objects.create(
+            conversation_id=self.conversation, sender=self.bob, message_body='New'
+        )
+        Message.objects.filter(pk=old[0].pk).update(
+            is_read=True, updated_at=timezone.now()
+        )
+        data = self.sync(token)
+
+        self.assertEqual(
+            {m['message_id'] for m in data['messages']},
+            {str(new.message_id), str(old[0].message_id)}
+        )
+        # The new message bumped the viewer's unread count
+        self.assertEqual(data['conversations'][0]['unread_count'], 3)
+
+    def test_continues_while_has_more(self):
+        self.create_messages(5)
+        seen = []
+        token = None
+
+        with patch('chats.views.ConversationViewSet.sync_page_size', 2):
+            while True:
+                data = self.sync(token)
+                seen.extend(m['message_id'] for m in data['messages'])
+                token = data['sync_token']
+                if not data['has_more']:
+                    break
+
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+
+    def test_participant_changes_are_synced(self):
+        token = self.sync()['sync_token']
+        self.assertEqual(self.sync(token)['conversations'], [])
+
+        self.conversation.participants.add(self.create_user('carol'))
+
+        self.assertEqual(len(self.sync(token)['conversations']), 1)
+
+    def test_invalid_token_is_rejected(self):
+        response = self.client.get(self.url, {'since': 'not-a-token'})
+        self.assertEqual(response.status_code, 400)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Search ranking and snippets need SQLite FTS5')
+class SearchTests(ChatsTestCase):
+    url = '/api/messages/search/'
+
+    def send(self, body, conversation=None, sender=None):
+        return Message.objects.create(
+            conversation_id=conversation or self.conversation,
+            sender=sender or self.bob,
+            message_body=body
+        )
+
+    def search(self, q, **params):
+        response = self.client.get(self.url, {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def found(self, q):
+        return [result['message_id'] for result in self.search(q)['results']]
+
+    def test_finds_only_messages_in_own_conversations(self):
+        mine = self.send('Lunch at the usual place?')
+        other = Conversation.objects.create()
+        carol = self.create_user('carol')
+        other.participants.set([self.bob, carol])
+        self.send('Lunch without Alice', conversation=other)
+
+        self.assertEqual(self.found('lunch'), [str(mine.message_id)])
+
+    def test_best_match_first_with_highlighted_snippet(self):
+        self.send('The deploy is done')
+        best = self.send('Deploy failed, rolling back the deploy <script>')
+
+        results = self.search('deploy')['results']
+
+        self.assertEqual(results[0]['message_id'], str(best.message_id))
+        self.assertIn('<mark>Deploy</mark>', results[0]['snippet'])
+        self.assertIn('&lt;script&gt;', results[0]['snippet'])
+
+    def test_prefix_matching_and_query_syntax_is_not_interpreted(self):
+        self.send('Tomorrow works for me')
+
+        self.assertEqual(len(self.found('tomor')), 1)
+        self.assertEqual(self.found('tomorrow OR "NEAR('), [])
+
+    def test_index_follows_updates_deletes_and_bulk_imports(self):
+        message = self.send('Original wording')
+        Message.objects.filter(pk=message.pk).update(message_body='Edited wording')
+        self.client.post('/api/messages/bulk/', {
+            'conversation_id': str(self.conversation.conversation_id),
+            'messages': [{'message_body': 'Imported wording'}],
+        }, format='json')
+
+        self.assertEqual(self.found('original'), [])
+        self.assertEqual(len(self.found('wording')), 2)
+
+        Message.objects.filter(pk=message.pk).delete()
+        self.assertEqual(len(self.found('wording')), 1)
+
+    def test_pages_by_rank_cursor_without_a_count(self):
+        for repeats in range(1, 6):
+            self.send(' '.join(['deploy'] * repeats))
+        expected = self.found('deploy')
+
+        seen, response = [], self.client.get(self.url, {'q': 'deploy', 'page_size': 2})
+        with CaptureQueriesContext(connection) as queries:
+            while True:
+                self.assertNotIn('count', response.data)
+                seen += [result['message_id'] for result in response.data['results']]
+                if not response.data['next']:
+                    break
+                last = response
+                response = self.client.get(response.data['next'])
+
+        self.assertEqual(seen, expected)
+        self.assertFalse(any(
+            'OFFSET' in q['sql'] or 'COUNT(' in q['sql'] for q in queries.captured_queries
+        ))
+        previous = self.client.get(response.data['previous']).data['results']
+        self.assertEqual(previous, last.data['results'])
+
+    def test_malformed_cursor_returns_404(self):
+        cursor = b64encode(b'd=n&t=not-a-rank&k=x').decode('ascii')
+        response = self.client.get(self.url, {'q': 'deploy', 'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+
+    def test_index_does_not_depend_on_message_rowids(self):
+        message = self.send('Renumbered by vacuum')
+        # What VACUUM may do to a table without an INTEGER PRIMARY KEY
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE chats_message SET rowid = rowid + 1000')
+
+        self.assertEqual(self.found('vacuum'), [str(message.message_id)])
+        Message.objects.filter(pk=message.pk).update(message_body='Edited')
+        self.assertEqual(self.found('vacuum'), [])
+        self.assertEqual(self.found('edited'), [str(message.message_id)])
+
+    def test_post_migrate_restores_dropped_triggers(self):
+        with connection.cursor() as cursor:
+            for name in search.TRIGGERS:
+                cursor.execute(f'DROP TRIGGER {name}')
+        message = self.send('Written while the triggers were gone')
+
+        search.install_index()
+
+        self.assertEqual(self.found('triggers'), [str(message.message_id)])
+        Message.objects.filter(pk=message.pk).delete()
+        self.assertEqual(self.found('triggers'), [])
+
+    def test_query_is_required(self):
+        self.assertEqual(self.client.get(self.url, {'q': '  '}).status_code, 400)
+
+
+class ReadReceiptTests(ChatsTestCase):
+    url = '/api/messages/read-receipt/'
+
+    def receipt(self, message):
+        return self.client.post(self.url, {
+            'conversation_id': str(self.conversation.conversation_id),
+            'message_id': str(message.message_id),
+        }, format='json')
+
+    def test_receipt_marks_everything_up_to_the_message_read(self):
+        messages = self.create_messages(5)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.receipt(messages[2])
+
+        self.assertEqual(response.data['status'], receipts.APPLIED)
+        state = ConversationReadState.objects.get(user=self.alice)
+        self.assertEqual(state.last_read_at, Message.objects.get(pk=messages[2].pk).sent_at)
+        self.assertEqual(state.unread_count, 2)
+        self.assertEqual(Message.objects.filter(is_read=True).count(), 3)
+        writes = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(writes), 2)
+
+    def test_rapid_receipts_are_coalesced(self):
+        messages = self.create_messages(10)
+
+        self.assertEqual(self.receipt(messages[0]).data['status'], receipts.APPLIED)
+        with CaptureQueriesContext(connection) as queries:
+            statuses = [self.receipt(message).data['status'] for message in messages[1:]]
+            stale = self.receipt(messages[3]).data['status']
+
+        self.assertEqual(set(statuses), {receipts.QUEUED})
+        self.assertEqual(stale, receipts.STALE)
+        self.assertFalse(any(q['sql'].startswith('UPDATE') for q in queries.captured_queries))
+        self.assertEqual(receipts.buffer.pending_count(), 1)
+
+        # Reading the inbox writes the pending watermark first
+        response = self.client.get('/api/conversations/inbox/')
+        self.assertEqual(response.data['results'][0]['unread_count'], 0)
+        self.assertEqual(receipts.buffer.pending_count(), 0)
+
+    def test_pending_receipt_is_written_once_due(self):
+        messages = self.create_messages(3)
+        self.receipt(messages[0])
+        self.receipt(messages[1])
+        self.assertEqual(receipts.buffer.flush(due_only=True), 0)
+
+        later = time.monotonic() + receipts.RECEIPT_INTERVAL
+        with patch('chats.receipts.time.monotonic', return_value=later):
+            self.assertEqual(receipts.buffer.flush(due_only=True), 1)
+
+        self.assertEqual(ConversationReadState.objects.get(user=self.alice).unread_count, 1)
+
+    def test_due_flush_takes_only_due_receipts(self):
+        buffer = receipts.ReceiptBuffer(interval=10)
+        start = time.monotonic()
+        with patch('chats.read_state.apply_receipt') as apply_receipt:
+            for user_id, offset in (('early', 0), ('late', 5)):
+                with patch('chats.receipts.time.monotonic', return_value=start + offset):
+                    buffer.submit(user_id, 'c', 1)
+                    buffer.submit(user_id, 'c', 2)
+            apply_receipt.reset_mock()
+
+            with patch('chats.receipts.time.monotonic', return_value=start + 10):
+                self.assertEqual(buffer.flush(due_only=True), 1)
+
+        apply_receipt.assert_called_once_with('early', 'c', 2)
+        self.assertEqual(buffer.pending_count(), 1)
+        self.assertEqual(len(buffer._due), 1)
+
+    def test_reading_messages_writes_own_pending_receipts(self):
+        messages = self.create_messages(3)
+        self.receipt(messages[0])
+        self.receipt(messages[1])
+
+        self.client.get('/api/messages/')
+
+        self.assertEqual(receipts.buffer.pending_count(), 0)
+        self.assertEqual(ConversationReadState.objects.get(user=self.alice).unread_count, 1)
+
+    @override_settings(CHATS_BACKGROUND_FLUSH=True)
+    def test_queued_receipts_are_written_without_more_traffic(self):
+        buffer = receipts.ReceiptBuffer(interval=0.05)
+        written = threading.Event()
+        self.addCleanup(buffer.flusher.stop)
+        with patch('chats.read_state.apply_receipt', side_effect=lambda *args: written.set()):
+            buffer.submit('alice', 'c', 1)
+            written.clear()
+            self.assertEqual(buffer.submit('alice', 'c', 2), receipts.QUEUED)
+
+            self.assertTrue(written.wait(5))
+        self.assertEqual(buffer.pending_count(), 0)
+
+    def test_message_must_belong_to_the_conversation(self):
+        other = Conversation.objects.create()
+        other.participants.set([self.alice, self.bob])
+        message = Message.objects.create(
+            conversation_id=other, sender=self.bob, message_body='Elsewhere'
+        )
+
+        self.assertEqual(self.receipt(message).status_code, 400)
+
+
+class PresenceTests(ChatsTestCase):
+
+    def test_requests_are_buffered_not_written(self):
+        before = User.objects.get(pk=self.alice.pk).last_activity
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/users/me/')
+
+        self.assertFalse(any(q['sql'].startswith('UPDATE') for q in queries.captured_queries))
+        self.assertEqual(User.objects.get(pk=self.alice.pk).last_activity, before)
+        self.assertIn(self.alice.pk, presence.buffer.recent([self.alice.pk]))
+
+    def test_flush_writes_everyone_at_once_and_expires_idle_users(self):
+        idle = self.create_user('carol')
+        User.objects.filter(pk=idle.pk).update(
+            online_status=True, last_activity=timezone.now() - timedelta(hours=1)
+        )
+        presence.buffer.touch(self.alice.pk)
+        presence.buffer.touch(self.bob.pk)
+        versions = dict(User.objects.values_list('username', 'updated_at'))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(presence.buffer.flush(), 2)
+
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE')]), 2)
+        self.assertEqual(
+            dict(User.objects.values_list('username', 'online_status')),
+            {'alice': True, 'bob': True, 'carol': False}
+        )
+        # Presence is not a profile change: no ETag or cache version moves
+        self.assertEqual(dict(User.objects.values_list('username', 'updated_at')), versions)
+
+    def test_requests_never_flush(self):
+        with patch.object(presence.buffer, 'interval', 0), \
+                patch.object(presence.buffer, 'max_buffered', 1), \
+                patch.object(presence.buffer.flusher, 'wake') as wake:
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get('/api/users/me/')
+
+        self.assertFalse(any(q['sql'].startswith('UPDATE') for q in queries.captured_queries))
+        # A full buffer hands the flush to the background thread
+        wake.assert_called_once_with()
+
+    def test_participant_presence_in_one_query(self):
+        User.objects.filter(pk=self.bob.pk).update(
+            last_activity=timezone.now() - timedelta(hours=1)
+        )
+        url = f'/api/conversations/{self.conversation.conversation_id}/presence/'
+
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(response.data[str(self.alice.user_id)]['online'])
+        self.assertFalse(response.data[str(self.bob.user_id)]['online'])
+
+    def test_new_users_are_offline_until_their_first_request(self):
+        carol = self.create_user('carol')
+        self.conversation.participants.add(carol)
+        url = f'/api/conversations/{self.conversation.conversation_id}/presence/'
+
+        state = self.client.get(url).data[str(carol.user_id)]
+
+        self.assertEqual(state, {'online': False, 'last_activity': None})
+        self.assertEqual(
+            self.client.get(f'/api/users/{carol.user_id}/').data['last_activity'], None
+        )
+
+    def test_presence_requires_membership(self):
+        other = Conversation.objects.create()
+        other.participants.set([self.bob, self.create_user('carol')])
+
+        response = self.client.get(f'/api/conversations/{other.conversation_id}/presence/')
+
+        self.assertEqual(response.status_code, 404)
+
+
+class CachedAuthenticationTests(ChatsTestCase):
+    url = '/api/conversations/inbox/'
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.alice)}')
+
+    def user_lookups(self, queries):
+        return [
+            q for q in queries.captured_queries
+            if q['sql'].startswith('SELECT') and 'FROM "chats_user" WHERE' in q['sql']
+        ]
+
+    def test_repeat_requests_skip_the_user_lookup(self):
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(self.url)
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.user_lookups(first)), 1)
+        self.assertEqual(self.user_lookups(second), [])
+        self.assertEqual(len(second), len(first) - 1)
+        self.assertEqual(user_cache.stats()['hit_rate'], 0.5)
+
+    def test_deactivation_takes_effect_immediately(self):
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.is_active = False
+            self.alice.save()
+
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_password_change_drops_the_cached_user(self):
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.set_password('a-new-password')
+            self.alice.save()
+
+        self.assertIsNone(user_cache.get(self.alice.pk))
+
+    def test_cached_user_is_a_private_copy(self):
+        self.client.get(self.url)
+
+        user_cache.get(self.alice.pk).first_name = 'Mallory'
+
+        self.assertEqual(user_cache.get(self.alice.pk).first_name, 'Alice')
+
+    def test_updating_me_does_not_write_back_the_cached_user(self):
+        self.client.get(self.url)
+        active = timezone.now()
+        # Changes from another process: no signal reaches this process's cache
+        User.objects.filter(pk=self.alice.pk).update(last_name='Jones', last_activity=active)
+
+        response = self.client.patch('/api/users/me/', {'first_name': 'Ally'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        alice = User.objects.get(pk=self.alice.pk)
+        self.assertEqual(
+            (alice.first_name, alice.last_name, alice.last_activity), ('Ally', 'Jones', active)
+        )
+
+
+class ProfileCacheTests(ChatsTestCase):
+
+    def test_profiles_are_served_from_cache(self):
+        url = f'/api/users/{self.bob.user_id}/'
+        first = self.client.get(url)
+        self.client.get('/api/users/me/')
+
+        with CaptureQueriesContext(connection) as queries:
+            again = self.client.get(url)
+            me = self.client.get('/api/users/me/')
+
+        # Only presence is read, once per request
+        self.assertEqual(len(queries), 2)
+        self.assertTrue(all(
+            '"last_activity"' in q['sql'] and '"first_name"' not in q['sql'] for q in queries
+        ))
+        self.assertEqual(again.data, first.data)
+        self.assertEqual(me.data['email'], 'alice@example.com')
+
+    def test_list_only_queries_ids_once_warm(self):
+        self.client.get('/api/users/')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/users/')
+
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn('"first_name"', queries[-1]['sql'])
+
+    def test_saving_a_user_invalidates_the_profile(self):
+        url = f'/api/users/{self.bob.user_id}/'
+        self.client.get(url)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.bob.first_name = 'Robert'
+            self.bob.save()
+        # Invalidated on commit: until then, concurrent readers see the old row
+        version = profile_cache.versions([self.bob.pk])
+        self.assertEqual(self.client.get(url).data['first_name'], 'Bob')
+        for callback in callbacks:
+            callback()
+
+        self.assertNotEqual(profile_cache.versions([self.bob.pk]), version)
+        self.assertEqual(self.client.get(url).data['first_name'], 'Robert')
+        self.assertEqual(
+            [u['first_name'] for u in self.client.get('/api/users/').data['results']],
+            ['Robert', 'Alice']
+        )
+
+    def test_presence_is_current_without_invalidating_the_profile(self):
+        url = f'/api/users/{self.bob.user_id}/'
+        User.objects.filter(pk=self.bob.pk).update(
+            last_activity=timezone.now() - timedelta(hours=1)
+        )
+        self.assertFalse(self.client.get(url).data['online_status'])
+        version = profile_cache.versions([self.bob.pk])
+
+        presence.buffer.touch(self.bob.pk)
+        self.assertTrue(self.client.get(url).data['online_status'])
+        presence.buffer.flush()
+
+        self.assertTrue(self.client.get(url).data['online_status'])
+        self.assertEqual(profile_cache.versions([self.bob.pk]), version)
+
+    def test_deleted_user_is_not_served(self):
+        url = f'/api/users/{self.bob.user_id}/'
+        self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bob.delete()
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_unknown_users_leave_no_version_keys(self):
+        missing = uuid.uuid4()
+
+        self.assertEqual(self.client.get(f'/api/users/{missing}/').status_code, 404)
+
+        self.assertEqual(profile_cache.versions([missing]), {})
+
+    def test_version_keys_expire(self):
+        with patch.object(profile_cache.cache, 'add', wraps=profile_cache.cache.add) as add, \
+                patch.object(profile_cache.cache, 'set_many', wraps=profile_cache.cache.set_many) as set_many:
+            self.client.get(f'/api/users/{self.bob.user_id}/')
+            profile_cache.invalidate([self.bob.pk])
+
+        self.assertEqual(add.call_args.kwargs['timeout'], profile_cache.VERSION_TIMEOUT)
+        self.assertEqual(set_many.call_args.kwargs['timeout'], profile_cache.VERSION_TIMEOUT)
+
+
+class DirectConversationTests(ChatsTestCase):
+
+    def test_pair_conversation_is_keyed_and_direct(self):
+        self.conversation.refresh_from_db()
+        self.assertTrue(self.conversation.is_direct)
+        self.assertEqual(
+            self.conversation.participant_key,
+            participants.participant_key([self.bob.pk, self.alice.pk])
+        )
+
+    def test_get_or_create_direct_is_order_independent(self):
+        carol = self.create_user('carol')
+
+        first, created = participants.get_or_create_direct(self.alice, carol)
+        again, created_again = participants.get_or_create_direct(carol, self.alice)
+        existing, _ = participants.get_or_create_direct(self.bob, self.alice)
+
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(again, first)
+        self.assertEqual(existing, self.conversation)
+
+    def test_create_returns_existing_direct_conversation(self):
+        limit = ConversationListSerializer.message_limit
+        for i in range(limit + 5):
+            latest = Message.objects.create(
+                conversation_id=self.conversation, sender=self.bob, message_body=f'Hi {i}'
+            )
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/conversations/',
+                {'participant_ids': [str(self.bob.user_id)]},
+                format='json'
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Conversation.objects.count(), 1)
+        # Participant ids resolve in a single IN query
+        user_lookups = [q for q in queries if 'WHERE "chats_user"."user_id" IN' in q['sql']]
+        self.assertEqual(len(user_lookups), 1)
+        # Rendered as in the list: only the latest messages, oldest first
+        self.assertEqual(len(response.data['messages']), limit)
+        self.assertEqual(response.data['messages'][-1]['message_id'], str(latest.pk))
+        self.assertTrue(response.data['has_more_messages'])
+
+    def test_create_group_and_unknown_participants(self):
+        carol = self.create_user('carol')
+        url = '/api/conversations/'
+
+        group = self.client.post(url, {
+            'participant_ids': [str(self.bob.user_id), str(carol.user_id)]
+        }, format='json')
+        unknown = self.client.post(url, {
+            'participant_ids': [str(self.bob.user_id), '00000000-0000-0000-0000-000000000000']
+        }, format='json')
+
+        self.assertEqual(group.status_code, 201)
+        self.assertFalse(Conversation.objects.get(pk=group.data['conversation_id']).is_direct)
+        self.assertEqual(unknown.status_code, 400)
+
+    def test_adding_a_participant_ends_direct_status(self):
+        carol = self.create_user('carol')
+        self.conversation.participants.add(carol)
+        self.conversation.refresh_from_db()
+        self.assertFalse(self.conversation.is_direct)
+
+        _, created = participants.get_or_create_direct(self.alice, self.bob)
+        self.assertTrue(created)
+
+    def test_direct_endpoint(self):
+        carol = self.create_user('carol')
+        url = '/api/conversations/direct/'
+
+        existing = self.client.post(url, {'user_id': str(self.bob.user_id)}, format='json')
+        created = self.client.post(url, {'user_id': str(carol.user_id)}, format='json')
+        own = self.client.post(url, {'user_id': str(self.alice.user_id)}, format='json')
+        invalid = self.client.post(url, {'user_id': 'nope'}, format='json')
+
+        self.assertEqual(existing.status_code, 200)
+        self.assertEqual(
+            existing.data['conversation_id'], str(self.conversation.conversation_id)
+        )
+        self.assertEqual(created.status_code, 201)
+        self.assertEqual(own.status_code, 400)
+        self.assertEqual(invalid.status_code, 400)
+
+
+class ReadStateTests(ChatsTestCase):
+    def unread(self, user, conversation=None):
+        return ConversationReadState.objects.get(
+            user=user, conversation=conversation or self.conversation
+        ).unread_count
+
+    def test_new_message_counts_as_unread_for_other_participants(self):
+        self.create_messages(3, sender=self.bob)
+        self.assertEqual(self.unread(self.alice), 3)
+        self.assertEqual(self.unread(self.bob), 0)
+
+    def test_added_participant_inherits_existing_messages_as_unread(self):
+        self.create_messages(2, sender=self.bob)
+        carol = self.create_user('carol')
+        self.conversation.participants.add(carol)
+        self.assertEqual(self.unread(carol), 2)
+
+        self.conversation.participants.remove(carol)
+        self.assertFalse(carol.read_states.exists())
+
+    def test_mark_as_read_moves_watermark(self):
+        messages = self.create_messages(3, sender=self.bob)
+
+        response = self.client.post(f'/api/messages/{messages[1].message_id}/mark-read/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.unread(self.alice), 1)
+
+    def test_mark_read_never_moves_watermark_backwards(self):
+        messages = self.create_messages(3, sender=self.bob)
+        for message in messages:
+            message.refresh_from_db()
+        # A concurrent call read the state before this one moved it forward
+        stale = ConversationReadState.objects.get(user=self.alice, conversation=self.conversation)
+        read_state.mark_read_up_to(self.alice, messages[2])
+
+        with patch.object(
+            ConversationReadState.objects, 'get_or_create', return_value=(stale, False)
+        ):
+            state = read_state.mark_read_up_to(self.alice, messages[0])
+
+        self.assertEqual(state.last_read_at, messages[2].sent_at)
+        stored = ConversationReadState.objects.get(pk=stale.pk)
+        self.assertEqual(stored.last_read_at, messages[2].sent_at)
+        self.assertEqual(stored.unread_count, 0)
+
+    def test_backfill_counts_unread_messages_in_one_aggregate(self):
+        carol = self.create_user('carol')
+        self.conversation.participants.add(carol)
+        self.create_messages(3, sender=self.bob)
+        self.create_messages(2, sender=carol)
+        Message.objects.filter(message_body='Message 0', sender=self.bob).update(is_read=True)
+        ConversationReadState.objects.all().delete()
+        migration = import_module('chats.migrations.0002_conversationreadstate')
+
+        with CaptureQueriesContext(connection) as queries:
+            migration.backfill_read_states(apps, None)
+
+        self.assertEqual(self.unread(self.alice), 4)
+        self.assertEqual(self.unread(self.bob), 2)
+        self.assertEqual(self.unread(carol), 2)
+        message_queries = [q for q in queries.captured_queries if 'chats_message' in q['sql']]
+        self.assertEqual(len(message_queries), 1)
+
+    def test_read_state_is_per_participant_in_group_chats(self):
+        carol = self.create_user('carol')
+        self.conversation.participants.add(carol)
+        self.create_messages(2, sender=self.bob)
+
+        self.client.post(
+            '/api/messages/mark-conversation-read/',
+            {'conversation_id': str(self.conversation.conversation_id)},
+            format='json'
+        )
+
+        self.assertEqual(self.unread(self.alice), 0)
+        self.assertEqual(self.unread(carol), 2)
+
+    def test_conversation_list_reads_unread_counts_in_one_query(self):
+        for _ in range(3):
+            conversation = Conversation.objects.create()
+            conversation.participants.set([self.alice, self.bob])
+            Message.objects.create(
+                conversation_id=conversation, sender=self.bob, message_body='Hi'
+            )
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/conversations/')
+
+        self.assertEqual(
+            sorted(c['unread_count'] for c in response.data['results']), [0, 1, 1, 1]
+        )
+        read_state_queries = [
+            q for q in queries.captured_queries
+            if 'chats_conversationreadstate' in q['sql']
+        ]
+        self.assertEqual(len(read_state_queries), 1)
+
+
+class InboxTests(ChatsTestCase):
+    url = '/api/conversations/inbox/'
+
+    def test_inbox_shows_last_message_preview_and_unread_count(self):
+        self.create_messages(2, sender=self.bob)
+        latest = Message.objects.create(
+            conversation_id=self.conversation,
+            sender=self.bob,
+            message_body='x' * 300
+        )
+
+        response = self.client.get(self.url)
+
+        summary = response.data['results'][0]
+        self.assertNotIn('messages', summary)
+        self.assertEqual(summary['last_message']['message_id'], latest.message_id)
+        self.assertEqual(len(summary['last_message']['preview']), 100)
+        self.assertEqual(summary['unread_count'], 3)
+        self.assertEqual(len(summary['participants']), 2)
+
+    def test_inbox_orders_by_latest_activity(self):
+        quiet = Conversation.objects.create()
+        quiet.participants.set([self.alice, self.bob])
+        self.create_messages(1)
+
+        response = self.client.get(self.url)
+
+        ids = [c['conversation_id'] for c in response.data['results']]
+        self.assertEqual(ids, [str(quiet.conversation_id), str(self.conversation.conversation_id)])
+        self.assertIsNone(response.data['results'][0]['last_message'])
+
+    def test_new_messages_advance_the_last_message_pointer(self):
+        first = Message.objects.create(
+            conversation_id=self.conversation, sender=self.bob, message_body='First'
+        )
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message_id, first.message_id)
+        self.assertEqual(self.conversation.last_message_at, first.sent_at)
+
+        # An older message arriving late does not move the pointer back
+        late = Message(
+            conversation_id=self.conversation, sender=self.bob, message_body='Late',
+            sent_at=first.sent_at - timedelta(minutes=1)
+        )
+        self.assertEqual(inbox.record_last_message(self.conversation.pk, late), 0)
+
+    def test_bulk_import_and_delete_maintain_the_pointer(self):
+        response = self.client.post('/api/messages/bulk/', {
+            'conversation_id': str(self.conversation.conversation_id),
+            'messages': [{'message_body': f'Imported {i}'} for i in range(3)],
+        }, format='json')
+        newest = Message.objects.order_by('-sent_at', '-message_id').first()
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message_id, newest.message_id)
+
+        self.client.delete(f'/api/messages/{newest.message_id}/')
+
+        previous = Message.objects.order_by('-sent_at', '-message_id').first()
+        self.conversation.refresh_from_db()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.conversation.last_message_id, previous.message_id)
+        self.assertEqual(self.conversation.last_message_at, previous.sent_at)
+
+    def test_inbox_query_count_does_not_depend_on_history(self):
+        self.create_messages(1)
+        with CaptureQueriesContext(connection) as short_history:
+            self.client.get(self.url)
+
+        self.create_messages(30)
+        with CaptureQueriesContext(connection) as long_history:
+            self.client.get(self.url)
+
+        self.assertEqual(len(long_history), len(short_history))
+
+    @patch.object(ConversationListSerializer, 'message_limit', 3)
+    def test_conversation_list_nests_only_the_latest_messages(self):
+        messages = self.create_messages(5)
+        quiet = Conversation.objects.create()
+        quiet.participants.set([self.alice, self.bob])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/conversations/')
+
+        by_id = {c['conversation_id']: c for c in response.data['results']}
+        busy = by_id[str(self.conversation.conversation_id)]
+        self.assertEqual(
+            [m['message_id'] for m in busy['messages']],
+            [str(m.message_id) for m in messages[2:]]
+        )
+        self.assertTrue(busy['has_more_messages'])
+        self.assertEqual(by_id[str(quiet.conversation_id)]['messages'], [])
+        self.assertFalse(by_id[str(quiet.conversation_id)]['has_more_messages'])
+        message_queries = [
+            q for q in queries.captured_queries if '"chats_message"."message_body"' in q['sql']
+        ]
+        self.assertEqual(len(message_queries), 1)
+
+
+class MessageVisibilityTests(ChatsTestCase):
+    def test_lists_conversation_messages_and_own_messages_once(self):
+        other = Conversation.objects.create()
+        other.participants.set([self.bob, self.create_user('carol')])
+        Message.objects.create(conversation_id=other, sender=self.bob, message_body='Hidden')
+        # Sent by alice into a conversation she has since left
+        Message.objects.create(conversation_id=other, sender=self.alice, message_body='Mine')
+        self.create_messages(2)
+        self.create_messages(1, sender=self.alice)
+
+        response = self.client.get('/api/messages/')
+
+        bodies = sorted(m['message_body'] for m in response.data['results'])
+        self.assertEqual(bodies, ['Message 0', 'Message 0', 'Message 1', 'Mine'])
+        self.assertEqual(response.data['count'], 4)
+
+
+class CountlessPaginationTests(ChatsTestCase):
+    def test_count_false_skips_count_query(self):
+        self.create_messages(5)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/messages/?count=false&page_size=2')
+
+        self.assertIsNone(response.data['count'])
+        self.assertEqual(len(response.data['results']), 2)
+        # The paginator's COUNT(*); the ETag validators' aggregate is allowed
+        self.assertFalse(any('AS "__count"' in q['sql'] for q in queries.captured_queries))
+
+        last = self.client.get(self.client.get(response.data['next']).data['next'])
+        self.assertEqual(len(last.data['results']), 1)
+        self.assertIsNone(last.data['next'])
+        self.assertIn('page=2', last.data['previous'])
+
+    def test_count_estimate_is_capped(self):
+        self.create_messages(5)
+
+        with patch.object(StandardResultsSetPagination, 'count_estimate_cap', 3):
+            capped = self.client.get('/api/messages/?count=estimate&page_size=2')
+        exact = self.client.get('/api/messages/?count=estimate&page_size=2')
+
+        self.assertEqual((capped.data['count'], capped.data['count_is_exact']), (3, False))
+        self.assertEqual((exact.data['count'], exact.data['count_is_exact']), (5, True))
+
+    def test_page_out_of_range_is_404(self):
+        self.create_messages(1)
+        response = self.client.get('/api/messages/?count=false&page=3')
+        self.assertEqual(response.status_code, 404)
+
+
+class SideloadedSenderTests(ChatsTestCase):
+    def test_sideload_replaces_nested_senders_with_users_map(self):
+        self.create_messages(3, sender=self.bob)
+        self.create_messages(2, sender=self.alice)
+
+        response = self.client.get('/api/messages/?sideload=users')
+
+        results = response.data['results']
+        self.assertEqual(len(results), 5)
+        self.assertNotIn('sender', results[0])
+        self.assertEqual(
+            set(response.data['users']), {str(self.alice.user_id), str(self.bob.user_id)}
+        )
+        bob = response.data['users'][str(self.bob.user_id)]
+        self.assertEqual(bob['full_name'], 'Bob Jones')
+        self.assertIn(str(self.bob.user_id), {str(m['sender_id']) for m in results})
+
+    def test_sideload_works_with_cursor_pagination(self):
+        self.create_messages(3)
+        url = (f'/api/conversations/{self.conversation.conversation_id}'
+               '/messages/?sideload=users&pagination=cursor&page_size=2')
+
+        response = self.client.get(url)
+
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(list(response.data['users']), [str(self.bob.user_id)])
+        self.assertIn('sideload=users', response.data['next'])
+
+    def test_default_representation_still_nests_sender(self):
+        self.create_messages(1)
+        response = self.client.get('/api/messages/')
+        self.assertEqual(response.data['results'][0]['sender']['email'], 'bob@example.com')
+
+
+class FastSerializationTests(ChatsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bob.phone_number = None
+        self.bob.save()
+        self.create_messages(3, sender=self.bob)
+        self.create_messages(2, sender=self.alice)
+        Message.objects.create(
+            conversation_id=self.conversation,
+            sender=self.alice,
+            message_body='Caf\u00e9 \u2603 line\u2028separator "quoted"'
+        )
+        self.queryset = Message.objects.order_by('sent_at', 'message_id')
+
+    def assertSameJSON(self, compact):
+        serializer_class = CompactMessageSerializer if compact else MessageSerializer
+        expected = JSONRenderer().render(
+            serializer_class(list(self.queryset), many=True).data
+        )
+        rows = MessageRows(compact=compact)
+        fast = rows.build(rows.prepare(self.queryset))
+
+        self.assertEqual(JSONRenderer().render(fast), expected)
+        self.assertEqual(FastJSONRenderer().render(fast), expected)
+
+    def test_nested_rows_match_message_serializer(self):
+        self.assertSameJSON(compact=False)
+
+    @skipUnless(orjson, 'orjson is not installed')
+    def test_floats_keep_their_value_not_their_spelling(self):
+        values = [0.1, 1.5, 1e16, 1e-7, 2.5e-05, 123456789012345.6]
+
+        rendered = FastJSONRenderer().render({'values': values})
+
+        self.assertEqual(json.loads(rendered), {'values': values})
+        self.assertEqual(FastJSONRenderer().render([1e-7]), b'[1e-7]')
+        self.assertEqual(JSONRenderer().render([1e-7]), b'[1e-07]')
+        # Non-finite floats are not rejected as JSONRenderer does
+        self.assertEqual(FastJSONRenderer().render([float('nan')]), b'[null]')
+        with self.assertRaises(ValueError):
+            JSONRenderer().render([float('nan')])
+
+    def test_compact_rows_match_compact_serializer(self):
+        self.assertSameJSON(compact=True)
+
+    def test_list_endpoints_match_drf_path(self):
+        urls = [
+            '/api/messages/',
+            '/api/messages/?sideload=users',
+            f'/api/conversations/{self.conversation.conversation_id}/messages/?pagination=cursor',
+        ]
+        for url in urls:
+            fast = self.client.get(url).content
+            with patch.object(MessageListMixin, 'fast_list_serialization', False):
+                slow = self.client.get(url).content
+            self.assertEqual(fast, slow, url)
+
+
+class PopulatedChatsTestCase(ChatsTestCase):
+    """
+    Three conversations with many messages from three senders, so N+1
+    patterns and missing indexes show up instead of hiding behind a tiny
+    dataset.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.carol = self.create_user('carol')
+        self.conversation.participants.add(self.carol)
+        for _ in range(2):
+            conversation = Conversation.objects.create()
+            conversation.participants.set([self.alice, self.bob, self.carol])
+        for conversation in Conversation.objects.all():
+            for i in range(15):
+                Message.objects.create(
+                    conversation_id=conversation,
+                    sender=[self.alice, self.bob, self.carol][i % 3],
+                    message_body=f'Message {i}'
+                )
+        self.message = Message.objects.filter(conversation_id=self.conversation).first()
+
+
+@override_settings(CHATS_QUERY_INSTRUMENTATION=True)
+class QueryBudgetTests(PopulatedChatsTestCase):
+    """Fails when an endpoint runs more SQL than its budget allows"""
+    # Maximum queries per '<ViewSet>.<action>' on the fixture below. None
+    # may depend on how many messages there are (see
+    # test_query_counts_do_not_grow_with_history). Lower a budget whenever an
+    # endpoint gets cheaper; never raise one without understanding where
+    # the extra queries come from.
+    QUERY_BUDGETS = {
+        # Cold profile cache: page of IDs, then the missing profiles
+        'UserViewSet.list': 3,
+        'UserViewSet.retrieve': 1,
+        # Count, page, prefetched participants and latest messages; ETag
+        # keys are columns of the page query
+        'ConversationViewSet.list': 4,
+        # Page row, participants, messages with their senders
+        'ConversationViewSet.retrieve': 3,
+        'ConversationViewSet.inbox': 3,
+        'ConversationViewSet.sync': 4,
+        'ConversationViewSet.list_messages': 3,
+        'ConversationViewSet.list_messages (sideload)': 4,
+        'MessageViewSet.list': 2,
+        'MessageViewSet.list (sideload)': 3,
+        'MessageViewSet.list (count=false)': 1,
+        'MessageViewSet.retrieve': 2,
+        # Participant lookup, insert, read states, participant key, then
+        # the new, empty conversation rendered in full
+        'ConversationViewSet.create': 14,
+        # Participant lookup and key, then the existing direct conversation
+        # as listed: row, participants, latest messages
+        'ConversationViewSet.create (existing)': 5,
+        # Membership, serializer lookups, insert, read states and inbox
+        # pointer in a savepoint
+        'MessageViewSet.create': 8,
+        # The same bookkeeping once per batch, not per message
+        'MessageViewSet.bulk_create': 5,
+        'MessageViewSet.mark_as_read': 5,
+        'MessageViewSet.read_receipt': 4,
+        'MessageViewSet.mark_conversation_read': 2,
+    }
+
+    def assertWithinBudget(self, url, variant='', data=None, status=200):
+        if data is None:
+            response = self.client.get(url)
+        else:
+            response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status)
+        stats = response.query_stats
+        label = f'{stats.label} ({variant})' if variant else stats.label
+        budget = self.QUERY_BUDGETS[label]
+        self.assertLessEqual(
+            stats.count, budget,
+            f'{label} ran {stats.count} queries (budget {budget}); '
+            f'repeated: {stats.duplicates}'
+        )
+        return response
+
+    def test_user_endpoints(self):
+        self.assertWithinBudget('/api/users/')
+        self.assertWithinBudget(f'/api/users/{self.bob.user_id}/')
+
+    def test_conversation_endpoints(self):
+        conversation_id = self.conversation.conversation_id
+        self.assertWithinBudget('/api/conversations/')
+        self.assertWithinBudget(f'/api/conversations/{conversation_id}/')
+        self.assertWithinBudget('/api/conversations/inbox/')
+        self.assertWithinBudget('/api/conversations/sync/')
+        self.assertWithinBudget(f'/api/conversations/{conversation_id}/messages/')
+        self.assertWithinBudget(
+            f'/api/conversations/{conversation_id}/messages/?sideload=users', 'sideload'
+        )
+
+    def test_message_endpoints(self):
+        self.assertWithinBudget('/api/messages/')
+        self.assertWithinBudget('/api/messages/?sideload=users', 'sideload')
+        self.assertWithinBudget('/api/messages/?count=false', 'count=false')
+        self.assertWithinBudget(f'/api/messages/{self.message.message_id}/')
+
+    def test_write_endpoints(self):
+        conversation_id = str(self.conversation.conversation_id)
+        received = Message.objects.filter(
+            conversation_id=self.conversation
+        ).exclude(sender=self.alice).last()
+
+        self.assertWithinBudget(
+            '/api/conversations/',
+            data={'participant_ids': [str(self.bob.pk), str(self.carol.pk)]}, status=201
+        )
+        self.assertWithinBudget(
+            '/api/messages/',
+            data={'conversation_id': conversation_id, 'message_body': 'Hi'}, status=201
+        )
+        self.assertWithinBudget(
+            '/api/messages/bulk/',
+            data={
+                'conversation_id': conversation_id,
+                'messages': [{'message_body': f'Imported {i}'} for i in range(20)],
+            },
+            status=201
+        )
+        self.assertWithinBudget(f'/api/messages/{received.message_id}/mark-read/', data={})
+        self.assertWithinBudget('/api/messages/read-receipt/', data={
+            'conversation_id': conversation_id, 'message_id': str(received.message_id),
+        })
+        self.assertWithinBudget(
+            '/api/messages/mark-conversation-read/', data={'conversation_id': conversation_id}
+        )
+
+    def test_existing_direct_conversation_is_within_budget(self):
+        data = {'participant_ids': [str(self.bob.pk)]}
+        self.client.post('/api/conversations/', data, format='json')
+        self.assertWithinBudget('/api/conversations/', 'existing', data=data)
+
+    def test_query_counts_do_not_grow_with_history(self):
+        direct = {'participant_ids': [str(self.bob.pk)]}
+        self.client.post('/api/conversations/', direct, format='json')
+        direct_id = Conversation.objects.get(is_direct=True).pk
+        urls = [
+            '/api/conversations/',
+            f'/api/conversations/{self.conversation.conversation_id}/',
+            '/api/conversations/inbox/',
+            f'/api/conversations/{self.conversation.conversation_id}/messages/',
+            '/api/messages/',
+        ]
+
+        def counts():
+            cache.clear()
+            membership.cache.clear()
+            result = {url: self.client.get(url).query_stats.count for url in urls}
+            response = self.client.post('/api/conversations/', direct, format='json')
+            result['create (existing)'] = response.query_stats.count
+            return result
+
+        before = counts()
+        # Ten times the fixture's 15 messages per conversation
+        senders = [self.alice, self.bob, self.carol]
+        for conversation in Conversation.objects.all():
+            for i in range(135):
+                Message.objects.create(
+                    conversation_id=conversation,
+                    sender=senders[i % 3] if conversation.pk != direct_id else senders[i % 2],
+                    message_body=f'More {i}'
+                )
+
+        self.assertEqual(counts(), before)
+
+
+class MigrationStateTests(TestCase):
+    def test_models_and_migrations_agree(self):
+        call_command('makemigrations', 'chats', '--check', '--dry-run', stdout=StringIO())
+
+    def test_participant_index_is_part_of_migration_state(self):
+        state = MigrationLoader(connection).project_state()
+        indexes = state.models['chats', 'conversationparticipant'].options['indexes']
+        self.assertIn('participant_user_conv_idx', [index.name for index in indexes])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+class QueryPlanTests(PopulatedChatsTestCase):
+    """
+    Runs EXPLAIN QUERY PLAN on every statement an endpoint executes and
+    fails on full scans of the large tables, so index coverage cannot
+    silently regress.
+    """
+    LARGE_TABLES = (
+        'chats_message',
+        'chats_conversation_participants',
+        'chats_conversationreadstate',
+    )
+    FULL_SCAN = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+    def capture(self, method, url, data=None):
+        statements = []
+
+        def collect(execute, sql, params, many, context):
+            statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(collect):
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 400, url)
+        return [
+            (sql, params) for sql, params in statements
+            if sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE'))
+        ]
+
+    def full_scans(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        return [
+            step for step in plan
+            if (match := self.FULL_SCAN.match(step)) and match.group(1) in self.LARGE_TABLES
+        ]
+
+    def assertIndexedPlans(self, method, url, data=None):
+        for sql, params in self.capture(method, url, data):
+            scans = self.full_scans(sql, params)
+            self.assertFalse(scans, f'{method.upper()} {url} scans {scans}:\n{sql}')
+
+    def test_user_endpoints(self):
+        self.assertIndexedPlans('get', '/api/users/')
+        self.assertIndexedPlans('get', f'/api/users/{self.bob.user_id}/')
+
+    def test_conversation_endpoints(self):
+        conversation_id = self.conversation.conversation_id
+        self.assertIndexedPlans('get', '/api/conversations/')
+        self.assertIndexedPlans('get', f'/api/conversations/{conversation_id}/')
+        self.assertIndexedPlans('get', '/api/conversations/inbox/')
+        self.assertIndexedPlans('get', '/api/conversations/sync/')
+        self.assertIndexedPlans(
+            'post', '/api/conversations/direct/', {'user_id': str(self.bob.user_id)}
+        )
+        self.assertIndexedPlans('get', f'/api/conversations/{conversation_id}/messages/')
+        self.assertIndexedPlans(
+            'get', f'/api/conversations/{conversation_id}/messages/?pagination=cursor'
+        )
+
+    def test_message_list_endpoints(self):
+        self.assertIndexedPlans('get', '/api/messages/')
+        self.assertIndexedPlans('get', '/api/messages/?pagination=cursor')
+        self.assertIndexedPlans('get', '/api/messages/search/?q=message')
+
+    def test_message_endpoints(self):
+        received = Message.objects.filter(sender=self.bob).first()
+        self.assertIndexedPlans('get', f'/api/messages/{self.message.message_id}/')
+        self.assertIndexedPlans('post', f'/api/messages/{received.message_id}/mark-read/')
+        self.assertIndexedPlans('post', '/api/messages/read-receipt/', {
+            'conversation_id': str(received.conversation_id_id),
+            'message_id': str(received.message_id),
+        })
+        self.assertIndexedPlans(
+            'post', '/api/messages/mark-conversation-read/',
+            {'conversation_id': str(self.conversation.conversation_id)}
+        )
+
+
+@override_settings(CHATS_QUERY_INSTRUMENTATION=True)
+class InstrumentationTests(ChatsTestCase):
+    def test_record_queries_counts_and_fingerprints(self):
+        with record_queries() as stats:
+            for user in (self.alice, self.bob):
+                list(Message.objects.filter(sender=user))
+
+        self.assertEqual(stats.count, 2)
+        self.assertEqual(stats.duplicate_count, 1)
+        self.assertEqual(list(stats.duplicates.values()), [2])
+
+    def test_headers_are_exposed_in_debug_mode_only(self):
+        response = self.client.get('/api/users/')
+        self.assertNotIn('X-DB-Query-Count', response)
+
+        with self.settings(DEBUG=True):
+            response = self.client.get('/api/users/')
+
+        self.assertEqual(response['X-DB-Query-Count'], str(response.query_stats.count))
+        self.assertIn('X-DB-Time-Ms', response)
+        self.assertIn('X-DB-Duplicate-Queries', response)
+
+    def test_disabled_instrumentation_wraps_no_queries(self):
+        with self.settings(CHATS_QUERY_INSTRUMENTATION=False, DEBUG=True):
+            with patch('chats.instrumentation.record_queries') as record:
+                response = self.client.get('/api/users/')
+
+        record.assert_not_called()
+        self.assertFalse(hasattr(response, 'query_stats'))
+        self.assertNotIn('X-DB-Query-Count', response)
+
+
+class SeedCommandTests(TestCase):
+
+    def seed(self, *args):
+        call_command(
+            'seed_chats', '--users', '30', '--conversations', '40',
+            '--messages', '600', *args, stdout=StringIO()
+        )
+        return (
+            sorted(User.objects.values_list('user_id', flat=True)),
+            sorted(Message.objects.values_list('message_id', 'sender', 'message_body')),
+        )
+
+    def test_same_seed_generates_the_same_dataset(self):
+        first = self.seed()
+        self.assertEqual(self.seed('--clear'), first)
+        self.assertNotEqual(self.seed('--clear', '--seed', '2'), first)
+
+    def test_generated_bookkeeping_matches_the_messages(self):
+        self.seed()
+
+        sizes = Conversation.objects.annotate(n=Count('participants')).values_list('n', flat=True)
+        self.assertTrue(all(2 <= n <= 10 for n in sizes))
+        for conversation in Conversation.objects.exclude(last_message_id=None)[:10]:
+            latest = conversation.messages.order_by('-sent_at').first()
+            self.assertEqual(conversation.last_message_id, latest.pk)
+            self.assertEqual(conversation.last_message_at, latest.sent_at)
+        for state in ConversationReadState.objects.all()[:20]:
+            unread = Message.objects.filter(conversation_id=state.conversation_id).exclude(
+                sender=state.user_id
+            )
+            if state.last_read_at is not None:
+                unread = unread.filter(sent_at__gt=state.last_read_at)
+            self.assertEqual(state.unread_count, unread.count())
+
+    def test_existing_dataset_requires_clear(self):
+        self.seed()
+        with self.assertRaises(CommandError):
+            self.seed()
+
+    def test_messages_may_be_zero_but_not_negative(self):
+        users, messages = self.seed('--messages', '0')
+        self.assertEqual(len(users), 30)
+        self.assertEqual(messages, [])
+
+        with self.assertRaisesMessage(CommandError, '--messages must not be negative'):
+            self.seed('--clear', '--messages', '-1')
+
+
+class LoadGeneratorTests(SimpleTestCase):
+
+    def test_percentile_uses_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(loadgen.percentile(values, 50), 50)
+        self.assertEqual(loadgen.percentile(values, 99), 99)
+        self.assertEqual(loadgen.percentile([7], 95), 7)
+        self.assertIsNone(loadgen.percentile([], 50))
+
+    def test_compare_reports_relative_change(self):
+        def stats(p95, throughput):
+            return {'p50': 1, 'p95': p95, 'p99': p95, 'throughput': throughput}
+
+        baseline = {'endpoints': {'inbox': stats(10, 100)}, 'total': stats(10, 100)}
+        report = {'endpoints': {'inbox': stats(15, 80)}, 'total': stats(10, 100)}
+
+        changes = loadgen.compare(report, baseline)
+
+        self.assertEqual(changes['inbox']['p95'], 0.5)
+        self.assertEqual(changes['inbox']['throughput'], -0.2)
+        self.assertEqual(changes['total']['p95'], 0)
+
+
+class SerialLiveServerThread(LiveServerThread):
+    """
+    Live server handling one request at a time. The in-memory test database
+    is a single connection shared with the server, on which requests in
+    parallel threads would interleave their transactions.
+    """
+
+    def _create_server(self, connections_override=None):
+        # run() already put the shared connections on this thread
+        return WSGIServer(
+            (self.host, self.port), QuietWSGIRequestHandler, allow_reuse_address=False
+        )
+
+
+class LoadTestCommandTests(LiveServerTestCase):
+    server_thread_class = SerialLiveServerThread
+
+    def test_reports_every_endpoint_against_a_live_server(self):
+        call_command(
+            'seed_chats', '--users', '10', '--conversations', '10',
+            '--messages', '100', stdout=StringIO()
+        )
+        with tempfile.NamedTemporaryFile(suffix='.json') as report_file:
+            call_command(
+                'loadtest', '--url', self.live_server_url, '--users', '3',
+                '--concurrency', '2', '--requests', '40',
+                '--json', report_file.name, stdout=StringIO()
+            )
+            report = json.load(report_file)
+
+        self.assertEqual(report['total']['requests'], 40)
+        self.assertEqual(report['total']['errors'], 0)
+        self.assertLessEqual(report['total']['p50'], report['total']['p99'])
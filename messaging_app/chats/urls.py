@@ -3,12 +3,13 @@
 from django.urls import path, include
 from rest_framework import routers
 from rest_framework_nested.routers import NestedDefaultRouter
-from .views import UserViewSet, ConversationViewSet, MessageViewSet
+from .views import UserViewSet, ConversationViewSet, MessageViewSet, conversation_events
 
 # Base router (explicit DefaultRouter)
 base_router = routers.DefaultRouter()
 base_router.register(r'users', UserViewSet, basename='user')
 base_router.register(r'conversations', ConversationViewSet, basename='conversation')
+base_router.register(r'messages', MessageViewSet, basename='message')
 
 # Nested router for messages under conversations
 conversation_router = NestedDefaultRouter(base_router, r'conversations', lookup='conversation')
@@ -18,4 +19,9 @@ conversation_router.register(r'messages', MessageViewSet, basename='conversation
 urlpatterns = [
     path('', include(base_router.urls)),
     path('', include(conversation_router.urls)),
+    path(
+        'conversations/<uuid:conversation_id>/events/',
+        conversation_events,
+        name='conversation-events'
+    ),
 ]
@@ -1,19 +1,91 @@
-from rest_framework import viewsets, permissions, status, filters
+from rest_framework import viewsets, permissions, serializers, status, filters
 from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed, NotFound
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import User, Conversation, Message
+from .models import User, Conversation, ConversationReadState, Message
 from .serializers import (
     UserSerializer,
     ConversationSerializer,
     MessageSerializer,
-    ConversationDetailSerializer
+    ConversationDetailSerializer,
+    ConversationListSerializer,
+    ConversationSummarySerializer,
+    CompactMessageSerializer,
+    BulkMessageSerializer,
+    ReadReceiptSerializer
 )
-from django.db.models import Q
+from .auth import CachedJWTAuthentication
+from .conditional import ConditionalGetMixin, latest
+from .fast_serializers import MessageRows
+from .instrumentation import QueryInstrumentationMixin
+from .pagination import KeysetPaginationMixin, SearchKeysetPagination, StandardResultsSetPagination
+from .presence import PresenceMixin
+from .search import MessageSearch
+from .sync import SyncToken, next_changes, with_change_time
+from . import inbox, membership, participants, presence, profile_cache, read_state, realtime, receipts
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.db.models import Count, F, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Substr
 from django.utils import timezone
 from datetime import timedelta
+import uuid
 
-class UserViewSet(viewsets.ModelViewSet):
+# Server-Sent Events stream tuning (seconds / milliseconds)
+STREAM_KEEPALIVE = 15
+STREAM_RETRY_MS = 3000
+
+class MessageListMixin:
+    """
+    Renders message lists either with a nested sender per message or, with
+    ``?sideload=users``, with sender IDs plus one de-duplicated ``users`` map
+    per page.
+
+    With ``fast_list_serialization`` on, rows are built from ``values_list()``
+    tuples by ``MessageRows`` instead of going through the DRF serializers;
+    the JSON output is identical.
+    """
+    sideload_query_param = 'sideload'
+    fast_list_serialization = True
+
+    def sideload_requested(self):
+        return self.request.query_params.get(self.sideload_query_param) == 'users'
+
+    def message_list_response(self, queryset, extra_columns=()):
+        compact = self.sideload_requested()
+        context = self.get_serializer_context()
+
+        if self.fast_list_serialization:
+            rows = MessageRows(compact=compact, extra_columns=extra_columns)
+            queryset = rows.prepare(queryset)
+            page = self.paginate_queryset(queryset)
+            messages = page if page is not None else list(queryset)
+            data = rows.build(messages)
+        else:
+            if not compact:
+                queryset = queryset.select_related('sender')
+            page = self.paginate_queryset(queryset)
+            messages = page if page is not None else list(queryset)
+            serializer_class = CompactMessageSerializer if compact else MessageSerializer
+            data = serializer_class(messages, many=True, context=context).data
+
+        if page is not None:
+            response = self.get_paginated_response(data)
+        elif compact:
+            response = Response({'results': data})
+        else:
+            return Response(data)
+
+        if compact:
+            response.data['users'] = CompactMessageSerializer.sideload_users(
+                messages, context=context
+            )
+        return response
+
+class UserViewSet(QueryInstrumentationMixin, PresenceMixin, viewsets.ModelViewSet):
     """Viewset for user management with filtering"""
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -33,14 +105,85 @@ class UserViewSet(viewsets.ModelViewSet):
 
     def get_object(self):
         if self.kwargs.get('user_id') == 'me':
-            return self.request.user
+            # Not request.user: authentication may have come from a cache, and
+            # saving a stale copy would write its old columns back
+            user = User.objects.get(pk=self.request.user.pk)
+            self.check_object_permissions(self.request, user)
+            return user
         return super().get_object()
 
-class ConversationViewSet(viewsets.ModelViewSet):
+    # Served from presence.states, not from the profile cache
+    presence_fields = ('online_status', 'last_activity')
+
+    def cacheable_profile(self, user):
+        data = self.get_serializer(user).data
+        return {key: value for key, value in data.items() if key not in self.presence_fields}
+
+    def load_profiles(self, user_ids):
+        """Serialize the given users for the profile cache"""
+        users = User.objects.filter(user_id__in=user_ids)
+        return {user.pk: self.cacheable_profile(user) for user in users}
+
+    def with_presence(self, profiles, stored):
+        """Cached profiles plus presence from ``(user_id, last_activity)`` pairs"""
+        states = presence.states(stored)
+        as_iso = serializers.DateTimeField().to_representation
+        results = []
+        for profile in profiles:
+            state = states[uuid.UUID(profile['user_id'])]
+            results.append({
+                **profile,
+                'online_status': state['online'],
+                'last_activity': as_iso(state['last_activity']) if state['last_activity'] else None,
+            })
+        return results
+
+    def list(self, request, *args, **kwargs):
+        # Only the page's IDs and activity come from the database; profiles come from the cache
+        queryset = self.filter_queryset(self.get_queryset()).values_list('user_id', 'last_activity')
+        page = self.paginate_queryset(queryset)
+        rows = list(page if page is not None else queryset)
+        profiles = profile_cache.get_many([user_id for user_id, _ in rows], self.load_profiles)
+        data = self.with_presence(profiles, rows)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = self.kwargs.get('user_id')
+        try:
+            user_id = request.user.pk if lookup == 'me' else uuid.UUID(lookup)
+        except ValueError:
+            return super().retrieve(request, *args, **kwargs)
+
+        stored = []
+
+        def load(missing):
+            instance = self.get_object()
+            stored.append((instance.pk, instance.last_activity))
+            return {instance.pk: self.cacheable_profile(instance)}
+
+        profile = profile_cache.get_many([user_id], load)[0]
+        if not stored:
+            stored = User.objects.filter(pk=user_id).values_list('pk', 'last_activity')
+        return Response(self.with_presence([profile], stored)[0])
+
+class ConversationViewSet(QueryInstrumentationMixin, PresenceMixin, ConditionalGetMixin, KeysetPaginationMixin, MessageListMixin, viewsets.ModelViewSet):
     """Viewset for conversation management with advanced filtering"""
     serializer_class = ConversationSerializer
     permission_classes = [permissions.IsAuthenticated]
     lookup_field = 'conversation_id'
+    pagination_class = StandardResultsSetPagination
+
+    # ?pagination=cursor on the messages action pages by (sent_at, message_id)
+    keyset_actions = ('list_messages',)
+    keyset_ordering = ('sent_at', 'message_id')
+
+    # Characters of the latest message shown in the inbox
+    inbox_preview_length = 100
+
+    # Conversations and messages per change stream in one sync response
+    sync_page_size = 500
     
     # Add comprehensive filtering
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -52,9 +195,28 @@ class ConversationViewSet(viewsets.ModelViewSet):
     ordering_fields = ['created_at', 'updated_at']
     ordering = ['-updated_at']
 
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Unread counts below must reflect the user's own buffered receipts
+        receipts.buffer.flush(user_id=request.user.pk)
+
     def get_queryset(self):
         user = self.request.user
-        queryset = Conversation.objects.filter(participants=user).order_by('-updated_at')
+        queryset = Conversation.objects.filter(participants=user).annotate(
+            viewer_unread_count=read_state.unread_count_subquery(user)
+        ).order_by('-updated_at')
+
+        if self.action in ('list', 'retrieve'):
+            queryset = self.with_validator_keys(queryset)
+        if self.action == 'list':
+            queryset = self.with_recent_messages(queryset)
+        elif self.action == 'retrieve':
+            # Every message with its sender in one query, however long the
+            # history is
+            queryset = queryset.prefetch_related(
+                'participants',
+                Prefetch('messages', queryset=Message.objects.select_related('sender')),
+            )
         
         # Additional filtering for participants
         participant_ids = self.request.query_params.getlist('participants')
@@ -66,18 +228,206 @@ class ConversationViewSet(viewsets.ModelViewSet):
         return queryset
 
     def get_serializer_class(self):
-        if self.action in ['retrieve', 'list']:
+        if self.action == 'list':
+            return ConversationListSerializer
+        if self.action == 'retrieve':
             return ConversationDetailSerializer
+        if self.action in ['inbox', 'sync', 'direct']:
+            return ConversationSummarySerializer
         return ConversationSerializer
 
+    def list(self, request, *args, **kwargs):
+        return self.respond_conditionally(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.respond_conditionally(super().retrieve, request, *args, **kwargs)
+
+    def with_recent_messages(self, queryset):
+        """
+        Prefetch what ``ConversationListSerializer`` nests: one query for
+        the latest messages of every conversation in ``queryset``
+        """
+        limit = ConversationListSerializer.message_limit
+        recent = Message.objects.select_related('sender').order_by(
+            '-sent_at', '-message_id'
+        )[:limit + 1]
+        return queryset.prefetch_related(
+            'participants',
+            Prefetch('messages', queryset=recent, to_attr='recent_messages'),
+        )
+
+    def with_validator_keys(self, queryset):
+        """
+        Annotate the newest change to each conversation's messages,
+        participants and the viewer's read state. Each is one index seek
+        per conversation on the page. Deleting a message touches
+        ``updated_at``, and new messages move ``last_message_id``.
+
+        Participants are rendered with their presence, which presence
+        flushes write without touching ``updated_at``: the newest
+        ``last_activity`` and the number of participants online cover it.
+        """
+        def newest(model, field='updated_at', **filters):
+            return Subquery(
+                model.objects.filter(**filters).order_by(F(field).desc(nulls_last=True))
+                .values(field)[:1]
+            )
+
+        participants = User.objects.filter(conversations=OuterRef('pk'))
+        return queryset.annotate(
+            messages_changed=newest(Message, conversation_id=OuterRef('pk')),
+            participants_changed=newest(User, conversations=OuterRef('pk')),
+            participants_active=newest(User, 'last_activity', conversations=OuterRef('pk')),
+            participants_online=Subquery(
+                participants.filter(online_status=True).order_by()
+                .values('conversations').annotate(online=Count('pk')).values('online')
+            ),
+            viewer_read_changed=newest(
+                ConversationReadState, conversation=OuterRef('pk'), user=self.request.user
+            ),
+        )
+
+    def get_validator_queryset(self):
+        return self.filter_queryset(self.get_queryset()).prefetch_related(None).values_list(
+            'conversation_id', 'updated_at', 'last_message_id', 'viewer_unread_count',
+            'messages_changed', 'participants_changed', 'participants_active',
+            'participants_online', 'viewer_read_changed', named=True
+        )
+
+    def row_validators(self, row):
+        timestamps = (
+            row.updated_at, row.messages_changed, row.participants_changed,
+            row.participants_active, row.viewer_read_changed,
+        )
+        key = (
+            row.conversation_id, row.last_message_id, row.viewer_unread_count,
+            row.participants_online,
+        ) + timestamps
+        return key, latest(*timestamps)
+
+    def get_inbox_queryset(self):
+        """
+        Conversations with a preview of their latest message, newest
+        activity first. Ordering reads the denormalized ``last_message_at``;
+        the preview is looked up by primary key.
+        """
+        latest = Message.objects.filter(message_id=OuterRef('last_message_id'))
+
+        return self.filter_queryset(self.get_queryset()).annotate(
+            last_message_sender_id=Subquery(latest.values('sender_id')[:1]),
+            last_message_preview=Subquery(
+                latest.annotate(
+                    preview=Substr('message_body', 1, self.inbox_preview_length)
+                ).values('preview')[:1]
+            ),
+        ).prefetch_related(
+            Prefetch('participants', queryset=User.objects.order_by('first_name'))
+        ).order_by('-last_message_at', '-conversation_id')
+
+    @action(detail=False, methods=['get'], url_path='inbox')
+    def inbox(self, request):
+        """Inbox summary whose cost depends on page size, not history length"""
+        queryset = self.get_inbox_queryset()
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'], url_path='presence')
+    def participant_presence(self, request, conversation_id=None):
+        """Online status of every participant, without loading the conversation"""
+        try:
+            allowed = membership.is_participant(request.user, conversation_id, request)
+        except ValueError:
+            allowed = False
+        if not allowed:
+            raise NotFound()
+
+        participants = Conversation.participants.through.objects.filter(
+            conversation_id=conversation_id
+        ).values('user_id')
+        as_iso = serializers.DateTimeField().to_representation
+        return Response({
+            str(user_id): {
+                'online': state['online'],
+                'last_activity': as_iso(state['last_activity']) if state['last_activity'] else None,
+            }
+            for user_id, state in presence.lookup(participants).items()
+        })
+
+    @action(detail=False, methods=['get'], url_path='sync')
+    def sync(self, request):
+        """
+        Conversations and messages changed since ``?since=<sync_token>``.
+
+        Conversations use the inbox representation; messages are compact,
+        with their senders in ``users``. Call again with the returned
+        ``sync_token`` while ``has_more`` is true.
+        """
+        token = SyncToken.decode(request.query_params.get('since'))
+        limit = self.sync_page_size
+
+        conversations, more_conversations, token.conversations = next_changes(
+            with_change_time(self.get_inbox_queryset(), request.user),
+            'changed_at', 'conversation_id', token.conversations, limit
+        )
+
+        rows = MessageRows(compact=True, extra_columns=('updated_at',))
+        messages, more_messages, token.messages = next_changes(
+            rows.prepare(membership.visible_messages(request.user)),
+            'updated_at', 'message_id', token.messages, limit
+        )
+
+        context = self.get_serializer_context()
+        return Response({
+            'conversations': self.get_serializer(conversations, many=True).data,
+            'messages': rows.build(messages),
+            'users': CompactMessageSerializer.sideload_users(messages, context=context),
+            'sync_token': token.encode(),
+            'has_more': more_conversations or more_messages,
+        })
+
     def create(self, request, *args, **kwargs):
-        if 'participants' not in request.data:
-            request.data['participants'] = []
+        participant_ids = [str(uid) for uid in request.data.get('participant_ids', [])]
+        if str(request.user.user_id) not in participant_ids:
+            participant_ids.append(str(request.user.user_id))
+        request.data['participant_ids'] = participant_ids
         
-        if request.user.user_id not in [str(uid) for uid in request.data['participants']]:
-            request.data['participants'].append(str(request.user.user_id))
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        if serializer.created:
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        # Two participants resolved to their existing direct conversation:
+        # render it as the list does, nesting only its latest messages
+        existing = self.with_recent_messages(self.get_queryset()).get(pk=serializer.instance.pk)
+        return Response(
+            ConversationListSerializer(existing, context=self.get_serializer_context()).data
+        )
+
+    @action(detail=False, methods=['post'], url_path='direct')
+    def direct(self, request):
+        """Get or create the one-to-one conversation with ``user_id``"""
+        try:
+            other = User.objects.filter(user_id=request.data.get('user_id')).first()
+        except DjangoValidationError:
+            other = None
+        if other is None or other.pk == request.user.pk:
+            return Response(
+                {'user_id': 'Invalid user ID'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        return super().create(request, *args, **kwargs)
+        conversation, created = participants.get_or_create_direct(request.user, other)
+        summary = self.get_inbox_queryset().get(conversation_id=conversation.conversation_id)
+        return Response(
+            self.get_serializer(summary).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
 
     @action(detail=True, methods=['get'], url_path='messages')
     def list_messages(self, request, conversation_id=None):
@@ -93,19 +443,21 @@ class ConversationViewSet(viewsets.ModelViewSet):
         if sender_id:
             messages = messages.filter(sender__user_id=sender_id)
             
-        page = self.paginate_queryset(messages)
-        if page is not None:
-            serializer = MessageSerializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        return self.message_list_response(messages)
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(QueryInstrumentationMixin, PresenceMixin, ConditionalGetMixin, KeysetPaginationMixin, MessageListMixin, viewsets.ModelViewSet):
     """Viewset for message management with advanced filtering"""
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
     lookup_field = 'message_id'
+    pagination_class = StandardResultsSetPagination
+
+    # ?pagination=cursor pages newest-first by (sent_at, message_id)
+    keyset_actions = ('list',)
+    keyset_ordering = ('-sent_at', '-message_id')
+
+    # Rows per INSERT statement in the bulk import endpoint
+    bulk_batch_size = 500
     
     # Add comprehensive filtering
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -113,16 +465,31 @@ class MessageViewSet(viewsets.ModelViewSet):
         'sent_at': ['gte', 'lte', 'exact'],
         'is_read': ['exact'],
     }
-    search_fields = ['content', 'sender__username']
+    search_fields = ['message_body', 'sender__username']
     ordering_fields = ['sent_at']
     ordering = ['-sent_at']
 
+    # Columns the validators read; get_queryset annotates the sender ones
+    validator_columns = ('updated_at', 'sender_changed', 'sender_active', 'sender_online')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Reads reflect the user's own buffered receipts; writes don't
+        # flush, or every receipt would write the one queued before it
+        if request.method in permissions.SAFE_METHODS:
+            receipts.buffer.flush(user_id=request.user.pk)
+
     def get_queryset(self):
-        user = self.request.user
-        queryset = Message.objects.filter(
-            Q(conversation_id__participants=user) | 
-            Q(sender=user)
-        ).distinct().order_by('-sent_at')
+        queryset = membership.visible_messages(self.request.user).order_by('-sent_at')
+        if self.action in ('list', 'retrieve'):
+            # Validator keys: senders are rendered with every message,
+            # including their presence, which flushes write without
+            # touching updated_at
+            queryset = queryset.annotate(
+                sender_changed=F('sender__updated_at'),
+                sender_active=F('sender__last_activity'),
+                sender_online=F('sender__online_status'),
+            )
         
         # Additional filtering parameters
         conversation_id = self.request.query_params.get('conversation')
@@ -144,13 +511,63 @@ class MessageViewSet(viewsets.ModelViewSet):
             
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        return self.respond_conditionally(self.list_messages, request, *args, **kwargs)
+
+    def list_messages(self, request, *args, **kwargs):
+        return self.message_list_response(
+            self.filter_queryset(self.get_queryset()),
+            extra_columns=self.validator_columns
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.respond_conditionally(super().retrieve, request, *args, **kwargs)
+
+    def get_validator_queryset(self):
+        return self.filter_queryset(self.get_queryset()).values_list(
+            'message_id', 'sent_at', *self.validator_columns, named=True
+        )
+
+    def row_validators(self, row):
+        return (
+            (row.message_id, row.updated_at, row.sender_changed,
+             row.sender_active, row.sender_online),
+            latest(row.updated_at, row.sender_changed, row.sender_active),
+        )
+
     def create(self, request, *args, **kwargs):
-        request.data['sender'] = str(request.user.user_id)
+        request.data['sender_id'] = str(request.user.user_id)
         
         if 'is_read' not in request.data:
             request.data['is_read'] = False
         
-        conversation_id = request.data.get('conversation_id')
+        error = self.check_conversation_access(request, request.data.get('conversation_id'))
+        if error is not None:
+            return error
+        
+        return super().create(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        # The post_save receivers bump read states and the inbox pointer;
+        # they must commit or roll back together with the insert
+        with transaction.atomic():
+            super().perform_create(serializer)
+
+    def perform_destroy(self, instance):
+        # delete() clears the instance's pk
+        message_id, conversation_id = instance.pk, instance.conversation_id_id
+        with transaction.atomic():
+            super().perform_destroy(instance)
+            if not inbox.refresh_last_message(conversation_id, removed_id=message_id):
+                # Still a change to the conversation, for ETags and sync
+                Conversation.objects.filter(pk=conversation_id).update(updated_at=timezone.now())
+
+    def check_conversation_access(self, request, conversation_id):
+        """
+        Validate ``conversation_id`` from the payload and the user's
+        membership in it. Returns an error response, or None when access is
+        allowed.
+        """
         if not conversation_id:
             return Response(
                 {'conversation_id': 'This field is required'},
@@ -158,27 +575,107 @@ class MessageViewSet(viewsets.ModelViewSet):
             )
         
         try:
-            conversation = Conversation.objects.get(conversation_id=conversation_id)
-            if request.user not in conversation.participants.all():
+            if membership.is_participant(request.user, conversation_id, request):
+                return None
+        except ValueError:
+            pass
+        else:
+            # Only non-members pay for telling "forbidden" from "missing"
+            if Conversation.objects.filter(conversation_id=conversation_id).exists():
                 return Response(
                     {'detail': 'You are not a participant in this conversation'},
                     status=status.HTTP_403_FORBIDDEN
                 )
-        except Conversation.DoesNotExist:
+        return Response(
+            {'conversation_id': 'Invalid conversation ID'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    @action(detail=False, methods=['get'], url_path='search')
+    def search(self, request):
+        """
+        Full-text search in the user's conversations, best match first.
+
+        ``?q=`` holds the words to find; results carry a ``snippet`` with
+        the matches wrapped in ``<mark>``. Paged by cursor on (rank,
+        message_id), without a count; supports ``?sideload=users``.
+        """
+        text = request.query_params.get('q', '').strip()
+        if not text:
             return Response(
-                {'conversation_id': 'Invalid conversation ID'},
+                {'q': 'This field is required'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+
+        paginator = SearchKeysetPagination()
+        hits = paginator.paginate_queryset(MessageSearch(request.user, text), request, view=self)
+
+        compact = self.sideload_requested()
+        rows = MessageRows(compact=compact)
+        found = {
+            row.message_id: row
+            for row in rows.prepare(Message.objects.filter(pk__in=[hit.message_id for hit in hits]))
+        }
+        # Messages deleted since the index was read are dropped
+        hits = [hit for hit in hits if hit.message_id in found]
+        messages = [found[hit.message_id] for hit in hits]
+        data = rows.build(messages)
+        for item, hit in zip(data, hits):
+            item['snippet'] = hit.snippet
+
+        response = paginator.get_paginated_response(data)
+        if compact:
+            response.data['users'] = CompactMessageSerializer.sideload_users(
+                messages, context=self.get_serializer_context()
+            )
+        return response
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_create(self, request):
+        """
+        Import a batch of messages into one conversation: one membership
+        check, one validation pass, bulk inserts in a single transaction.
+        """
+        # Validated first: the body may not even be an object
+        serializer = BulkMessageSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        conversation_id = serializer.validated_data['conversation_id']
+
+        error = self.check_conversation_access(request, conversation_id)
+        if error is not None:
+            return error
         
-        return super().create(request, *args, **kwargs)
+        messages = [
+            Message(
+                conversation_id_id=conversation_id,
+                sender=request.user,
+                message_body=item['message_body']
+            )
+            for item in serializer.validated_data['messages']
+        ]
+        with transaction.atomic():
+            # bulk_create skips post_save, so read states are bumped here once
+            Message.objects.bulk_create(messages, batch_size=self.bulk_batch_size)
+            read_state.record_new_messages(conversation_id, request.user.pk, len(messages))
+            inbox.record_last_of(conversation_id, messages)
+            transaction.on_commit(lambda: realtime.publish_messages(messages))
+        
+        return Response(
+            {
+                'created': len(messages),
+                'message_ids': [str(message.message_id) for message in messages]
+            },
+            status=status.HTTP_201_CREATED
+        )
 
     @action(detail=True, methods=['post'], url_path='mark-read')
     def mark_as_read(self, request, message_id=None):
         message = self.get_object()
         
-        if request.user != message.sender:
+        if request.user.pk != message.sender_id:
             message.is_read = True
-            message.save()
+            message.save(update_fields=['is_read', 'updated_at'])
+            read_state.mark_read_up_to(request.user, message)
             return Response({'status': 'message marked as read'})
         
         return Response(
@@ -186,42 +683,110 @@ class MessageViewSet(viewsets.ModelViewSet):
             status=status.HTTP_403_FORBIDDEN
         )
     
+    @action(detail=False, methods=['post'], url_path='read-receipt')
+    def read_receipt(self, request):
+        """
+        "Read up to ``message_id`` in ``conversation_id``": marks that
+        message and everything before it read. Rapid receipts for the same
+        conversation are coalesced, so this is cheap to call while scrolling.
+        """
+        serializer = ReadReceiptSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        conversation_id = serializer.validated_data['conversation_id']
+        message_id = serializer.validated_data['message_id']
+        error = self.check_conversation_access(request, conversation_id)
+        if error is not None:
+            return error
+
+        read_up_to = Message.objects.filter(
+            message_id=message_id, conversation_id=conversation_id
+        ).values_list('sent_at', flat=True).first()
+        if read_up_to is None:
+            return Response(
+                {'message_id': 'No such message in this conversation'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        outcome = receipts.buffer.submit(request.user.pk, conversation_id, read_up_to)
+        return Response(
+            {
+                'status': outcome,
+                'conversation_id': str(conversation_id),
+                'message_id': str(message_id)
+            },
+            status=status.HTTP_202_ACCEPTED if outcome == receipts.QUEUED else status.HTTP_200_OK
+        )
+
     @action(detail=False, methods=['post'], url_path='mark-conversation-read')
     def mark_conversation_read(self, request):
         """Mark all unread messages in a conversation as read"""
         conversation_id = request.data.get('conversation_id')
-        if not conversation_id:
-            return Response(
-                {'conversation_id': 'This field is required'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        error = self.check_conversation_access(request, conversation_id)
+        if error is not None:
+            return error
+        
+        # Update all unread messages in the conversation
+        updated = Message.objects.filter(
+            conversation_id=conversation_id,
+            is_read=False
+        ).exclude(sender=request.user).update(is_read=True, updated_at=timezone.now())
+        read_state.mark_conversation_read(request.user, conversation_id)
         
+        return Response({
+            'status': f'{updated} messages marked as read',
+            'conversation_id': str(conversation_id)
+        })
+
+async def conversation_events(request, conversation_id):
+    """
+    Server-Sent Events stream of new messages in a conversation.
+
+    Meant to be served through the ASGI application: an idle client costs
+    one held connection and a queue slot instead of a poll every few
+    seconds. Clients resume with ``list_messages`` after a disconnect.
+    """
+    user = await authenticate_stream(request)
+    if user is None:
+        return JsonResponse(
+            {'detail': 'Authentication credentials were not provided.'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    if not await sync_to_async(membership.is_participant)(user, conversation_id):
+        return JsonResponse(
+            {'detail': 'You are not a participant in this conversation'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    subscription = realtime.broker.subscribe(realtime.message_channel(conversation_id))
+
+    async def stream():
         try:
-            conversation = Conversation.objects.get(conversation_id=conversation_id)
-            if request.user not in conversation.participants.all():
-                return Response(
-                    {'detail': 'You are not a participant in this conversation'},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-            
-            # Update all unread messages in the conversation
-            updated = Message.objects.filter(
-                conversation_id=conversation,
-                is_read=False
-            ).exclude(sender=request.user).update(is_read=True)
-            
-            return Response({
-                'status': f'{updated} messages marked as read',
-                'conversation_id': str(conversation_id)
-            })
-            
-        except Conversation.DoesNotExist:
-            return Response(
-                {'conversation_id': 'Invalid conversation ID'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+            yield f'retry: {STREAM_RETRY_MS}\n\n'.encode()
+            while True:
+                # An open stream counts as activity
+                presence.buffer.touch(user.pk)
+                event = await subscription.get(timeout=STREAM_KEEPALIVE)
+                if event is None:
+                    yield b': keepalive\n\n'
+                else:
+                    yield realtime.format_sse(event)
+        except realtime.SubscriptionOverflow:
+            yield realtime.format_sse({'event': 'reset', 'data': ''})
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
-    pagination_class = PageNumberPagination
-    page_size = 20
-    page_size_query_param = 'page_size'
-    max_page_size = 100
+async def authenticate_stream(request):
+    """Resolve the user from a JWT bearer token or the session"""
+    try:
+        result = await sync_to_async(CachedJWTAuthentication().authenticate)(request)
+    except AuthenticationFailed:
+        return None
+    if result is not None:
+        return result[0]
+    user = await request.auser()
+    return user if user.is_authenticated else None
@@ -3,6 +3,10 @@ ASGI config for messaging_app project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with an ASGI server (e.g. ``uvicorn messaging_app.asgi:application``)
+to stream ``/api/conversations/<id>/events/`` without tying up a worker
+thread per connected client.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
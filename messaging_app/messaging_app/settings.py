@@ -85,6 +85,19 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Per-process memory; use a shared backend (Redis, Memcached) when running
+# several processes so profile cache invalidation reaches all of them.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'chats',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -126,10 +139,13 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Custom user model
+AUTH_USER_MODEL = 'chats.User'
+
 # Django REST Framework configuration
 REST_FRAMEWORK = {
    'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'chats.auth.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',  # Optional for browsable API
     ),
     'DEFAULT_PERMISSION_CLASSES': (
@@ -140,10 +156,23 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'chats.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20
 }
 
 SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
+    'USER_ID_FIELD': 'user_id',
 }
+
+# Per-request SQL stats on chats API responses (chats.instrumentation).
+# Wraps every query, so keep it off in production.
+CHATS_QUERY_INSTRUMENTATION = DEBUG
+
+# Write presence and buffered read receipts from background threads
+# (chats.flusher) instead of waiting for more requests
+CHATS_BACKGROUND_FLUSH = True